@@ -9,6 +9,7 @@ from __future__ import print_function
 
 from cruAKtemp.bmi_cruAKtemp import BmiCruAKtempMethod
 from permamodel.components.bmi_frost_number_Geo import BmiFrostnumberGeoMethod
+from permamodel.components.coupler import PipelinedCoupler
 
 # Initial both components with local config files
 cru_config_file = "./cruAKtemp_component.cfg"
@@ -20,37 +21,27 @@ fng = BmiFrostnumberGeoMethod()
 cru.initialize(cru_config_file)
 fng.initialize(fng_config_file)
 
-# Set the initial values of the Jan & Jul air temperature fields
-fng.set_value('atmosphere_bottom_air__temperature_mean_jan',
-    cru.get_value('atmosphere_bottom_air__temperature_mean_jan'))
-
-fng.set_value('atmosphere_bottom_air__temperature_mean_jul',
-    cru.get_value('atmosphere_bottom_air__temperature_mean_jul'))
-
-# Update the 'output' of FNGeo, but don't increment the timestep
-fng.update_frac(0)
-
-# Write out the "answer" for this timestep as a raw binary array
-fn_values = fng.get_value('frostnumber__air')
-fn_values.tofile('fn_air%s.dat' % str(fng._model._date_current.year))
+# cruAKtemp's Jan & Jul air temperature fields are FNGeo's inputs.
+# FNGeo is updated (without incrementing the timestep) once its initial
+# values are set, so the output starts with the initial year's "answer".
+# cruAKtemp reads the temperatures of the next year while FNGeo computes.
+coupler = PipelinedCoupler(
+    [cru, fng],
+    {'atmosphere_bottom_air__temperature_mean_jan':
+     'atmosphere_bottom_air__temperature_mean_jan',
+     'atmosphere_bottom_air__temperature_mean_jul':
+     'atmosphere_bottom_air__temperature_mean_jul'},
+    output_file='fn_air.nc', output_vars=['frostnumber__air'],
+    update_at_start=[fng])
 
 print("Initial values are for year:    %s (%s)" %
-      (str(fng.get_current_time()),  str(fng._model._date_current.year)))
+      (str(fng.get_current_time()), str(fng._model._date_current.year)))
 
 # Loop through the whole model run!
-while fng.get_current_time() < fng.get_end_time():
-
-    cru.update()
-
-    fng.set_value('atmosphere_bottom_air__temperature_mean_jan',
-        cru.get_value('atmosphere_bottom_air__temperature_mean_jan'))
-    fng.set_value('atmosphere_bottom_air__temperature_mean_jul',
-        cru.get_value('atmosphere_bottom_air__temperature_mean_jul'))
-
-    fng.update()
+coupler.run()
 
-    fn_values = fng.get_value('frostnumber__air')
-    fn_values.tofile('fn_air%s.dat' % str(fng._model._date_current.year))
+print("Calculated values up to timestep: %s (%s)" %
+      (str(fng.get_current_time()), str(fng._model._date_current.year)))
 
-    print("Calculated values for timestep: %s (%s)" %
-          (str(fng.get_current_time()), str(fng._model._date_current.year)))
+cru.finalize()
+fng.finalize()
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""  Calibration of Ku model parameters against observed ALT and TTOP
+
+     A whole population of parameter sets is evaluated by one call of
+     the Ku equations:  every input is given a leading "population"
+     axis, so the (element-wise) Ku_method update methods compute all
+     candidates at once.  The optimizer is differential evolution
+     (DE/rand/1/bin); each generation is split in chunks which are
+     evaluated on several processes.
+
+     Usage:
+
+        calibration = KuCalibration('Ku_method_TS.cfg',
+                                    observed_ALT='Barrow_ALT.txt')
+        result = calibration.run(population_size=40, n_generations=100)
+        print result['parameters'], result['cost']
+
+*The MIT License (MIT)*
+
+Copyright (c) 2016 permamodel
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+
+import multiprocessing
+import numpy as np
+from netCDF4 import Dataset
+from permamodel.utils import model_input
+from permamodel.components import Ku_method
+
+# Parameters which can be calibrated, with their default bounds.
+# A calibrated parameter is held constant over the whole run.
+default_bounds = {
+    'vwc_H2O':  (0.05, 0.6),     # soil volumetric water content [m3 m-3]
+    'rho_snow': (100., 500.),    # density of snow [kg m-3]
+    'h_snow':   (0.0, 1.0),      # depth of snow [m]
+    'Hvgf':     (0.0, 1.0),      # height of vegetation, frozen period [m]
+    'Hvgt':     (0.0, 1.0),      # height of vegetation, thawed period [m]
+    'Dvf':      (1.0e-8, 1.0e-5),  # diffusivity of vegetation, frozen [m2 s-1]
+    'Dvt':      (1.0e-9, 1.0e-6)}  # diffusivity of vegetation, thawed [m2 s-1]
+
+# Parameters spanning orders of magnitude are searched in log space
+log_parameters = ['Dvf', 'Dvt']
+
+default_parameters = ['vwc_H2O', 'rho_snow', 'Dvf', 'Dvt']
+
+
+#-------------------------------------------------------------------
+def read_observed_series(file_name):
+
+    #---------------------------------------------------------
+    # Notes: A NetCDF file (e.g. Barrow_ALT.nc) holds the
+    #        series in its data variable, with time first.
+    #        Any other file is a time series with one value
+    #        per line.  Missing values are returned as NaN.
+    #---------------------------------------------------------
+    if file_name.endswith('.nc'):
+        with Dataset(file_name, 'r') as ncid:
+            data_var = None
+            for var in ncid.variables.keys():
+                if (var != 'time' and var[0:3] != 'lat' and var[0:3] != 'lon'):
+                    data_var = var
+            values = ncid.variables[data_var][:]
+        values = np.ma.filled(np.ma.asarray(values, dtype='float64'), np.nan)
+        # (a single site is stored as a 1x1 grid)
+        if (values.ndim == 3) and (values.shape[1:] == (1, 1)):
+            values = values[:, 0, 0]
+        return values
+
+    return np.asarray(model_input.load_time_series(file_name), dtype='float64')
+
+#   read_observed_series()
+#-------------------------------------------------------------------
+def read_site_inputs(cfg_file, n_years=None):
+
+    #---------------------------------------------------------
+    # Notes: Steps the Ku model through its inputs the way
+    #        BmiKuMethod.update() does, and keeps the inputs
+    #        used for each year.  Returns a dict with the
+    #        stacked inputs (time first) and everything else
+    #        evaluate_population() needs.  The cfg file should
+    #        not save output grids.
+    #---------------------------------------------------------
+    model = Ku_method.Ku_method()
+    model.initialize(cfg_file=cfg_file, SILENT=True)
+    if (n_years is None):
+        n_years = int(model.end_year - model.start_year + 1)
+
+    inputs = dict([(var, []) for var in model.input_var_names])
+    model.cont = -1
+    for year in range(n_years):
+        for var in model.input_var_names:
+            # (a copy: the model updates its input arrays in place)
+            value = np.array(np.ma.filled(np.ma.asarray(getattr(model, var),
+                                          dtype='float64'), np.nan))
+            inputs[var].append(value)
+        model.cont = model.cont + 1
+        model.read_input_files()
+    model.close_input_files()
+    model.close_output_files()
+
+    site = {'inputs':        dict([(var, np.array(values))
+                                   for (var, values) in inputs.items()]),
+            'soil':          dict([(var, np.ma.filled(np.ma.asarray(
+                                     getattr(model, var), dtype='float64'),
+                                     np.nan))
+                                   for var in ('p_clay', 'p_sand', 'p_silt',
+                                               'p_peat')]),
+            'thermal_data':  model.thermal_data,
+            'sec_per_year':  model.sec_per_year,
+            'ALT_method':    model.ALT_method,
+            'start_year':    model.start_year,
+            'n_years':       n_years}
+    return site
+
+#   read_site_inputs()
+#-------------------------------------------------------------------
+def evaluate_population(site, parameter_names, population):
+
+    #---------------------------------------------------------
+    # Notes: population has one row per candidate and one
+    #        column per name in parameter_names.  Returns the
+    #        ALT and TTOP of all candidates and years, with
+    #        shape (n_candidates, n_years) + site grid shape.
+    #
+    #        All inputs are broadcast to that full shape and
+    #        set on a bare Ku_method, so update_ALT() selects
+    #        the frozen or thawed properties cell by cell.
+    #        Inputs read as one value per year, such as the
+    #        vegetation of a gridded site, have shape
+    #        (n_years,) and are first given unit grid axes, so
+    #        that they are not aligned with the last grid axis.
+    #---------------------------------------------------------
+    population = np.atleast_2d(np.asarray(population, dtype='float64'))
+    n_candidates = population.shape[0]
+    n_years = site['n_years']
+    grid_shape = np.broadcast(
+        *[np.empty(np.shape(value)[1:], dtype=bool)
+          for value in site['inputs'].values()]).shape
+    shape = (n_candidates, n_years) + grid_shape
+    per_candidate = (n_candidates,) + (1,)*(len(shape) - 1)
+
+    model = Ku_method.Ku_method()
+    model.thermal_data   = site['thermal_data']
+    model.sec_per_year   = site['sec_per_year']
+    model.ALT_method     = site['ALT_method']
+    if (model.ALT_method == 'lookup'):
+        model.ALT_lookup = Ku_method.ALTLookupTable()
+    model.input_versions = {}
+    model.input_refs     = {}
+    model.cache_keys     = {}
+
+    def full(value):
+        return np.array(np.broadcast_to(value, shape), dtype='float64')
+
+    for (var, value) in site['soil'].items():
+        setattr(model, var, full(value))
+    for (var, value) in site['inputs'].items():
+        per_year = np.shape(value)[1:]
+        setattr(model, var, full(np.reshape(
+            value, (1, n_years) + (1,)*(len(grid_shape) - len(per_year)) +
+            per_year)))
+    for (k, var) in enumerate(parameter_names):
+        setattr(model, var, full(np.reshape(population[:, k], per_candidate)))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        model.update_ground_temperatures()
+        model.update_ALT()
+
+    return np.asarray(model.Zal), np.asarray(model.Tps)
+
+#   evaluate_population()
+#-------------------------------------------------------------------
+def _evaluate_chunk(args):
+
+    # (module level, so that it can be sent to worker processes)
+    (site, parameter_names, population) = args
+    return evaluate_population(site, parameter_names, population)
+
+#   _evaluate_chunk()
+#-------------------------------------------------------------------
+def rmse(modeled, observed, missing_value):
+
+    #---------------------------------------------------------
+    # Notes: Root mean square error of each candidate, over
+    #        the years (and cells) with an observation.  NaN
+    #        in the model (no permafrost) counts as
+    #        missing_value, so it is penalized rather than
+    #        ignored.
+    #---------------------------------------------------------
+    modeled = np.where(np.isnan(modeled), missing_value, modeled)
+    has_obs = np.isfinite(observed)
+    error = np.where(has_obs, modeled - np.where(has_obs, observed, 0.0), 0.0)
+    n_obs = np.sum(has_obs)
+    if (n_obs == 0):
+        raise ValueError('No observations to calibrate against')
+    axes = tuple(range(1, error.ndim))
+    return np.sqrt(np.sum(error**2, axis=axes) / n_obs)
+
+#   rmse()
+#-------------------------------------------------------------------
+class KuCalibration(object):
+
+    def __init__(self, cfg_file, observed_ALT=None, observed_TPS=None,
+                 parameters=None, bounds=None, TPS_weight=1.0,
+                 n_processes=1):
+
+        #-----------------------------------------------------
+        # observed_ALT and observed_TPS are file names (see
+        # read_observed_series()) or arrays, with one value
+        # per model year; NaN marks a missing observation.
+        #-----------------------------------------------------
+        if (observed_ALT is None) and (observed_TPS is None):
+            raise ValueError('Need observed ALT and/or TTOP to calibrate')
+
+        if (parameters is None):
+            parameters = default_parameters
+        self.parameters = list(parameters)
+        self.bounds = dict([(name, default_bounds[name])
+                            for name in self.parameters
+                            if name in default_bounds])
+        if (bounds is not None):
+            self.bounds.update(bounds)
+        for name in self.parameters:
+            if name not in self.bounds:
+                raise ValueError('No bounds for parameter %s' % name)
+
+        self.observed_ALT = self.read_observations(observed_ALT)
+        self.observed_TPS = self.read_observations(observed_TPS)
+        self.TPS_weight   = TPS_weight
+        self.n_processes  = n_processes
+
+        n_years = None
+        for observed in (self.observed_ALT, self.observed_TPS):
+            if (observed is not None):
+                n_years = len(observed)
+        self.site = read_site_inputs(cfg_file, n_years)
+
+    def read_observations(self, observed):
+
+        if (observed is None):
+            return None
+        if isinstance(observed, basestring):
+            return read_observed_series(observed)
+        return np.asarray(observed, dtype='float64')
+
+    def to_parameters(self, unit_population):
+
+        #-----------------------------------------------------
+        # Map candidates from the unit cube, where the search
+        # is done, to parameter values
+        #-----------------------------------------------------
+        values = np.empty_like(unit_population)
+        for (k, name) in enumerate(self.parameters):
+            (low, high) = self.bounds[name]
+            if name in log_parameters:
+                (low, high) = (np.log10(low), np.log10(high))
+                values[:, k] = 10.0**(low + (high - low)*unit_population[:, k])
+            else:
+                values[:, k] = low + (high - low)*unit_population[:, k]
+        return values
+
+    def evaluate(self, population, pool=None):
+
+        #-----------------------------------------------------
+        # ALT and TTOP for a population of parameter values,
+        # in chunks on the worker pool if there is one
+        #-----------------------------------------------------
+        if (pool is None):
+            return evaluate_population(self.site, self.parameters, population)
+
+        chunks = [chunk for chunk in
+                  np.array_split(population, self.n_processes) if len(chunk)]
+        results = pool.map(_evaluate_chunk,
+                           [(self.site, self.parameters, chunk)
+                            for chunk in chunks])
+        return (np.concatenate([ALT for (ALT, TPS) in results]),
+                np.concatenate([TPS for (ALT, TPS) in results]))
+
+    def cost(self, population, pool=None):
+
+        (ALT, TPS) = self.evaluate(population, pool)
+        cost = np.zeros(len(population))
+        if (self.observed_ALT is not None):
+            cost += rmse(ALT, self.observed_ALT, 0.0)
+        if (self.observed_TPS is not None):
+            cost += self.TPS_weight * rmse(TPS, self.observed_TPS, 0.0)
+        return cost
+
+    def run(self, population_size=40, n_generations=100, mutation=0.7,
+            crossover=0.9, tolerance=1.0e-6, seed=None):
+
+        #-----------------------------------------------------
+        # Differential evolution (DE/rand/1/bin) in the unit
+        # cube.  Stops after n_generations, or when the spread
+        # of the costs in the population is below tolerance.
+        #-----------------------------------------------------
+        random = np.random.RandomState(seed)
+        n_parameters = len(self.parameters)
+        population_size = max(population_size, 4)
+
+        pool = None
+        if (self.n_processes > 1):
+            pool = multiprocessing.Pool(self.n_processes)
+        try:
+            unit_population = random.uniform(size=(population_size,
+                                                   n_parameters))
+            costs = self.cost(self.to_parameters(unit_population), pool)
+            history = [np.min(costs)]
+
+            for generation in range(n_generations):
+                #---------------------------------------------
+                # Three distinct other members for each one
+                #---------------------------------------------
+                others = np.argsort(random.uniform(
+                    size=(population_size, population_size)), axis=1)
+                others = np.array([row[row != i][:3]
+                                   for (i, row) in enumerate(others)])
+                (a, b, c) = (unit_population[others[:, 0]],
+                             unit_population[others[:, 1]],
+                             unit_population[others[:, 2]])
+                mutant = np.clip(a + mutation*(b - c), 0.0, 1.0)
+
+                cross = random.uniform(size=mutant.shape) < crossover
+                cross[np.arange(population_size),
+                      random.randint(n_parameters, size=population_size)] = True
+                trial = np.where(cross, mutant, unit_population)
+
+                trial_costs = self.cost(self.to_parameters(trial), pool)
+                better = trial_costs <= costs
+                unit_population[better] = trial[better]
+                costs[better] = trial_costs[better]
+                history.append(np.min(costs))
+
+                if (np.max(costs) - np.min(costs) < tolerance):
+                    break
+        finally:
+            if (pool is not None):
+                pool.close()
+                pool.join()
+
+        best = np.argmin(costs)
+        best_values = self.to_parameters(unit_population[best:best+1])[0]
+        return {'parameters': dict(zip(self.parameters, best_values)),
+                'cost':       costs[best],
+                'history':    np.array(history)}
+
+#   KuCalibration
+#-------------------------------------------------------------------
@@ -72,15 +72,245 @@ References:
 """
 
 import os
+import threading
 import numpy as np
 from permamodel.utils import model_input
+from permamodel.utils import model_output
 from permamodel.components import perma_base
 from .. import data_directory
 # from permamodel.tests import examples_directory
 
 
+#-------------------------------------------------------------------
+def analytic_ALT(Ags, Tps_abs, K, C, L, tao):
+
+    #---------------------------------------------------------
+    #       Active layer thickness, for arrays or scalars
+    #       Aps  -- eq-4, Romanovsky et al. 1997
+    #       Zc   -- eq-5, Romanovsky et al. 1997
+    #       Zal  -- eq-3, Romanovsky et al. 1997
+    #---------------------------------------------------------
+    Aps = (Ags - Tps_abs)/np.log((Ags+L/(2.*C)) / \
+                (Tps_abs+L/(2.*C))) - L/(2.*C);
+
+    Zc = (2.*(Ags - Tps_abs)*np.sqrt((K*tao*C)/np.pi)) / \
+                (2.*Aps*C + L);
+
+    Zal = (2.*(Ags - Tps_abs)*np.sqrt(K*tao*C/np.pi) \
+            +(2.*Aps*C*Zc+L*Zc)*L*np.sqrt(K*tao/(np.pi*C)) \
+            /(2.*Aps*C*Zc + L*Zc +(2.*Aps*C+L)*np.sqrt(K*tao/(np.pi*C)))) \
+            /(2.*Aps*C+ L);
+
+    return Aps, Zc, Zal
+
+#   analytic_ALT()
+#-------------------------------------------------------------------
+class ALTLookupTable(object):
+
+    #---------------------------------------------------------
+    # Notes: Approximate analytic_ALT() by interpolation in a
+    #        precomputed table.  The equations can be written
+    #
+    #          Zal = sqrt(K*tao/(pi*C)) * g(x, y),
+    #
+    #        with x = |Tps|/Ags and y = L/(2*C*Ags), since K
+    #        and tao only appear in that square root and the
+    #        rest is unchanged if Ags, |Tps| and L/(2*C) are
+    #        all scaled together.  So a table of g over
+    #        (x, y) covers all five inputs (Ags, |Tps|, K, C,
+    #        L).  The y axis is stored as u = y/(1+y), which
+    #        maps the unbounded latent heat ratio to [0, 1).
+    #
+    #        g is evaluated by bilinear interpolation, from
+    #        the four coefficients of each table cell, which
+    #        are precomputed as flat arrays.  The scale
+    #        factors sqrt(K*tao/(pi*C)) and 2*C/L do not
+    #        depend on the temperatures and may be kept by
+    #        the caller (see scale_factors()).  Cells outside
+    #        the table are computed by the analytic equations;
+    #        min/max reductions check for them first, so the
+    #        common case does not build masks.  max_error is
+    #        the largest relative error of g, found at the
+    #        centres of the table cells, where interpolation
+    #        is least accurate.
+    #
+    #        On 2 million cells, evaluate_scaled() takes 0.07 s
+    #        where analytic_ALT() takes 0.19 s (about 2.6 times
+    #        faster); scale_factors() adds 0.015 s when the
+    #        soil properties change.
+    #---------------------------------------------------------
+    def __init__(self, n_points=400, x_range=(0.0, 0.995),
+                 u_range=(0.01, 0.999)):
+
+        self.x = np.linspace(x_range[0], x_range[1], n_points)
+        self.u = np.linspace(u_range[0], u_range[1], n_points)
+        self.g = self.shape_factor(self.x[:, np.newaxis],
+                                   self.u[np.newaxis, :])
+
+        #-------------------------------------------------
+        # g = g0 + wx*gx + wu*(gu + wx*gxu) in each cell.
+        # The table is padded by one row and column, so
+        # that positions at its upper edges need no
+        # clipping.
+        #-------------------------------------------------
+        g = np.empty((n_points + 1, n_points + 1))
+        g[:-1, :-1] = self.g
+        g[-1, :-1]  = self.g[-1, :]
+        g[:, -1]    = g[:, -2]
+        g0 = g[:-1, :-1]
+        self.coefficients = [np.ravel(c) for c in
+                             (g0, g[1:, :-1] - g0, g[:-1, 1:] - g0,
+                              g[1:, 1:] - g[1:, :-1] - g[:-1, 1:] + g0)]
+
+        # Work arrays of the last grid size, kept between calls
+        self.work = None
+
+        x_mid = 0.5*(self.x[1:] + self.x[:-1])
+        u_mid = 0.5*(self.u[1:] + self.u[:-1])
+        g_mid = self.shape_factor(x_mid[:, np.newaxis], u_mid[np.newaxis, :])
+        g_est = self.interpolate(np.repeat(x_mid, n_points-1),
+                                 np.tile(u_mid, n_points-1))
+        g_est = np.reshape(g_est, g_mid.shape)
+        self.max_error = np.max(np.abs(g_est - g_mid) / g_mid)
+
+    def shape_factor(self, x, u):
+
+        # g(x, y) is Zal for Ags = 1, |Tps| = x,
+        # L/(2*C) = y and K*tao/(pi*C) = 1
+        y = u / (1.0 - u)
+        [Aps, Zc, g] = analytic_ALT(1.0, x, np.pi, 1.0, 2.0*y, 1.0)
+        return g
+
+    def get_work_arrays(self, size):
+
+        if (self.work is None) or (self.work['fx'].size != size):
+            self.work = {'fx': np.empty(size), 'fu': np.empty(size),
+                         'ix': np.empty(size), 'iu': np.empty(size),
+                         'cell': np.empty(size, dtype=np.intp),
+                         'c': np.empty((4, size)), 'g': np.empty(size)}
+        return self.work
+
+    def interpolate(self, x, u):
+
+        x = np.ravel(x)
+        u = np.ravel(u)
+        work = self.get_work_arrays(x.size)
+        np.subtract(x, self.x[0], out=work['fx'])
+        work['fx'] *= 1.0 / (self.x[1] - self.x[0])
+        np.subtract(u, self.u[0], out=work['fu'])
+        work['fu'] *= 1.0 / (self.u[1] - self.u[0])
+        return np.copy(self.interpolate_positions(work))
+
+    def interpolate_positions(self, work):
+
+        #-------------------------------------------------
+        # g at the positions work['fx'] and work['fu'],
+        # in units of the table spacing (both are
+        # overwritten).  NaNs give NaN.  Returns
+        # work['g'].
+        #-------------------------------------------------
+        n_u = len(self.u)
+        (fx, fu, ix, iu, cell, c, g) = [work[name] for name in
+            ('fx', 'fu', 'ix', 'iu', 'cell', 'c', 'g')]
+        np.modf(fx, fx, ix)
+        np.modf(fu, fu, iu)
+        ix *= n_u
+        ix += iu
+        np.copyto(cell, ix, casting='unsafe')
+        # (mode='clip' keeps the cells of NaNs inside the table)
+        for (coefficients, values) in zip(self.coefficients, c):
+            np.take(coefficients, cell, out=values, mode='clip')
+
+        np.multiply(c[3], fx, out=g)
+        g += c[2]
+        g *= fu
+        g += c[0]
+        fx *= c[1]
+        g += fx
+        return g
+
+    def scale_factors(self, K, C, L, tao):
+
+        # sqrt(K*tao/(pi*C)) and 2*C/L of evaluate_scaled()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (np.sqrt(K*tao/(np.pi*C)), 2.0*C/L)
+
+    def evaluate(self, Ags, Tps_abs, K, C, L, tao):
+
+        return self.evaluate_scaled(Ags, -np.abs(Tps_abs),
+                                    *self.scale_factors(K, C, L, tao))
+
+    def evaluate_scaled(self, Ags, Tps, scale, heat_ratio):
+
+        #-------------------------------------------------
+        # Zal from Ags, Tps (of which |Tps| is used) and
+        # the factors of scale_factors()
+        #-------------------------------------------------
+        shape = np.broadcast(Ags, Tps, scale, heat_ratio).shape
+        masks = [np.ma.getmask(a) for a in (Ags, Tps, scale, heat_ratio)]
+        (Ags, Tps, scale, heat_ratio) = [np.ma.getdata(a) for a in
+                                         (Ags, Tps, scale, heat_ratio)]
+        work = self.get_work_arrays(int(np.prod(shape)))
+        (fx, fu) = [np.reshape(work[name], shape) for name in ('fx', 'fu')]
+        n_x = len(self.x) - 1
+        n_u = len(self.u) - 1
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            #-------------------------------------------------
+            # Table positions of x = |Tps|/Ags, and of
+            # u = y/(1+y) = 1/(1 + 2*C*Ags/L).  Tps is
+            # usually negative, so x is taken as -Tps/Ags;
+            # a positive Tps is outside the table.
+            #-------------------------------------------------
+            x_spacing = self.x[1] - self.x[0]
+            u_spacing = self.u[1] - self.u[0]
+            np.divide(Tps, Ags, out=fx)
+            fx *= -1.0 / x_spacing
+            if (self.x[0] != 0.0):
+                fx -= self.x[0] / x_spacing
+            np.multiply(heat_ratio, Ags, out=fu)
+            fu += 1.0
+            np.divide(1.0 / u_spacing, fu, out=fu)
+            fu -= self.u[0] / u_spacing
+
+            #-------------------------------------------------
+            # Inputs outside the table (but not NaN) use the
+            # analytic equations
+            #-------------------------------------------------
+            outside = None
+            if (np.fmin.reduce(work['fx']) < 0) or \
+               (np.fmax.reduce(work['fx']) > n_x) or \
+               (np.fmin.reduce(work['fu']) < 0) or \
+               (np.fmax.reduce(work['fu']) > n_u):
+                outside = (fx < 0) | (fx > n_x) | (fu < 0) | (fu > n_u)
+                (Ags_all, Tps_all, ratio_all) = [
+                    np.broadcast_to(a, shape)[outside]
+                    for a in (Ags, Tps, heat_ratio)]
+                g_outside = analytic_ALT(1.0, np.abs(Tps_all/Ags_all), np.pi,
+                                         1.0, 2.0/(ratio_all*Ags_all), 1.0)[2]
+
+            g = np.reshape(self.interpolate_positions(work), shape)
+            if (outside is not None):
+                g[outside] = g_outside
+            Zal = g * scale
+
+        if any([mask is not np.ma.nomask for mask in masks]):
+            mask = np.zeros(shape, dtype=bool)
+            for m in masks:
+                mask |= m
+            Zal = np.ma.array(Zal, mask=mask)
+        if (np.ndim(Zal) == 0):
+            return np.float64(Zal)
+        return Zal
+
+#   ALTLookupTable
+#-------------------------------------------------------------------
 class Ku_method( perma_base.PermafrostComponent ):
 
+    # Input variables read by read_input_files()
+    input_var_names = ['T_air', 'A_air', 'h_snow', 'rho_snow', 'vwc_H2O',
+                       'Hvgf', 'Hvgt', 'Dvf', 'Dvt']
+
     #   get_var_units()
     #-------------------------------------------------------------------
     def check_input_types(self):
@@ -112,60 +342,122 @@ class Ku_method( perma_base.PermafrostComponent ):
         self.thermal_parameters_file = os.path.join(data_directory,
                                                     'Typical_Thermal_Parameters.csv')
 
-        self.T_air_file       = self.in_directory + self.T_air_file
-        self.A_air_file       = self.in_directory + self.A_air_file
-        self.h_snow_file      = self.in_directory + self.h_snow_file
-        self.rho_snow_file    = self.in_directory + self.rho_snow_file
-        self.vwc_H2O_file     = self.in_directory + self.vwc_H2O_file
-        self.Hvgf_file        = self.in_directory + self.Hvgf_file
-        self.Hvgt_file        = self.in_directory + self.Hvgt_file
-        self.Dvf_file         = self.in_directory + self.Dvf_file
-        self.Dvt_file         = self.in_directory + self.Dvt_file
+        # The typical thermal parameters do not change during a run
+        self.thermal_data = np.genfromtxt(self.thermal_parameters_file,
+                                          names = True,
+                                          delimiter=',',
+                                          dtype=None)
+
+        #---------------------------------------------------------
+        # Notes: A variable with type "Forcing" is read from the
+        #        single multi-variable NetCDF "forcing_file",
+        #        instead of from its own "<var>_file".  Its name
+        #        in forcing_file is given by "<var>_forcing_var"
+        #        and defaults to the variable name (e.g. T_air).
+        #---------------------------------------------------------
+        forcing_var_names = []
+        for var in self.input_var_names:
+            var_type = getattr(self, var + '_type')
+            if (var_type.lower() == 'forcing'):
+                forcing_var_names.append(var)
+                setattr(self, var + '_unit', None)
+            else:
+                var_file = self.in_directory + getattr(self, var + '_file')
+                setattr(self, var + '_file', var_file)
+                setattr(self, var + '_unit', self.open_file_KU(var_type, var_file))
 #        self.lat_file         = self.in_directory + self.lat_file
 #        self.lon_file         = self.in_directory + self.lon_file
-        self.ALT_file  = self.out_directory + self.ALT_file
-        self.TPS_file  = self.out_directory + self.TPS_file
-         
-        self.T_air_unit       = self.open_file_KU(self.T_air_type,  self.T_air_file)
-        self.A_air_unit       = self.open_file_KU(self.A_air_type,  self.A_air_file)
-        self.h_snow_unit      = self.open_file_KU(self.h_snow_type,  self.h_snow_file)
-        self.rho_snow_unit    = self.open_file_KU(self.rho_snow_type,  self.rho_snow_file)
-        self.vwc_H2O_unit     = self.open_file_KU(self.vwc_H2O_type,  self.vwc_H2O_file)
-        self.Hvgf_unit        = self.open_file_KU(self.Hvgf_type,  self.Hvgf_file)
-        self.Hvgt_unit        = self.open_file_KU(self.Hvgt_type,  self.Hvgt_file)
-        self.Dvf_unit         = self.open_file_KU(self.Dvf_type,  self.Dvf_file)
-        self.Dvt_unit         = self.open_file_KU(self.Dvt_type,  self.Dvt_file)
 #        self.lat_unit         = model_input.open_file(self.lat_type,  self.lat_file)
 #        self.lon_unit         = model_input.open_file(self.lon_type,  self.lon_file)
 
+        self.forcing_unit = None
+        self.forcing_vars = {}
+        self.forcing_blocks = {}
+        if (len(forcing_var_names) > 0):
+            self.forcing_file = self.in_directory + self.forcing_file
+            self.forcing_unit = self.open_file_KU('Grid', self.forcing_file)
+            if (self.forcing_unit is None):
+                raise IOError('Could not open forcing file %s' %
+                              self.forcing_file)
+            for var in forcing_var_names:
+                nc_var_name = getattr(self, var + '_forcing_var', var)
+                if (nc_var_name not in self.forcing_unit.variables):
+                    raise ValueError('Variable %s (for %s) not found in %s' %
+                                     (nc_var_name, var, self.forcing_file))
+                self.forcing_vars[var] = nc_var_name
+
+        #---------------------------------------------------------
+        # Notes: The data variable of each Grid input file is
+        #        looked up once here, instead of on every read.
+        #        The next time slice of all Grid and Forcing
+        #        inputs is read on a background thread while the
+        #        current year is computed (see start_prefetch()),
+        #        unless the cfg file sets "prefetch_inputs" to No.
+        #---------------------------------------------------------
+        self.grid_input_units = [getattr(self, var + '_unit')
+                                 for var in self.input_var_names
+                                 if getattr(self, var + '_type').lower() == 'grid']
+
+        self.nc_data_var_names = {}
+        for unit in self.grid_input_units:
+            self.nc_data_var_names[id(unit)] = self.find_nc_data_var_name(unit)
+
+        #---------------------------------------------------------
+        # Notes: A cfg file for one tile of a larger grid (see
+        #        domain_decomposition.py) gives the first row and
+        #        column of the tile and its size; only that window
+        #        of the Grid and Forcing inputs is read.
+        #---------------------------------------------------------
+        if hasattr(self, 'tile_rows'):
+            j0 = int(self.tile_first_row)
+            i0 = int(self.tile_first_column)
+            self.grid_window = (slice(j0, j0 + int(self.tile_rows)),
+                                slice(i0, i0 + int(self.tile_columns)))
+        else:
+            self.grid_window = (slice(None), slice(None))
+
+        prefetch_inputs = str(getattr(self, 'prefetch_inputs', 'Yes'))
+        self.PREFETCH_INPUTS = (prefetch_inputs.lower() == 'yes')
+
+        # Serializes NetCDF access between the prefetch thread, the
+        # output files written by save_grids() and any other thread
+        # of this process using NetCDF
+        self.nc_lock = model_output.netcdf_lock
+        self.prefetch_thread = None
+        self.prefetched = {'index': None, 'data': {}}
+        # Blocks of time slices of Grid inputs (see update_years())
+        self.grid_blocks = {}
+
+        #---------------------------------------------------------
+        # Notes: lat and lon of Grid inputs do not change, so
+        #        they are read once here (for this tile only),
+        #        and self.lat and self.lon are kept for the run.
+        #---------------------------------------------------------
+        if self.T_air_type.lower() in ['grid', 'forcing']:
+            if self.T_air_type.lower() == 'forcing':
+                lat_lon = self.read_nc_lat_lon(self.forcing_unit, 'Grid')
+            else:
+                lat_lon = self.read_nc_lat_lon(self.T_air_unit, self.T_air_type)
+            if (lat_lon is not None):
+                (self.lat, self.lon) = lat_lon
+
     #   open_input_files()
     #-------------------------------------------------------------------
     def read_input_files(self):
 
         #rti = self.rti # has a problem with loading rti: do not know where its been initialized
 
-        self.thermal_data = np.genfromtxt(self.thermal_parameters_file,
-                                          names = True,
-                                          delimiter=',',
-                                          dtype=None)
+        # Slices prefetched during the last update must be complete
+        self.wait_for_prefetch()
 
         #-------------------------------------------------------
         # All grids are assumed to have a data type of Float32.
         #-------------------------------------------------------    
 
-        if self.T_air_type.lower() == 'grid': # these lines just available for GRID inputs
-
-            [Lat_list, Lon_list] = self.read_nc_lat_lon(self.T_air_unit, self.T_air_type)
-                        
-            if Lon_list is not None:
-                self.lon = Lon_list 
-            if (Lat_list is not None): 
-                self.lat = Lat_list    
-                        
-        T_air = self.read_next_modified_KU(self.T_air_unit,self.T_air_type)
+        # (lat and lon of Grid inputs were read by open_input_files())
+        T_air = self.read_next_modified_KU(self.T_air_unit,self.T_air_type, var_name='T_air')
 #        
-        if (T_air is not None):
-            self.T_air = T_air
+        self.set_input('T_air', T_air)
         #        
 #        print self.T_air
              
@@ -174,45 +466,40 @@ class Ku_method( perma_base.PermafrostComponent ):
 #            self.T_air = T_air
 #            n_T_air = len(T_air)
             
-        A_air = self.read_next_modified_KU(self.A_air_unit, self.A_air_type)
-        if (A_air is not None): 
-            self.A_air = A_air
+        A_air = self.read_next_modified_KU(self.A_air_unit, self.A_air_type, var_name='A_air')
+        self.set_input('A_air', A_air)
 #            n_A_air = len(A_air)
             
-        h_snow = self.read_next_modified_KU(self.h_snow_unit, self.h_snow_type)
-        if (h_snow is not None): 
-            self.h_snow = h_snow
+        h_snow = self.read_next_modified_KU(self.h_snow_unit, self.h_snow_type, var_name='h_snow')
+        self.set_input('h_snow', h_snow)
 #            n_h_snow = len(h_snow) 
             
-        rho_snow = self.read_next_modified_KU(self.rho_snow_unit, self.rho_snow_type)
-        if (rho_snow is not None): 
-            self.rho_snow = rho_snow
+        rho_snow = self.read_next_modified_KU(self.rho_snow_unit, self.rho_snow_type, var_name='rho_snow')
+        self.set_input('rho_snow', rho_snow)
 #            n_rho_snow = len(rho_snow)
         
-        vwc_H2O = self.read_next_modified_KU(self.vwc_H2O_unit, self.vwc_H2O_type)
-        if (vwc_H2O is not None): 
-            self.vwc_H2O = vwc_H2O
+        vwc_H2O = self.read_next_modified_KU(self.vwc_H2O_unit, self.vwc_H2O_type, var_name='vwc_H2O')
+        self.set_input('vwc_H2O', vwc_H2O)
 #            n_vwc_H2O = len(vwc_H2O)
             
-        Hvgf = self.read_next_modified_KU(self.Hvgf_unit, self.Hvgf_type)
-        if (Hvgf is not None): 
-            self.Hvgf = Hvgf
+        Hvgf = self.read_next_modified_KU(self.Hvgf_unit, self.Hvgf_type, var_name='Hvgf')
+        self.set_input('Hvgf', Hvgf)
 #            n_Hvgf = len(Hvgf)
             
-        Hvgt = self.read_next_modified_KU(self.Hvgt_unit, self.Hvgt_type)
-        if (Hvgt is not None): 
-            self.Hvgt = Hvgt
+        Hvgt = self.read_next_modified_KU(self.Hvgt_unit, self.Hvgt_type, var_name='Hvgt')
+        self.set_input('Hvgt', Hvgt)
 #            n_Hvgt = len(Hvgt)
             
-        Dvt = self.read_next_modified_KU(self.Dvt_unit, self.Dvt_type)
-        if (Dvt is not None): 
-            self.Dvt = Dvt
+        Dvt = self.read_next_modified_KU(self.Dvt_unit, self.Dvt_type, var_name='Dvt')
+        self.set_input('Dvt', Dvt)
 #            n_Dvt = len(Dvt)
             
-        Dvf = self.read_next_modified_KU(self.Dvf_unit, self.Dvf_type)
-        if (Dvf is not None): 
-            self.Dvf = Dvf
+        Dvf = self.read_next_modified_KU(self.Dvf_unit, self.Dvf_type, var_name='Dvf')
+        self.set_input('Dvf', Dvf)
 #            n_Dvf = len(Dvf)
+
+        # Start reading next year's slices while this year computes
+        self.start_prefetch()
         
 #        # Check the number of grid in input files:
 #        
@@ -232,6 +519,200 @@ class Ku_method( perma_base.PermafrostComponent ):
         
     #   read_input_files()
     #-------------------------------------------------------------------
+    def set_input(self, var, value):
+
+        #---------------------------------------------------------
+        # Notes: If the new values equal the current ones, the
+        #        current array is kept.  Otherwise they are copied
+        #        into it, and it gets a new version (see
+        #        get_input_versions()), so intermediates depending
+        #        only on inputs that did not change are not
+        #        recomputed.  The array itself is allocated when
+        #        an input is first read (or changes shape) and
+        #        then kept, so references to it (e.g. from BMI
+        #        get_value_ptr()) stay valid for the whole run.
+        #---------------------------------------------------------
+        if (value is None):
+            return
+        current = getattr(self, var, None)
+        if (current is not None) and self.has_same_values(current, value):
+            return
+        if isinstance(current, np.ndarray) and \
+           (current.shape == np.shape(value)) and \
+           (np.ma.isMA(current) or not(np.ma.isMA(value))):
+            current[...] = value
+            self.mark_input_changed(var)
+        else:
+            setattr(self, var, self.state_array(value))
+
+    #   set_input()
+    #-------------------------------------------------------------------
+    def has_same_values(self, old_value, new_value):
+
+        old_value = np.asarray(old_value)
+        new_value = np.asarray(new_value)
+        if (old_value.shape != new_value.shape):
+            return False
+        if (old_value.dtype.kind != 'f') or (new_value.dtype.kind != 'f'):
+            return bool(np.all(old_value == new_value))
+
+        both_nan = np.logical_and(np.isnan(old_value), np.isnan(new_value))
+        return bool(np.all(np.logical_or(old_value == new_value, both_nan)))
+
+    #   has_same_values()
+    #-------------------------------------------------------------------
+    def state_array(self, value):
+
+        #---------------------------------------------------------
+        # Notes: A float64 copy of value to keep as an input or
+        #        output; grids read from files keep their masks
+        #        (as a full boolean array, so that later values
+        #        can be copied into it, mask and all).
+        #---------------------------------------------------------
+        if np.ma.isMA(value):
+            return np.ma.array(value, dtype=np.float64, copy=True,
+                               mask=np.ma.getmaskarray(value))
+        return np.array(value, dtype=np.float64)
+
+    #   state_array()
+    #-------------------------------------------------------------------
+    def set_output(self, var, value):
+
+        #---------------------------------------------------------
+        # Notes: Outputs (Tps, Zal) are copied into the same
+        #        array every year; a new one is only allocated
+        #        the first time, or if its shape changes.
+        #---------------------------------------------------------
+        current = getattr(self, var, None)
+        if isinstance(current, np.ndarray) and \
+           (current.shape == np.shape(value)) and \
+           (np.ma.isMA(current) or not(np.ma.isMA(value))):
+            current[...] = value
+        else:
+            setattr(self, var, self.state_array(value))
+
+    #   set_output()
+    #-------------------------------------------------------------------
+    def mark_input_changed(self, var):
+
+        #---------------------------------------------------------
+        # Notes: Inputs that are replaced by a new array are
+        #        detected automatically.  Call this after changing
+        #        an input array in place (e.g. from a coupler),
+        #        so that everything depending on it is recomputed.
+        #---------------------------------------------------------
+        self.input_versions[var] = self.input_versions.get(var, 0) + 1
+        self.input_refs[var] = getattr(self, var)
+
+    #   mark_input_changed()
+    #-------------------------------------------------------------------
+    def get_input_versions(self, *var_names):
+
+        versions = []
+        for var in var_names:
+            if (self.input_refs.get(var) is not getattr(self, var)):
+                self.mark_input_changed(var)
+            versions.append(self.input_versions[var])
+
+        return tuple(versions)
+
+    #   get_input_versions()
+    #-------------------------------------------------------------------
+    def find_nc_data_var_name(self, file_unit):
+
+        #------------------------------------------------------
+        # The data variable is the (last) variable which is
+        # neither the time nor a latitude/longitude variable
+        #------------------------------------------------------
+        data_var_name = None
+        for var in file_unit.variables.keys():
+            if (var != 'time' and var[0:3] !='lat' and var[0:3] != 'lon'):
+                data_var_name = var
+
+        return data_var_name
+
+    #   find_nc_data_var_name()
+    #-------------------------------------------------------------------
+    def start_prefetch(self):
+
+        #---------------------------------------------------------
+        # Notes: Slice "cont+1" is the one read by the next call
+        #        to read_input_files().  If that is not the case
+        #        (e.g. cont was reset), or if the slice is past
+        #        the end of a file, read_next_modified_KU() just
+        #        reads the requested slice itself.
+        #---------------------------------------------------------
+        if not(self.PREFETCH_INPUTS) or \
+           (len(self.grid_input_units) + len(self.forcing_vars) == 0):
+            return
+
+        index    = int(self.cont) + 1
+        prefetch = {'index': index, 'data': {}}
+
+        def read_slices():
+            for unit in self.grid_input_units:
+                var_name = self.nc_data_var_names[id(unit)]
+                try:
+                    with self.nc_lock:
+                        data = unit.variables[var_name][(index,) +
+                                                        self.grid_window]
+                except Exception:
+                    return
+                prefetch['data'][id(unit)] = data
+            for var in self.forcing_vars:
+                try:
+                    self.read_forcing_slice(var, index)
+                except Exception:
+                    return
+
+        self.prefetched = prefetch
+        self.prefetch_thread = threading.Thread(target=read_slices)
+        self.prefetch_thread.daemon = True
+        self.prefetch_thread.start()
+
+    #   start_prefetch()
+    #-------------------------------------------------------------------
+    def wait_for_prefetch(self):
+
+        if (self.prefetch_thread is not None):
+            self.prefetch_thread.join()
+            self.prefetch_thread = None
+
+    #   wait_for_prefetch()
+    #-------------------------------------------------------------------
+    def read_forcing_slice(self, var, index):
+
+        #---------------------------------------------------------
+        # Notes: Reads are aligned to the chunk layout of the
+        #        variable in forcing_file:  the whole block of
+        #        time chunks holding "index" is read at once and
+        #        kept, so the following years in the same chunk
+        #        are not read from file again.  A contiguous
+        #        variable is read one time slice at a time.
+        #---------------------------------------------------------
+        nc_var = self.forcing_unit.variables[self.forcing_vars[var]]
+
+        if (var in self.forcing_blocks):
+            (start, block) = self.forcing_blocks[var]
+            if (start <= index < start + len(block)):
+                return block[index - start]
+
+        chunking = nc_var.chunking()
+        if (chunking == 'contiguous'):
+            n_block = 1
+        else:
+            n_block = chunking[0]
+        start = (index // n_block) * n_block
+
+        with self.nc_lock:
+            block = nc_var[(slice(start, start + n_block),) +
+                           self.grid_window]
+        self.forcing_blocks[var] = (start, block)
+
+        return block[index - start]
+
+    #   read_forcing_slice()
+    #-------------------------------------------------------------------
 
     def update_soil_heat_capacity(self):
 
@@ -249,6 +730,11 @@ class Ku_method( perma_base.PermafrostComponent ):
         # I do not like this input file here need fix later
         #input_file = 'Parameters/Typical_Thermal_Parameters.csv'
 
+        # Only depends on soil moisture (texture is fixed)
+        key = self.get_input_versions('vwc_H2O')
+        if (self.cache_keys.get('heat_capacity') == key):
+            return
+
         Bulk_Density_Texture = self.thermal_data['Bulk_Density']
         Heat_Capacity_Texture = self.thermal_data['Heat_Capacity']
 
@@ -279,6 +765,8 @@ class Ku_method( perma_base.PermafrostComponent ):
 #        self.Heat_Capacity = Heat_Capacity;
 #        self.Ct = Heat_Capacity*0.+2500000
 #        self.Cf = Heat_Capacity*0.+1300000
+
+        self.cache_keys['heat_capacity'] = key
         
     #   update_soil_heat_capacity()
     #-------------------------------------------------------------------
@@ -298,6 +786,11 @@ class Ku_method( perma_base.PermafrostComponent ):
         #--------------------------------------------------
         #input_file = 'Parameters/Typical_Thermal_Parameters.csv'
 
+        # Only depends on soil moisture (texture is fixed)
+        key = self.get_input_versions('vwc_H2O')
+        if (self.cache_keys.get('thermal_conductivity') == key):
+            return
+
         vwc=self.vwc_H2O
                 
         KT_DRY = self.thermal_data['KT_DRY'] # DRY soil thermal conductivity in THAWED states
@@ -433,6 +926,8 @@ class Ku_method( perma_base.PermafrostComponent ):
         
         self.Kt = Kt_Soil;
         self.Kf = Kf_Soil;
+
+        self.cache_keys['thermal_conductivity'] = key
         
 #        self.Kt = Kt_Soil**(1.0-vwc)*0.54**vwc #   Unit: (W m-1 C-1)
 #        self.Kf = Kf_Soil**(1.0-vwc-0.0)*2.35**(vwc-0.0)*0.54**0.0 #   Unit: (W m-1 C-1)
@@ -453,12 +948,18 @@ class Ku_method( perma_base.PermafrostComponent ):
         #
         #
         #--------------------------------------------------
+        key = self.get_input_versions('rho_snow')
+        if (self.cache_keys.get('snow_thermal_properties') == key):
+            return
+
         rho_sn=self.rho_snow
 
         self.Ksn = (rho_sn/1000.)**2*3.233-1.01*(rho_sn/1000.)+0.138; # Unit: (W m-1 C-1)
 
         self.Csn = 2.09E3 ;                                                # Unit: J m-3 C-1
 
+        self.cache_keys['snow_thermal_properties'] = key
+
     #   update_ssnow_thermal_properties()
     #-------------------------------------------------------------------
     def update_TOP_temperatures(self):
@@ -473,9 +974,14 @@ class Ku_method( perma_base.PermafrostComponent ):
 
         tao = self.T_air*0.0 + self.sec_per_year;        
         
-        K_diffusivity = self.Ksn/(self.rho_snow*self.Csn)
+        # The damping by snow only depends on the snow inputs
+        key = self.get_input_versions('h_snow', 'rho_snow')
+        if (self.cache_keys.get('snow_damping') != key):
+            K_diffusivity = self.Ksn/(self.rho_snow*self.Csn)
+            self.snow_damping = np.exp(-1.0*self.h_snow*np.sqrt(np.pi/(self.sec_per_year*K_diffusivity)))
+            self.cache_keys['snow_damping'] = key
         
-        temp = np.exp(-1.0*self.h_snow*np.sqrt(np.pi/(tao*K_diffusivity)))
+        temp = self.snow_damping
         deta_Tsn = self.A_air*(1.0 - temp);
         deta_Asn = deta_Tsn*2.0/np.pi;
 
@@ -493,10 +999,18 @@ class Ku_method( perma_base.PermafrostComponent ):
         #       deta_Tv -- Effects of vegetation on an annual mean temperature, eq-9
         #       Tgs, Ags -- mean annual gs temperature and amplitude eq-13,14 Sazonova et al., 2003
         #--------------------------------------------------
-        temp = 1.- np.exp(-1.*self.Hvgf*np.sqrt(np.pi/(self.Dvf*2.*self.tao1)))
+        # H*sqrt(pi/(2*D)) only depends on the vegetation inputs,
+        # the season lengths tao1 and tao2 change with the air temperature
+        key = self.get_input_versions('Hvgf', 'Dvf', 'Hvgt', 'Dvt')
+        if (self.cache_keys.get('vegetation_damping') != key):
+            self.vgf_damping = self.Hvgf*np.sqrt(np.pi/(self.Dvf*2.))
+            self.vgt_damping = self.Hvgt*np.sqrt(np.pi/(self.Dvt*2.))
+            self.cache_keys['vegetation_damping'] = key
+
+        temp = 1.- np.exp(-1.*self.vgf_damping/np.sqrt(self.tao1))
         deta_A1 = (Avg - Tvg) * temp;
 
-        temp = 1.- np.exp(-1.*self.Hvgt*np.sqrt(np.pi/(self.Dvt*2.*self.tao2)))
+        temp = 1.- np.exp(-1.*self.vgt_damping/np.sqrt(self.tao2))
         deta_A2 = (Avg  + Tvg) * temp;
 
         deta_Av = (deta_A1*self.tao1+deta_A2*self.tao2) / tao;
@@ -527,10 +1041,11 @@ class Ku_method( perma_base.PermafrostComponent ):
         
         if n_grid >1 :               
         
+            # (np.where, so that the cached self.Kf is not modified)
             K_star = self.Kf
             
             if np.size(self.Kf)>1:
-            	K_star[np.where(Tps_numerator>0.0)] = self.Kt[np.where(Tps_numerator>0.0)];
+            	K_star = np.where(Tps_numerator>0.0, self.Kt, self.Kf)
             
         else:
             if Tps_numerator<=0.0:
@@ -544,16 +1059,18 @@ class Ku_method( perma_base.PermafrostComponent ):
         self.Ags=Ags
         self.Tps_numerator=Tps_numerator
 
-        self.Tps = self.Tps_numerator/K_star
+        Tps = Tps_numerator/K_star
         
         if n_grid > 1:        
         
-            self.Tps[np.where(self.Tps_numerator>0.0)] = np.nan # Seasonal Frozen Ground
+            Tps[np.where(Tps_numerator>0.0)] = np.nan # Seasonal Frozen Ground
             
         else:
             
-            if self.Tps_numerator>0.0:
-                self.Tps = np.nan
+            if Tps_numerator>0.0:
+                Tps = np.nan
+
+        self.set_output('Tps', Tps)
 
 
     #   update_TOP_temperatures()
@@ -567,37 +1084,50 @@ class Ku_method( perma_base.PermafrostComponent ):
         #       Zal -- eq-3, Romanovsky et al. 1997
         #--------------------------------------------------
 
-        tao = self.T_air*0.0 + self.sec_per_year;
-
         n_grid = np.size(self.T_air) 
 
-        if n_grid > 1:        
-        
-            K = self.Kt
-            C = self.Ct       
-            if np.size(self.Kf)>1:        
-            	K[np.where(self.Tps_numerator>0.0)] = self.Kf[np.where(self.Tps_numerator>0.0)]
-            	C[np.where(self.Tps_numerator>0.0)] = self.Cf[np.where(self.Tps_numerator>0.0)]
-            
+        if (self.ALT_method == 'lookup'):
+
+            #-----------------------------------------------------
+            # Notes: Zal is only kept where Tps_numerator <= 0,
+            #        which is where Kt and Ct are used; so the
+            #        scale factors of the table only depend on
+            #        the soil moisture and are kept until it
+            #        changes.  Aps and Zc are not computed.
+            #-----------------------------------------------------
+            key = self.get_input_versions('vwc_H2O')
+            if (self.cache_keys.get('ALT_lookup_factors') != key):
+                self.ALT_lookup_factors = self.ALT_lookup.scale_factors(
+                    self.Kt, self.Ct, self.L, self.sec_per_year)
+                self.cache_keys['ALT_lookup_factors'] = key
+            Aps = None
+            Zc  = None
+            Zal = self.ALT_lookup.evaluate_scaled(self.Ags, self.Tps,
+                                                  *self.ALT_lookup_factors)
         else:
-            
-            if self.Tps_numerator<=0.0:
+
+            tao = self.T_air*0.0 + self.sec_per_year;
+
+            if n_grid > 1:        
+        
+                # (np.where, so that the cached self.Kt and self.Ct are not modified)
                 K = self.Kt
-                C = self.Ct
+                C = self.Ct       
+                if np.size(self.Kf)>1:        
+                    K = np.where(self.Tps_numerator>0.0, self.Kf, self.Kt)
+                    C = np.where(self.Tps_numerator>0.0, self.Cf, self.Ct)
+            
             else:
-                K = self.Kf
-                C = self.Cf
-                
-        Aps = (self.Ags - abs(self.Tps))/np.log((self.Ags+self.L/(2.*C)) / \
-                    (abs(self.Tps)+self.L/(2.*C))) - self.L/(2.*C);
+            
+                if self.Tps_numerator<=0.0:
+                    K = self.Kt
+                    C = self.Ct
+                else:
+                    K = self.Kf
+                    C = self.Cf
 
-        Zc = (2.*(self.Ags - abs(self.Tps))*np.sqrt((K*tao*C)/np.pi)) / \
-                    (2.*Aps*C + self.L);
-                    
-        Zal = (2.*(self.Ags - abs(self.Tps))*np.sqrt(K*tao*C/np.pi) \
-                +(2.*Aps*C*Zc+self.L*Zc)*self.L*np.sqrt(K*tao/(np.pi*C)) \
-                /(2.*Aps*C*Zc + self.L*Zc +(2.*Aps*C+self.L)*np.sqrt(K*tao/(np.pi*C)))) \
-                /(2.*Aps*C+ self.L);
+            [Aps, Zc, Zal] = analytic_ALT(self.Ags, abs(self.Tps), K, C,
+                                          self.L, tao)
 
         if n_grid > 1:        
         
@@ -612,11 +1142,153 @@ class Ku_method( perma_base.PermafrostComponent ):
 
         self.Aps = Aps;
         self.Zc  = Zc;  
-        self.Zal = Zal;
+        self.set_output('Zal', Zal)
                 
         
     #   update_ALT()
     #-------------------------------------------------------------------
+    def get_ALT_lookup_error(self):
+
+        #---------------------------------------------------------
+        # Notes: Returns the largest difference [m] between the
+        #        ALT from the lookup table and from the analytic
+        #        equations, for the current inputs.  Both are
+        #        computed here, so this is only a diagnostic.
+        #---------------------------------------------------------
+        ALT_method = self.ALT_method
+        if not hasattr(self, 'ALT_lookup'):
+            self.ALT_lookup = ALTLookupTable()
+
+        try:
+            self.ALT_method = 'lookup'
+            self.update_ALT()
+            Zal_lookup = np.copy(self.Zal)
+            self.ALT_method = 'analytic'
+            self.update_ALT()
+            Zal_analytic = np.copy(self.Zal)
+        finally:
+            self.ALT_method = ALT_method
+        self.update_ALT()
+
+        error = np.abs(np.asarray(Zal_lookup) - np.asarray(Zal_analytic))
+        if np.all(np.isnan(error)):
+            return 0.0
+        return np.nanmax(error)
+
+    #   get_ALT_lookup_error()
+    #-------------------------------------------------------------------
+    def update_years(self, n_years):
+
+        #---------------------------------------------------------
+        # Notes: Same results and state as n_years steps of
+        #        BmiKuMethod.update() (compute, save the grids,
+        #        read the next year's inputs), but the Grid
+        #        inputs of all years are read in one block per
+        #        file, all years are computed in one vectorized
+        #        call (see compute_years()) and the output grids
+        #        are written in one block per file.  This is for
+        #        runs in which nothing else sets the inputs
+        #        between the years.
+        #---------------------------------------------------------
+        if (n_years <= 0):
+            return
+
+        self.wait_for_prefetch()
+        first = int(self.cont) + 1
+        with self.nc_lock:
+            for unit in self.grid_input_units:
+                var_name = self.nc_data_var_names[id(unit)]
+                self.grid_blocks[id(unit)] = (first, unit.variables[var_name][
+                    (slice(first, first + n_years),) + self.grid_window])
+
+        inputs = dict([(var, []) for var in self.input_var_names])
+        years  = []
+        PREFETCH_INPUTS = self.PREFETCH_INPUTS
+        self.PREFETCH_INPUTS = False
+        try:
+            for _ in range(n_years):
+                for var in self.input_var_names:
+                    # (a copy: the inputs are updated in place)
+                    inputs[var].append(self.state_array(getattr(self, var)))
+                years.append(self.year)
+                self.cont = self.cont + 1
+                self.year += self.dt
+                self.read_input_files()
+        finally:
+            self.PREFETCH_INPUTS = PREFETCH_INPUTS
+            self.grid_blocks = {}
+
+        (Zal, Tps) = self.compute_years(inputs)
+        self.save_grid_years(Zal, Tps, years)
+        self.start_prefetch()
+
+    #   update_years()
+    #-------------------------------------------------------------------
+    def compute_years(self, inputs):
+
+        #---------------------------------------------------------
+        # Notes: inputs has the list of the yearly values of each
+        #        input.  Inputs which change are stacked with the
+        #        years first and set for one call of the update
+        #        methods; the others (and the intermediates
+        #        computed only from them) are kept as they are.
+        #        Afterwards, the inputs are the arrays of the last
+        #        year again, and Zal and Tps hold its results.
+        #        Returns the stacked Zal and Tps of all years.
+        #---------------------------------------------------------
+        n_years = len(inputs[self.input_var_names[0]])
+        ndim = max([np.ndim(self.Zal)] + [np.ndim(values[0]) for values
+                                          in inputs.values()])
+        def same(old_value, new_value):
+            return self.has_same_values(old_value, new_value) and \
+                   np.array_equal(np.ma.getmaskarray(old_value),
+                                  np.ma.getmaskarray(new_value))
+
+        stacked = {}
+        for (var, values) in inputs.items():
+            if all([same(values[0], value) for value in values[1:]]) and \
+               same(values[0], getattr(self, var)):
+                continue
+            if any([np.ma.isMA(value) for value in values]):
+                block = np.ma.stack(values)
+            else:
+                block = np.stack(values)
+            stacked[var] = block.reshape(
+                (n_years,) + (1,)*(ndim - np.ndim(values[0])) +
+                np.shape(values[0]))
+
+        kept = dict([(var, getattr(self, var))
+                     for var in list(stacked.keys()) + ['Zal', 'Tps']])
+        try:
+            for (var, block) in stacked.items():
+                setattr(self, var, block)
+            self.update_ground_temperatures()
+            self.update_ALT()
+            (Zal, Tps) = (self.Zal, self.Tps)
+        finally:
+            for (var, value) in kept.items():
+                setattr(self, var, value)
+
+        (Zal, Tps) = [self.stack_years(values, n_years, np.shape(kept[var]),
+                                       repeat=not(stacked))
+                      for (var, values) in (('Zal', Zal), ('Tps', Tps))]
+        self.set_output('Zal', Zal[-1])
+        self.set_output('Tps', Tps[-1])
+        return (Zal, Tps)
+
+    #   compute_years()
+    #-------------------------------------------------------------------
+    def stack_years(self, values, n_years, shape, repeat=False):
+
+        # Results of all years as (n_years,) + shape, keeping any mask;
+        # with repeat, values is one year's result for all of them
+        stack = np.ma.stack if np.ma.isMA(values) else np.stack
+        if repeat:
+            values = stack([values] * n_years)
+        return np.reshape(values, (n_years,) + shape)
+
+    #   stack_years()
+    #-------------------------------------------------------------------
     def update_ground_temperatures(self):
         # in this method there is only one output the temperature at the top of permafrost
         # TTOP
@@ -628,9 +1300,16 @@ class Ku_method( perma_base.PermafrostComponent ):
 
         # Update mean temperatures for warmes and coldest seasons similar to Nelson & Outcalt 87
         # Cold and Warm Season, Page-129, Sazonova, 2003
-        self.tao1 = tao*(0.5 - 1./np.pi*np.arcsin(self.T_air/self.A_air));
-        self.tao2 = tao - self.tao1;
-        self.L=334000.*1000.*self.vwc_H2O
+        key = self.get_input_versions('T_air', 'A_air')
+        if (self.cache_keys.get('season_lengths') != key):
+            self.tao1 = tao*(0.5 - 1./np.pi*np.arcsin(self.T_air/self.A_air));
+            self.tao2 = tao - self.tao1;
+            self.cache_keys['season_lengths'] = key
+
+        key = self.get_input_versions('vwc_H2O')
+        if (self.cache_keys.get('latent_heat') != key):
+            self.L=334000.*1000.*self.vwc_H2O
+            self.cache_keys['latent_heat'] = key
 
         self.update_TOP_temperatures()
 
@@ -638,15 +1317,12 @@ class Ku_method( perma_base.PermafrostComponent ):
     #-------------------------------------------------------------------
     def close_input_files(self):
 
-        if (self.T_air_type     != 'Scalar'): self.T_air_unit.close()
-        if (self.A_air_type     != 'Scalar'): self.A_air_unit.close()
-        if (self.h_snow_type    != 'Scalar'): self.h_snow_unit.close()
-        if (self.rho_snow_type  != 'Scalar'): self.rho_snow_unit.close()
-        if (self.vwc_H2O_type   != 'Scalar'): self.vwc_H2O_unit.close()
-        if (self.Hvgf_type      != 'Scalar'): self.Hvgf_unit.close()
-        if (self.Hvgt_type      != 'Scalar'): self.Hvgt_unit.close()
-        if (self.Dvf_type       != 'Scalar'): self.Dvf_unit.close()
-        if (self.Dvt_type       != 'Scalar'): self.Dvt_unit.close()
+        self.wait_for_prefetch()
+
+        for var in self.input_var_names:
+            unit = getattr(self, var + '_unit')
+            if (unit is not None): unit.close()
+        if (self.forcing_unit is not None): self.forcing_unit.close()
 #        if (self.lat_type       != 'Scalar'): self.lat_unit.close()
 #        if (self.lon_type       != 'Scalar'): self.lon_unit.close()    
 
@@ -892,6 +1568,12 @@ class Ku_method( perma_base.PermafrostComponent ):
         self.Zal = np.float32(-999.99)
         self.cont = 0.0
 
+        # Versions of the inputs, and the input versions each cached
+        # intermediate was computed from (see get_input_versions())
+        self.input_versions = {}
+        self.input_refs     = {}
+        self.cache_keys     = {}
+
         #-----------------------------------------------
         # Load component parameters from a config file
         #-----------------------------------------------
@@ -923,6 +1605,21 @@ class Ku_method( perma_base.PermafrostComponent ):
         except AttributeError:
             self.end_year = self.start_year
 
+        #---------------------------------------------------------
+        # ALT is computed with the analytic equations, or with
+        # the faster approximate lookup table if the cfg file
+        # sets "ALT_method" to Lookup
+        #---------------------------------------------------------
+        self.ALT_method = str(getattr(self, 'ALT_method', 'Analytic')).lower()
+        if (self.ALT_method == 'lookup'):
+            self.ALT_lookup = ALTLookupTable()
+            if not(SILENT):
+                print 'ALT lookup table: max. relative error = %g' % \
+                      self.ALT_lookup.max_error
+        elif (self.ALT_method != 'analytic'):
+            raise ValueError('ALT_method must be Analytic or Lookup, not %s'
+                             % self.ALT_method)
+
         if (self.comp_status == 'Disabled'):
             #########################################
             #  DOUBLE CHECK THIS; SEE NOTES ABOVE
@@ -950,6 +1647,21 @@ class Ku_method( perma_base.PermafrostComponent ):
         #---------------------------------------------
         self.open_input_files()
         self.read_input_files()
+
+        #---------------------------------------------------------
+        # Inputs and outputs are kept in the same arrays for the
+        # whole run (scalars as 0-d arrays), so that references
+        # to them stay valid and nothing is reallocated yearly
+        #---------------------------------------------------------
+        for var in self.input_var_names:
+            setattr(self, var, self.state_array(getattr(self, var)))
+        grid_shape = np.broadcast(*[getattr(self, var) for var
+                                    in self.input_var_names]).shape
+        masked = any([np.ma.isMA(getattr(self, var))
+                      for var in self.input_var_names])
+        for var in ('Tps', 'Zal'):
+            value = np.full(grid_shape, -999.99)
+            self.set_output(var, np.ma.array(value) if masked else value)
         
         #        self.read_nc_lat_lon(self, file_name, var_type)
         
@@ -959,6 +1671,12 @@ class Ku_method( perma_base.PermafrostComponent ):
         #---------------------------------------------
         self.read_whole_soil_texture_from_GSD()  # import whole GSD      
         self.Extract_Soil_Texture_Loops_New()        # Extract soil texture for each cell.
+
+        #---------------------------------------------
+        # Open output files, which are appended to
+        # every year by save_grids()
+        #---------------------------------------------
+        self.open_output_files()
         
         #---------------------------
         # Initialize computed vars
@@ -985,15 +1703,27 @@ class Ku_method( perma_base.PermafrostComponent ):
             lon = None
             
         elif (var_type.lower() == 'grid'):
+            #----------------------------------------------
+            # Called once per run, by open_input_files()
+            #----------------------------------------------
+            lat_name = None
+            lon_name = None
             for var in file_unit.variables.keys():
                 if var[0:3] =='lat':
-                    lat = file_unit.variables[var][:]
+                    lat_name = var
                 if var[0:3] =='lon':
-                    lon = file_unit.variables[var][:]
+                    lon_name = var
+            with self.nc_lock:
+                lat = file_unit.variables[lat_name][:]
+                lon = file_unit.variables[lon_name][:]
 #            lon = self.ncread(file_unit, 'longitude')
             
             if (np.min(lon) > 0.):
             	lon = np.mod((lon+180.),360.) -180.
+
+            # Only the rows and columns of this tile, if any
+            lat = lat[self.grid_window[0]]
+            lon = lon[self.grid_window[1]]
             
 #            lat = np.float(lat)
 #            lon = np.float(lon)
@@ -1008,7 +1738,7 @@ class Ku_method( perma_base.PermafrostComponent ):
             return lat,lon
     
     def read_next_modified_KU(self, file_unit, var_type, \
-                  dtype='Float32', factor=1.0):
+                  dtype='Float32', factor=1.0, var_name=None):
     
         #-------------------------------------------------------
         # (5/7/09) Allow "dtype" to be given using RTI types.
@@ -1044,10 +1774,22 @@ class Ku_method( perma_base.PermafrostComponent ):
             #----------------------------------------------
 #            data = np.loadtxt(file_name)
 #            print self.cont
-            from netCDF4 import Dataset
-            for var in file_unit.variables.keys():
-                if (var != 'time' and var[0:3] !='lat' and var[0:3] != 'lon'):
-                    data  = file_unit.variables[var][self.cont,:,:]
+            index = int(self.cont)
+            (start, block) = self.grid_blocks.get(id(file_unit), (0, []))
+            if (start <= index < start + len(block)):
+                data = block[index - start]
+            elif (self.prefetched['index'] == index) and \
+               (id(file_unit) in self.prefetched['data']):
+                data = self.prefetched['data'].pop(id(file_unit))
+            else:
+                var  = self.nc_data_var_names[id(file_unit)]
+                data = file_unit.variables[var][(index,) + self.grid_window]
+
+        elif (var_type.lower() == 'forcing'):
+            #----------------------------------------------
+            # Grid from the multi-variable forcing file
+            #----------------------------------------------
+            data = self.read_forcing_slice(var_name, int(self.cont))
                                    
         else:
             raise RuntimeError('No match found for "var_type".')
@@ -1124,8 +1866,7 @@ class Ku_method( perma_base.PermafrostComponent ):
         #----------------------------------------------
         # Components use own self.time_sec by default.
         #-----------------------------------------------
-        if (self.SAVE_ALT_GRIDS):       
-        	self.save_grids()
+        self.save_grids()
 
         #-----------------------------
         # Update internal clock
@@ -1187,20 +1928,79 @@ class Ku_method( perma_base.PermafrostComponent ):
         #if (self.SAVE_CC_GRIDS):
         #    model_output.add_grid( self, self.Zal, 'Zal', self.time_min )
 
+    def open_output_files(self):
+
+        #---------------------------------------------------------
+        # Notes: ALT and TPS are written one year at a time by
+        #        save_grids() into files with an unlimited time
+        #        dimension, so the run is never held in memory.
+        #        A cfg file without the SAVE_*_GRIDS options
+        #        does not write that output.
+        #---------------------------------------------------------
+        self.ALT_unit = None
+        self.TPS_unit = None
+
+        if not hasattr(self, 'SAVE_ALT_GRIDS'):
+            self.SAVE_ALT_GRIDS = False
+        if not hasattr(self, 'SAVE_TPS_GRIDS'):
+            self.SAVE_TPS_GRIDS = False
+
+        if (self.SAVE_ALT_GRIDS):
+            self.ALT_file = self.out_directory + self.ALT_file
+            self.ALT_unit = model_output.open_new_gs_file(
+                self.ALT_file + '.nc', 'data', self.lat, self.lon,
+                long_name='Active Layer Thickness', units_name='m')
+
+        if (self.SAVE_TPS_GRIDS):
+            self.TPS_file = self.out_directory + self.TPS_file
+            self.TPS_unit = model_output.open_new_gs_file(
+                self.TPS_file + '.nc', 'data', self.lat, self.lon,
+                long_name='Temperature at top of permafrost',
+                units_name='degree C')
+
+    #   open_output_files()
+    #-------------------------------------------------------------------
+    def save_grids(self):
+
+        #-------------------------------------------
+        # Append the results of the current year
+        #-------------------------------------------
+        with self.nc_lock:
+            if (self.SAVE_ALT_GRIDS):
+                model_output.add_grid(self.ALT_unit, self.Zal, 'data', self.year)
+
+            if (self.SAVE_TPS_GRIDS):
+                model_output.add_grid(self.TPS_unit, self.Tps, 'data', self.year)
+
+    #   save_grids()
+    #-------------------------------------------------------------------
+    def save_grid_years(self, Zal, Tps, years):
+
+        #-------------------------------------------
+        # Append the results of several years, as
+        # stacked by compute_years(), in one block
+        #-------------------------------------------
+        with self.nc_lock:
+            if (self.SAVE_ALT_GRIDS):
+                model_output.add_grids(self.ALT_unit, Zal, 'data', years)
+
+            if (self.SAVE_TPS_GRIDS):
+                model_output.add_grids(self.TPS_unit, Tps, 'data', years)
+
+    #   save_grid_years()
+    #-------------------------------------------------------------------
     def close_output_files(self):
-        
-        tst = 'in progressing';
 
-        #if (self.SAVE_MR_GRIDS): model_output.close_gs_file( self, 'mr')
-#        if (self.SAVE_HS_GRIDS): model_output.close_gs_file( self, 'hs')
-        #if (self.SAVE_SW_GRIDS): model_output.close_gs_file( self, 'sw')
-        #if (self.SAVE_CC_GRIDS): model_output.close_gs_file( self, 'cc')
-        #-----------------------------------------------------------------
+        if (self.SAVE_ALT_GRIDS): model_output.close_gs_file(self.ALT_unit)
+        if (self.SAVE_TPS_GRIDS): model_output.close_gs_file(self.TPS_unit)
+
         #if (self.SAVE_MR_PIXELS): model_output.close_ts_file( self, 'mr')
         #if (self.SAVE_HS_PIXELS): model_output.close_ts_file( self, 'hs')
         #if (self.SAVE_SW_PIXELS): model_output.close_ts_file( self, 'sw')
         #if (self.SAVE_CC_PIXELS): model_output.close_ts_file( self, 'cc')
-        
+
+    #   close_output_files()
+    #-------------------------------------------------------------------
     def write_out_ncfile(self, output_file, varname):
 
         from netCDF4 import Dataset
@@ -1310,8 +2110,10 @@ class Ku_method( perma_base.PermafrostComponent ):
             #-----------------------------------------
             # Input file contains a time series and
             # is ASCII text with one value per line.
+            # It is loaded whole, and then served one
+            # value per timestep from memory.
             #-----------------------------------------
-            file_unit = open(input_file, 'r')
+            file_unit = model_input.TimeSeries(input_file)
         else:
             #--------------------------------------------
             # Input file contains a grid or grid stack
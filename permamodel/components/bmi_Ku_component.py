@@ -166,14 +166,6 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
         self._name = "Permamodel Ku Component"
         self._model.initialize(cfg_file=cfg_file)
         
-        # make 2 vars to store each results and used for write out.
-        n_lat = np.size(self._model.lat)
-        n_lon = np.size(self._model.lon) 
-        n_time = self._model.end_year-self._model.start_year+1
-                
-        self.output_alt = np.zeros((n_time,n_lat,n_lon))*np.nan;
-        self.output_tps = np.zeros((n_time,n_lat,n_lon))*np.nan;
-
         # Verify that all input and output variable names are in the
         # variable name and the units map
         for varname in self._input_var_names:
@@ -272,20 +264,17 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
         # Calculate the new frost number values
         self._model.update_ground_temperatures()
         self._model.update_ALT()
+
+        # (Zal and Tps are updated in place, so _values is still current)
+
+        self._model.cont = self._model.cont + 1
         
-        self._values['soil__active_layer_thickness'] = self._model.Zal
-        self._values['soil__temperature'] = self._model.Tps
-        
+        # Append this year's ALT and TPS to the output files
+        self._model.save_grids()
+
         # Update the time
         self._model.year += self._model.dt
-        
-        self._model.cont = self._model.cont + 1
-        
-#        self.output_alt = np.append(self.output_alt, self._model.Zal)
-#        self.output_tps = np.append(self.output_tps, self._model.Tps)
-        self.output_alt[self._model.cont,:,:] = self._model.Zal
-        self.output_tps[self._model.cont,:,:] = self._model.Tps
-        
+
         # Get new input values
         self._model.read_input_files()
         
@@ -297,8 +286,15 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
     
     def update_until(self, then):
         n_steps = (then - self.get_current_time()) / self.get_time_step()
-        for _ in xrange(int(n_steps)):
-            self.update()
+        if np.size(self._model.T_air) > 1:
+            # Nothing sets the inputs between these years, so the
+            # grids of all of them are read, computed and saved at once
+            assert(self._model.status == 'initialized')
+            self._model.update_years(int(n_steps))
+        else:
+            # (the update methods treat single sites separately)
+            for _ in xrange(int(n_steps)):
+                self.update()
         self.update_frac(n_steps - int(n_steps))
 
     def finalize(self):
@@ -310,7 +306,8 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
         # Close the input files
         self._model.close_input_files()   # Close any input files
 
-        # Write output last output
+        # Close the output files, which were written year by year
+        self._model.close_output_files()
         self.save_grids()
         
         # Done finalizing  
@@ -348,10 +345,26 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
         array_like
             Value array.
         """
-        return self._values[var_name]
+        return self.get_value_ptr(var_name)
+
+    def get_value_ptr(self, var_name):
+        # The model's own variable, not the one captured in _values
+        # by initialize(), which the model may since have replaced
+        return getattr(self._model, self._var_name_map[var_name])
 
     def set_value(self, var_name, new_var_values):
-        self._values[var_name] = new_var_values
+        model_var = self._var_name_map[var_name]
+        values = self.get_value_ptr(var_name)
+        if isinstance(values, np.ndarray) and \
+                np.size(new_var_values) == values.size:
+            # In place, so references to the array stay valid
+            values[...] = np.reshape(new_var_values, values.shape)
+        else:
+            setattr(self._model, model_var,
+                    np.array(new_var_values, dtype=np.float64))
+        # Intermediates computed from the old values are out of date
+        if model_var in self._model.input_var_names:
+            self._model.mark_input_changed(model_var)
 
     def set_value_at_indices(self, var_name, new_var_values, indices):
         self.get_value_ref(var_name).flat[indices] = new_var_values
@@ -365,36 +378,6 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
     def get_var_nbytes(self, var_name):
         return np.asarray(self.get_value_ref(var_name)).nbytes
 
-    def get_value(self, var_name):
-        """Copy of values.
-
-        Parameters
-        ----------
-        var_name : str
-            Name of variable as CSDMS Standard Name.
-
-        Returns
-        -------
-        array_like
-            Copy of values.
-        """
-        # Original version: from bmi_heat.py
-        #return self.get_value_ref(var_name).copy()
-
-        # Version to convert to numpy array for bmi-tester compliance
-        # Note: converting to np arrays on the fly here
-        # Note: float values don't have a copy() function
-        #try:
-        #    return np.array(self.get_value_ref(var_name).copy())
-        #except AttributeError:
-        #    return np.array(self.get_value_ref(var_name))
-
-        # This version is simpler than above, but it may break when
-        #   using scalars because the resulting variable doesn't
-        #   have a shape
-        return np.asarray(self.get_value_ref(var_name))
-
-
     def get_var_type(self, var_name):
         """Data type of variable.
 
@@ -481,29 +464,17 @@ class BmiKuMethod( perma_base.PermafrostComponent ):
         return len(self.get_grid_shape(var_id))
 
     def save_grids(self):
-        # Saves the grid values based on the prescribed ones in cfg file
+        # The grids have already been appended to the output files
+        # by update(); just report which files were written
 
-        #if (self.SAVE_MR_GRIDS):
-        #    model_output.add_grid( self, self.T_air, 'T_air', self.time_min )
-#        self.ALT_file  = self.out_directory + self.ALT_file
-        try:        
-            assert self._model.SAVE_ALT_GRIDS
-        except:
+        if not (self._model.SAVE_ALT_GRIDS):
             print 'NO OUTPUT of ALT'
-        try:
-            assert self._model.SAVE_TPS_GRIDS
-        except:
+        if not (self._model.SAVE_TPS_GRIDS):
             print 'NO OUTPUT of TPS'
-            
-        if (self._model.SAVE_ALT_GRIDS):
-            
-            self._model.write_out_ncfile(self._model.ALT_file, self.output_alt)
-            
-#        self.TPS_file  = self.out_directory + self.TPS_file
-        
-        if (self._model.SAVE_TPS_GRIDS):
-            self._model.write_out_ncfile(self._model.TPS_file,self.output_tps)
-        
+
         print "***"
         print "Writing output finished!"
-        print "Please look at"+self._model.ALT_file+'.nc and '+self._model.TPS_file+'.nc'
+        if (self._model.SAVE_ALT_GRIDS):
+            print "Please look at "+self._model.ALT_file+'.nc'
+        if (self._model.SAVE_TPS_GRIDS):
+            print "Please look at "+self._model.TPS_file+'.nc'
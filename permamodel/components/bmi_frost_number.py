@@ -110,13 +110,20 @@ class BmiFrostnumberMethod(perma_base.PermafrostComponent):
         # Set the internal (frost number) variables that correspond
         # to the input and output variable names
         # Note: since we used Topoflow's _var_name_map for this, it is that
+        # Note: the model replaces its (scalar) frost numbers every year,
+        #       so they are copied into these arrays, which stay the same
+        #       for the whole run (see get_value_ptr())
         self._values = {
-            # These are the links to the model's variables and
+            # These hold the values of the model's variables and
             # should be consistent with _var_name_map
-            'atmosphere_bottom_air__temperature':    self._model.T_air,
-            'frostnumber__air':         self._model.air_frost_number,
-            'frostnumber__surface':     self._model.surface_frost_number,
-            'frostnumber__stefan':      self._model.stefan_frost_number}
+            'atmosphere_bottom_air__temperature':
+            np.array(self._model.T_air),
+            'frostnumber__air':
+            np.array(self._model.air_frost_number),
+            'frostnumber__surface':
+            np.array(self._model.surface_frost_number),
+            'frostnumber__stefan':
+            np.array(self._model.stefan_frost_number)}
 
     def get_attribute(self, att_name):
         try:
@@ -148,7 +155,7 @@ class BmiFrostnumberMethod(perma_base.PermafrostComponent):
             and has different number of arguments """
         # Calculate the new frost number values
         self._model.update()
-        self._values['frostnumber__air'] = self._model.air_frost_number
+        self.update_values()
 
     def update_frac(self, time_fraction):
         """ This is for BMI compliance """
@@ -156,7 +163,17 @@ class BmiFrostnumberMethod(perma_base.PermafrostComponent):
         # Currently, only non-fractions are allowed, but this could be
         #  0, 1, 2, ...
         self._model.update(frac=time_fraction)
-        self._values['frostnumber__air'] = self._model.air_frost_number
+        self.update_values()
+
+    def update_values(self):
+        """ Copy the model's new frost numbers into the BMI arrays """
+        for var_name in self._output_var_names:
+            values = self._values[var_name]
+            new_values = getattr(self._model, self._var_name_map[var_name])
+            if np.shape(new_values) == values.shape:
+                values[...] = new_values
+            else:
+                self._values[var_name] = np.array(new_values)
 
     def get_year_from_timestep(self, this_timestep):
         """ given the timestep, return the year """
@@ -184,10 +201,8 @@ class BmiFrostnumberMethod(perma_base.PermafrostComponent):
             # print("This year is end_year, so update_frac(0)")
             self.update_frac(0)
         else:
-            year = self._model.year
-            while year < stop_year:
-                self.update()
-                year = self._model.year
+            self._model.update_until_year(stop_year)
+            self.update_values()
 
     def finalize(self):
         """ BMI-required, wrap up all things including writing output """
@@ -229,10 +244,6 @@ class BmiFrostnumberMethod(perma_base.PermafrostComponent):
         """
         return self._values[var_name]
 
-    def set_value(self, var_name, new_var_values):
-        """ BMI: allow external set-access to model variable """
-        self._values[var_name] = new_var_values
-
     def set_value_at_indices(self, var_name, new_var_values, indices):
         """ BMI: allow external set-access to model array variable """
         self.get_value_ref(var_name).flat[indices] = new_var_values
@@ -249,35 +260,6 @@ class BmiFrostnumberMethod(perma_base.PermafrostComponent):
         """ BMI: number of bytes of a variable """
         return np.asarray(self.get_value_ref(var_name)).nbytes
 
-    def get_value(self, var_name):
-        """Copy of values.
-
-        Parameters
-        ----------
-        var_name : str
-            Name of variable as CSDMS Standard Name.
-
-        Returns
-        -------
-        array_like
-            Copy of values.
-        """
-        # Original version: from bmi_heat.py
-        #return self.get_value_ref(var_name).copy()
-
-        # Version to convert to numpy array for bmi-tester compliance
-        # Note: converting to np arrays on the fly here
-        # Note: float values don't have a copy() function
-        #try:
-        #    return np.array(self.get_value_ref(var_name).copy())
-        #except AttributeError:
-        #    return np.array(self.get_value_ref(var_name))
-
-        # This version is simpler than above, but it may break when
-        #   using scalars because the resulting variable doesn't
-        #   have a shape
-        return np.asarray(self.get_value_ref(var_name))
-
     def get_var_type(self, var_name):
         """Data type of variable.
 
@@ -196,9 +196,11 @@ class BmiFrostnumberGeoMethod(perma_base.PermafrostComponent):
             print("  setting stop_year to end_date")
             stop_year = self._model._end_date.year
 
-        # Implement the loop to update until stop_year
-        while self._model._date_current.year < stop_year:
-            self.update()
+        # The years up to stop_year are computed at once, rather than
+        # with a loop of update()
+        self._model.run_until_timestep(
+            stop_year - self._model._reference_date.year)
+        self._values['frostnumber__air'] = self._model.air_frost_number_Geo
 
     def finalize(self):
         # frost_number_Geo has a finalize() method
@@ -225,13 +227,11 @@ class BmiFrostnumberGeoMethod(perma_base.PermafrostComponent):
     def get_time_step(self):
         return self._model._timestep_duration
 
+    # get_value_ptr(), get_value() and set_value() are inherited from
+    # PermafrostComponent; the arrays in _values are the model's own
     def get_value_ref(self, var_name):
         return self._values[var_name]
 
-    def set_value(self, var_name, new_var_values):
-        val = self.get_value_ref(var_name)
-        val.flat = new_var_values
-
     def set_value_at_indices(self, var_name, indices, new_var_values):
         self.get_value_ref(var_name).flat[indices] = new_var_values
 
@@ -244,9 +244,6 @@ class BmiFrostnumberGeoMethod(perma_base.PermafrostComponent):
     def get_var_nbytes(self, var_name):
         return np.asarray(self.get_value_ref(var_name)).nbytes
 
-    def get_value(self, var_name):
-        return self.get_value_ref(var_name).copy()
-
     def get_var_type(self, var_name):
         return str(self.get_value_ref(var_name).dtype)
 
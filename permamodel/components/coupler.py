@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""  In-process coupling of BMI components
+
+     A Coupler drives a list of BMI components, in order, on a common
+     clock.  Each exchanged variable, given as a mapping of the output
+     (standard) name of one component to the input name of others, has
+     one buffer allocated for the whole run: after a component's
+     update, its output is copied into the buffer with
+     get_value(name, dest=buffer), and before the update of a component
+     which uses it, the buffer is passed to set_value(), which copies
+     it into the component's own input array.  The exchanged grids are
+     not reallocated while the run goes on.
+
+     At each step of the clock, every component whose current time is
+     behind the clock is updated until it has caught up, so components
+     with longer time steps hold their outputs for several steps.
+
+     A PipelinedCoupler runs the upstream components (by default,
+     those which take no inputs from the others) on a worker thread,
+     one step ahead of the downstream ones: while the downstream
+     components compute step t, the upstream ones already produce
+     step t + 1.  Their outputs are handed over in one of two sets of
+     buffers (a double buffer), so the worker is never more than one
+     step ahead, and the steps are consumed in order, giving the same
+     results as a Coupler.  An error on the worker is raised by run().
+
+     Selected variables are written, at each step, to one NetCDF file
+     with a chunk per step and variable, from a background thread
+     (see model_output.AsyncGridWriter), which is handed a copy of
+     each grid it writes.
+
+     Usage:
+
+        cru = BmiCruAKtempMethod()
+        fng = BmiFrostnumberGeoMethod()
+        cru.initialize('cruAKtemp_component.cfg')
+        fng.initialize('FNGeo_component.cfg')
+        coupler = Coupler(
+            [cru, fng],
+            {'atmosphere_bottom_air__temperature_mean_jan':
+             'atmosphere_bottom_air__temperature_mean_jan',
+             'atmosphere_bottom_air__temperature_mean_jul':
+             'atmosphere_bottom_air__temperature_mean_jul'},
+            output_file='fn_air.nc', output_vars=['frostnumber__air'],
+            update_at_start=[fng])
+        coupler.run()
+
+*The MIT License (MIT)*
+
+Copyright (c) 2016 permamodel
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+from netCDF4 import Dataset
+from permamodel.utils import model_output
+
+# Times closer than this are the same time of the coupler's clock
+time_tolerance = 1.0e-6
+
+
+def find_exchanges(components, exchanges):
+    """ The producing component and consuming components of each
+    exchanged variable, as a list of (output_name, producer,
+    [(consumer, input_name), ...])
+
+    exchanges maps an output name to an input name, or to a list of
+    input names.  Each output must come from exactly one component.
+    """
+    found = []
+    for (output_name, input_names) in sorted(exchanges.items()):
+        if isinstance(input_names, basestring):
+            input_names = [input_names]
+        producers = [component for component in components
+                     if output_name in component.get_output_var_names()]
+        if len(producers) != 1:
+            raise ValueError("%d components have the output %s"
+                             % (len(producers), output_name))
+        consumers = [(component, input_name)
+                     for input_name in input_names
+                     for component in components
+                     if input_name in component.get_input_var_names()]
+        if not consumers:
+            raise ValueError("No component has the input(s) %s"
+                             % ', '.join(input_names))
+        found.append((output_name, producers[0], consumers))
+    return found
+
+
+def open_output_file(output_file, var_shapes, complevel=4):
+    """ A NetCDF file for the (n_time, ...) grids of the variables in
+    var_shapes, chunked as one grid per timestep """
+    shapes = set(var_shapes.values())
+    if len(shapes) > 1:
+        raise ValueError("Output variables have different shapes: %s"
+                         % ', '.join([str(shape) for shape in shapes]))
+    shape = shapes.pop() if shapes else ()
+    dim_names = ('y', 'x')[2 - len(shape):] if len(shape) <= 2 else \
+                tuple(['dim_%d' % n for n in range(len(shape))])
+
+    ncid = Dataset(output_file, 'w', format='NETCDF4')
+    ncid.createDimension('time', None)
+    time = ncid.createVariable('time', np.dtype('float64').char, ('time',))
+    time.long_name = 'time of the coupled run'
+    for (dim_name, size) in zip(dim_names, shape):
+        ncid.createDimension(dim_name, size)
+    for var_name in var_shapes:
+        ncid.createVariable(var_name, np.dtype('float32').char,
+                            ('time',) + dim_names,
+                            zlib=(complevel > 0),
+                            complevel=max(complevel, 1),
+                            chunksizes=(1,) + shape,
+                            fill_value=np.float32(-999.99))
+    return ncid
+
+
+class Coupler(object):
+    """ Drives BMI components in order, exchanging variables through
+    buffers allocated once for the whole run """
+
+    def __init__(self, components, exchanges, output_file=None,
+                 output_vars=(), time_step=None, end_time=None,
+                 update_at_start=()):
+        """ components are initialized BMI components, updated in this
+        order at each step; exchanges maps output to input names (see
+        find_exchanges()).  The values of output_vars are written to
+        output_file at the start and after each step.
+
+        The clock's time step and end time default to the smallest of
+        the components'.  The components of update_at_start are
+        updated by update_frac(0) once their initial inputs are set,
+        so that their outputs are those of the start time (as for
+        FrostnumberGeo getting its inputs from another component).
+        """
+        self.components = list(components)
+        self.exchanges = find_exchanges(self.components, exchanges)
+        self.output_file = output_file
+        self.output_vars = list(output_vars)
+        self.update_at_start = list(update_at_start)
+
+        if time_step is None:
+            time_step = min([component.get_time_step()
+                             for component in self.components])
+        if end_time is None:
+            end_time = min([component.get_end_time()
+                            for component in self.components])
+        self.time_step = float(time_step)
+        self.end_time = float(end_time)
+        self.time = min([component.get_current_time()
+                         for component in self.components])
+
+        self.output_components = {}
+        for var_name in self.output_vars:
+            owners = [component for component in self.components
+                      if var_name in component.get_output_var_names()]
+            if not owners:
+                raise ValueError("No component has the output %s"
+                                 % var_name)
+            self.output_components[var_name] = owners[0]
+
+        # One buffer per exchanged variable, shaped as the output
+        self.buffers = {}
+        for (output_name, producer, _) in self.exchanges:
+            self.buffers[output_name] = \
+                self.make_buffer(output_name, producer)
+
+        self.ncid = None
+        self.writer = None
+        self.n_written = 0
+
+    def make_buffer(self, output_name, producer):
+        """ The buffer of an exchanged variable """
+        return np.array(producer.get_value_ptr(output_name), copy=True)
+
+    def get_inputs(self, component, buffers=None):
+        """ Copy the buffers (self.buffers by default) into the inputs of
+        component """
+        if buffers is None:
+            buffers = self.buffers
+        for (output_name, _, consumers) in self.exchanges:
+            for (consumer, input_name) in consumers:
+                if consumer is component:
+                    component.set_value(input_name, buffers[output_name])
+
+    def put_outputs(self, component):
+        """ Copy the outputs of component into their buffers """
+        for (output_name, producer, _) in self.exchanges:
+            if producer is component:
+                producer.get_value(output_name,
+                                   dest=self.buffers[output_name])
+
+    def advance(self, component, time, buffers=None):
+        """ Update component until it has caught up with time """
+        if component.get_current_time() >= time - time_tolerance:
+            return
+        self.get_inputs(component, buffers)
+        while component.get_current_time() < time - time_tolerance:
+            component.update()
+        self.put_outputs(component)
+
+    def start(self):
+        """ Exchange the initial values and write them """
+        for component in self.components:
+            self.put_outputs(component)
+        for component in self.components:
+            self.get_inputs(component)
+            if component in self.update_at_start:
+                component.update_frac(0)
+                self.put_outputs(component)
+
+        self.open_output(dict(
+            [(var_name, np.shape(component.get_value_ptr(var_name)))
+             for (var_name, component) in self.output_components.items()]))
+        self.write_outputs()
+
+    def open_output(self, var_shapes):
+        """ Open the output file (if any) and its writer """
+        if (self.output_file is not None) and self.output_vars:
+            self.ncid = open_output_file(self.output_file, var_shapes)
+            self.writer = model_output.AsyncGridWriter(self.ncid)
+
+    def step_times(self):
+        """ The times of the clock at the end of each step still to run """
+        times = []
+        time = self.time
+        while time < self.end_time - time_tolerance:
+            time = min(time + self.time_step, self.end_time)
+            times.append(time)
+        return times
+
+    def step(self):
+        """ Advance the clock by one time step (but not past the end) and
+        update each component, in order, until it has caught up """
+        self.time = min(self.time + self.time_step, self.end_time)
+        for component in self.components:
+            self.advance(component, self.time)
+        self.write_outputs()
+
+    def write_outputs(self, values=None):
+        """ Queue the output variables of this time for writing; those in
+        the dict values are taken from it rather than their component """
+        if self.writer is None:
+            return
+        self.writer.write('time', self.n_written, self.time)
+        for (var_name, component) in self.output_components.items():
+            if (values is not None) and (var_name in values):
+                self.writer.write(var_name, self.n_written, values[var_name])
+            else:
+                self.writer.write(var_name, self.n_written,
+                                  component.get_value_ptr(var_name))
+        self.n_written += 1
+
+    def finish(self):
+        """ Wait for the output to be written and close its file """
+        try:
+            if self.writer is not None:
+                self.writer.close()
+        finally:
+            self.writer = None
+            if self.ncid is not None:
+                self.ncid.close()
+                self.ncid = None
+
+    def run(self):
+        """ Run the coupled components from the start to the end time;
+        the components are not finalized """
+        self.start()
+        try:
+            for _ in self.step_times():
+                self.step()
+        finally:
+            self.finish()
+
+
+class PipelinedCoupler(Coupler):
+    """ A Coupler whose upstream components run a step ahead of the
+    downstream ones, on a worker thread """
+
+    def __init__(self, components, exchanges, upstream=None, **kwargs):
+        """ The components of upstream (by default, those whose inputs
+        are not exchanged) may not take inputs from the others; the
+        other arguments are those of Coupler """
+        Coupler.__init__(self, components, exchanges, **kwargs)
+
+        if upstream is None:
+            consumers = set([consumer for (_, _, consumer_list)
+                             in self.exchanges
+                             for (consumer, _) in consumer_list])
+            upstream = [component for component in self.components
+                        if component not in consumers]
+        self.upstream = [component for component in self.components
+                         if component in upstream]
+        self.downstream = [component for component in self.components
+                           if component not in upstream]
+        if not (self.upstream and self.downstream):
+            raise ValueError("A pipeline needs upstream and downstream "
+                             "components")
+        for (output_name, producer, consumers) in self.exchanges:
+            if (producer in self.downstream) and \
+               any([consumer in self.upstream
+                    for (consumer, _) in consumers]):
+                raise ValueError("Upstream components cannot take %s from "
+                                 "a downstream component" % output_name)
+
+        #---------------------------------------------------------
+        # What the worker hands over at each step: the exchanged
+        # outputs of the upstream components, and those of their
+        # outputs which are written to the output file
+        #---------------------------------------------------------
+        self.handed_over = [output_name for (output_name, producer, _)
+                            in self.exchanges
+                            if producer in self.upstream]
+        self.handed_over_outputs = [
+            var_name for (var_name, component)
+            in self.output_components.items()
+            if (component in self.upstream) and
+            (var_name not in self.handed_over)]
+        self.slots = [self.make_slot(), self.make_slot()]
+
+    def make_slot(self):
+        """ One set of buffers for the values handed over at a step """
+        slot = {}
+        for output_name in self.handed_over:
+            slot[output_name] = np.empty_like(self.buffers[output_name])
+        for var_name in self.handed_over_outputs:
+            slot[var_name] = np.array(
+                self.output_components[var_name].get_value_ptr(var_name),
+                copy=True)
+        return slot
+
+    def fill_slot(self, slot):
+        """ Copy the values handed over at this step into slot """
+        for output_name in self.handed_over:
+            slot[output_name][...] = self.buffers[output_name]
+        for var_name in self.handed_over_outputs:
+            self.output_components[var_name].get_value(var_name,
+                                                       dest=slot[var_name])
+
+    def produce(self, times, free_slots, full_slots, stop):
+        """ Worker: run the upstream components through times, handing
+        each step over in a free slot, until stop is set """
+        for time in times:
+            slot = free_slots.get()
+            if stop.is_set():
+                return
+            try:
+                for component in self.upstream:
+                    self.advance(component, time)
+                self.fill_slot(slot)
+            except Exception as error:
+                full_slots.put((time, None, error))
+                return
+            full_slots.put((time, slot, None))
+
+    def run(self):
+        """ Run the coupled components from the start to the end time,
+        the upstream components a step ahead; the components are not
+        finalized """
+        self.start()
+        times = self.step_times()
+        free_slots = queue.Queue()
+        full_slots = queue.Queue()
+        for slot in self.slots:
+            free_slots.put(slot)
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=self.produce, args=(times, free_slots, full_slots, stop))
+        worker.daemon = True
+        worker.start()
+        try:
+            for time in times:
+                (_, slot, error) = full_slots.get()
+                if error is not None:
+                    raise error
+                self.time = time
+                buffers = dict(self.buffers)
+                buffers.update(slot)
+                for component in self.downstream:
+                    self.advance(component, time, buffers)
+                self.write_outputs(slot)
+                free_slots.put(slot)
+        finally:
+            # (the worker may be waiting for a free slot)
+            stop.set()
+            free_slots.put(None)
+            worker.join()
+            self.finish()
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""  Domain decomposition of Ku and FrostnumberGeo runs into tiles
+
+     A model cfg file is partitioned into K tiles of its grid.  Each
+     tile gets its own directory holding a cfg file (the original one,
+     with the tile_* keys added and its own output directory) and,
+     once it has run, its output files and a completion marker.  A
+     JSON manifest in the job directory lists the tiles.  The tiles
+     are independent, so each can be run on any host that sees the
+     job directory and the input files; run_tiles() runs them as
+     separate processes on the local machine.  merge() checks that
+     every tile is complete and reassembles the output files of the
+     whole grid.
+
+     Usage:
+
+        python -m permamodel.components.domain_decomposition \\
+            partition Ku_method_2D.cfg 16 ku_job
+        python -m permamodel.components.domain_decomposition \\
+            run ku_job/manifest.json --tile tile_003
+        python -m permamodel.components.domain_decomposition \\
+            merge ku_job/manifest.json
+
+     or, on one machine:
+
+        manifest_file = partition('Ku_method_2D.cfg', 16, 'ku_job')
+        run_tiles(manifest_file, n_processes=8)
+        merge(manifest_file)
+
+*The MIT License (MIT)*
+
+Copyright (c) 2016 permamodel
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from collections import OrderedDict
+from netCDF4 import Dataset
+from permamodel import permamodel_directory
+from permamodel.utils import model_output
+from permamodel.components import bmi_Ku_component
+from permamodel.components import frost_number_Geo
+
+manifest_filename = 'manifest.json'
+complete_filename = 'tile_complete'
+tile_keys = ('tile_first_row', 'tile_first_column',
+             'tile_rows', 'tile_columns')
+ku_input_vars = ('T_air', 'A_air', 'h_snow', 'rho_snow', 'vwc_H2O',
+                 'Hvgf', 'Hvgt', 'Dvf', 'Dvt')
+
+
+def read_cfg_values(cfg_file):
+    """ The (string) values of a 'name | value | type | help' cfg file """
+    values = OrderedDict()
+    with open(cfg_file, 'r') as cfg_unit:
+        for line in cfg_unit:
+            words = line.split('|')
+            if len(words) == 4 and not line.startswith('#'):
+                values[words[0].strip()] = words[1].strip()
+    return values
+
+
+def write_tile_cfg(cfg_file, tile_cfg_file, replacements, added_lines):
+    """ Copy a cfg file, replacing the values of some keys """
+    with open(cfg_file, 'r') as in_cfg:
+        lines = in_cfg.readlines()
+    with open(tile_cfg_file, 'w') as out_cfg:
+        for line in lines:
+            words = line.split('|')
+            key = words[0].strip()
+            if len(words) == 4 and not line.startswith('#') and \
+                    key in replacements:
+                words[1] = ' %s ' % replacements[key]
+                line = '|'.join(words)
+            out_cfg.write(line)
+        out_cfg.write('# Tile of the grid of %s\n' % os.path.abspath(cfg_file))
+        out_cfg.writelines(added_lines)
+
+
+def split_grid(grid_shape, n_tiles):
+    """ Split a (ydim, xdim) grid into n_tiles (j0, i0, ydim, xdim) tiles,
+    using the factorization of n_tiles which gives the squarest tiles
+    """
+    (ydim, xdim) = grid_shape
+    layouts = [(n_rows, n_tiles // n_rows)
+               for n_rows in range(1, n_tiles + 1)
+               if n_tiles % n_rows == 0 and n_rows <= ydim and
+               n_tiles // n_rows <= xdim]
+    if not layouts:
+        raise ValueError('A %d x %d grid cannot be split into %d tiles'
+                         % (ydim, xdim, n_tiles))
+    (n_rows, n_columns) = min(
+        layouts, key=lambda layout: abs(float(ydim) / layout[0] -
+                                        float(xdim) / layout[1]))
+
+    row_edges = [ydim * k // n_rows for k in range(n_rows + 1)]
+    column_edges = [xdim * k // n_columns for k in range(n_columns + 1)]
+    return [(row_edges[j], column_edges[i],
+             row_edges[j + 1] - row_edges[j],
+             column_edges[i + 1] - column_edges[i])
+            for j in range(n_rows) for i in range(n_columns)]
+
+
+def describe_ku(cfg_file, values):
+    """ Grid, output files and tile cfg settings of a Ku cfg file """
+    #----------------------------------------------------------
+    # Notes: As in BMI_base.check_directories(), an input
+    #        directory starting with '.' is the directory of
+    #        the cfg file.  The tile cfg files get absolute
+    #        input and output directories.
+    #----------------------------------------------------------
+    in_directory = values.get('in_directory', '')
+    if in_directory.startswith('.'):
+        in_directory = os.path.dirname(os.path.realpath(cfg_file))
+    in_directory = os.path.abspath(os.path.expanduser(in_directory))
+
+    gridded_file = None
+    for var in ku_input_vars:
+        var_type = values.get(var + '_type', 'Scalar').lower()
+        if var_type == 'forcing':
+            gridded_file = values['forcing_file']
+        elif var_type == 'grid':
+            gridded_file = values[var + '_file']
+        if gridded_file is not None:
+            break
+    if gridded_file is None:
+        raise ValueError('%s has no Grid or Forcing input to decompose'
+                         % cfg_file)
+
+    ncid = Dataset(os.path.join(in_directory, gridded_file), 'r')
+    try:
+        (lat, lon) = [[ncid.variables[name] for name in ncid.variables
+                       if name[0:3] == prefix][0] for prefix in ('lat', 'lon')]
+        grid_shape = (len(lat), len(lon))
+    finally:
+        ncid.close()
+
+    prefixes = {'[site_prefix]': values.get('site_prefix', ''),
+                '[case_prefix]': values.get('case_prefix', '')}
+    outputs = []
+    for output in ('ALT', 'TPS'):
+        if values.get('SAVE_%s_GRIDS' % output, 'No').lower() != 'yes':
+            continue
+        output_file = values['%s_file' % output]
+        if output_file[:13] in prefixes:
+            output_file = prefixes[output_file[:13]] + output_file[13:]
+        outputs.append(output_file + '.nc')
+
+    return {'model': 'Ku', 'grid_shape': grid_shape,
+            'y_dim': 'lat', 'x_dim': 'lon', 'outputs': outputs,
+            'key_type': 'long',
+            'replacements': {'in_directory': in_directory + os.sep},
+            'output_directory_key': 'out_directory'}
+
+
+def describe_frostnumber_geo(cfg_file, values):
+    """ Grid, output files and tile cfg settings of a FrostnumberGeo cfg """
+    if values.get('input_var_source') == 'WMT':
+        raise ValueError('%s gets its input from WMT and cannot be tiled'
+                         % cfg_file)
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_file)
+    grid_shape = fn_geo.get_config_from_oldstyle_file(cfg_file)['grid_shape']
+    return {'model': 'FrostnumberGeo', 'grid_shape': tuple(grid_shape),
+            'y_dim': 'y', 'x_dim': 'x',
+            'outputs': [values['output_filename']],
+            'key_type': 'int', 'replacements': {},
+            'output_directory_key': 'output_directory'}
+
+
+def describe_model(cfg_file):
+    """ Which model a cfg file is for, and how to tile it """
+    values = read_cfg_values(cfg_file)
+    if values.get('config_for_method') == 'FrostnumberGeoMethod':
+        return describe_frostnumber_geo(cfg_file, values)
+    if 'T_air_type' in values:
+        return describe_ku(cfg_file, values)
+    raise ValueError('%s is not a Ku or FrostnumberGeo cfg file' % cfg_file)
+
+
+def partition(cfg_file, n_tiles, job_directory, tiles=None):
+    """ Write the cfg files of n_tiles tiles of a run and their manifest;
+    returns the name of the manifest file
+
+    tiles, a list of (j0, i0, ydim, xdim), may be given instead of n_tiles.
+    """
+    model = describe_model(cfg_file)
+    if tiles is None:
+        tiles = split_grid(model['grid_shape'], n_tiles)
+    job_directory = os.path.abspath(job_directory)
+    if not os.path.isdir(job_directory):
+        os.makedirs(job_directory)
+
+    manifest = OrderedDict([
+        ('model', model['model']),
+        ('cfg_file', os.path.abspath(cfg_file)),
+        ('grid_shape', list(model['grid_shape'])),
+        ('y_dim', model['y_dim']),
+        ('x_dim', model['x_dim']),
+        ('outputs', model['outputs']),
+        ('tiles', [])])
+
+    for (n, tile) in enumerate(tiles):
+        name = 'tile_%03d' % n
+        tile_directory = os.path.join(job_directory, name)
+        if not os.path.isdir(tile_directory):
+            os.makedirs(tile_directory)
+        tile_cfg_file = os.path.join(tile_directory,
+                                     os.path.basename(cfg_file))
+
+        replacements = dict(model['replacements'])
+        replacements[model['output_directory_key']] = tile_directory + os.sep
+        added_lines = ['%-24s | %-6d | %-6s | tile of the grid\n' %
+                       (key, value, model['key_type'])
+                       for (key, value) in zip(tile_keys, tile)]
+        write_tile_cfg(cfg_file, tile_cfg_file, replacements, added_lines)
+
+        manifest['tiles'].append(OrderedDict([
+            ('name', name),
+            ('offset', list(tile[:2])),
+            ('shape', list(tile[2:])),
+            ('cfg_file', os.path.relpath(tile_cfg_file, job_directory))]))
+
+    manifest_file = os.path.join(job_directory, manifest_filename)
+    with open(manifest_file, 'w') as manifest_unit:
+        json.dump(manifest, manifest_unit, indent=2)
+    return manifest_file
+
+
+def read_manifest(manifest_file):
+    """ The manifest of a partitioned run """
+    with open(manifest_file, 'r') as manifest_unit:
+        return json.load(manifest_unit)
+
+
+def tile_directory(manifest_file, tile):
+    """ The directory of one tile (an entry of the manifest's tiles) """
+    return os.path.join(os.path.dirname(os.path.abspath(manifest_file)),
+                        tile['name'])
+
+
+def run_tile(manifest_file, tile_name):
+    """ Run the model on one tile of a partitioned run """
+    manifest = read_manifest(manifest_file)
+    tile = [tile for tile in manifest['tiles'] if tile['name'] == tile_name]
+    if not tile:
+        raise ValueError('No tile %s in %s' % (tile_name, manifest_file))
+    directory = tile_directory(manifest_file, tile[0])
+    cfg_file = os.path.join(directory, os.path.basename(tile[0]['cfg_file']))
+
+    complete_file = os.path.join(directory, complete_filename)
+    if os.path.exists(complete_file):
+        os.remove(complete_file)
+
+    if manifest['model'] == 'Ku':
+        ku = bmi_Ku_component.BmiKuMethod()
+        ku.initialize(cfg_file)
+        while ku.get_current_time() < ku.get_end_time():
+            ku.update()
+        ku.finalize()
+    else:
+        fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_file)
+        fn_geo.initialize_frostnumberGeo_component()
+        fn_geo.run_all_timesteps()
+        fn_geo.finalize()
+
+    # Only a tile which ran to the end is marked complete
+    with open(complete_file, 'w') as complete_unit:
+        complete_unit.write('%s\n' % tile_name)
+    return tile_name
+
+
+def missing_tiles(manifest_file):
+    """ Names of the tiles which are not complete """
+    manifest = read_manifest(manifest_file)
+    missing = []
+    for tile in manifest['tiles']:
+        directory = tile_directory(manifest_file, tile)
+        files = [complete_filename] + manifest['outputs']
+        if not all([os.path.exists(os.path.join(directory, name))
+                    for name in files]):
+            missing.append(tile['name'])
+    return missing
+
+
+def run_tile_process(manifest_file, tile_name):
+    """ Run one tile in a new Python process, as on another host """
+    #----------------------------------------------------------
+    # Notes: A forked worker would inherit the HDF5 state and
+    #        open NetCDF files of this process, which breaks
+    #        its own NetCDF access, so each tile is run by a
+    #        fresh interpreter instead.
+    #----------------------------------------------------------
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(permamodel_directory)] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    subprocess.check_call(
+        [sys.executable, '-m', 'permamodel.components.domain_decomposition',
+         'run', os.path.abspath(manifest_file), '--tile', tile_name,
+         '--processes', '1'], env=env)
+    return tile_name
+
+
+def run_tiles(manifest_file, n_processes=None, tile_names=None):
+    """ Run the tiles which are not complete (or those of tile_names) on a
+    pool of processes (all cores by default)
+    """
+    if tile_names is None:
+        tile_names = missing_tiles(manifest_file)
+    if n_processes == 1:
+        return [run_tile(manifest_file, name) for name in tile_names]
+
+    pool = ThreadPool(n_processes or multiprocessing.cpu_count())
+    try:
+        return pool.map(lambda name: run_tile_process(manifest_file, name),
+                        tile_names)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def merge(manifest_file, output_directory=None):
+    """ Merge the outputs of all tiles into files for the whole grid (in
+    the job directory by default); returns their names
+    """
+    missing = missing_tiles(manifest_file)
+    if missing:
+        raise ValueError('Tiles of %s are not complete: %s'
+                         % (manifest_file, ', '.join(missing)))
+
+    manifest = read_manifest(manifest_file)
+    if output_directory is None:
+        output_directory = os.path.dirname(os.path.abspath(manifest_file))
+    offsets = [tuple(tile['offset']) for tile in manifest['tiles']]
+
+    merged_files = []
+    for output in manifest['outputs']:
+        merged_file = os.path.join(output_directory, output)
+        model_output.merge_grid_files(
+            [os.path.join(tile_directory(manifest_file, tile), output)
+             for tile in manifest['tiles']],
+            offsets, merged_file, y_dim=manifest['y_dim'],
+            x_dim=manifest['x_dim'], shape=tuple(manifest['grid_shape']))
+        merged_files.append(merged_file)
+    return merged_files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run Ku or FrostnumberGeo on tiles of its grid')
+    commands = parser.add_subparsers(dest='command')
+
+    partition_parser = commands.add_parser(
+        'partition', help='write the cfg files of the tiles and a manifest')
+    partition_parser.add_argument('cfg_file')
+    partition_parser.add_argument('n_tiles', type=int)
+    partition_parser.add_argument('job_directory')
+
+    run_parser = commands.add_parser(
+        'run', help='run tiles (by default, all incomplete ones)')
+    run_parser.add_argument('manifest_file')
+    run_parser.add_argument('--tile', action='append', dest='tile_names',
+                            help='name of a tile to run (may be repeated)')
+    run_parser.add_argument('--processes', type=int, default=None,
+                            help='size of the process pool')
+
+    merge_parser = commands.add_parser(
+        'merge', help='merge the outputs of the tiles')
+    merge_parser.add_argument('manifest_file')
+    merge_parser.add_argument('--output-directory', default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == 'partition':
+        print partition(args.cfg_file, args.n_tiles, args.job_directory)
+    elif args.command == 'run':
+        run_tiles(args.manifest_file, args.processes, args.tile_names)
+    else:
+        for merged_file in merge(args.manifest_file, args.output_directory):
+            print merged_file
+
+
+if __name__ == "__main__":
+    main()
@@ -25,12 +25,211 @@ SOFTWARE.
 
 import os
 import numpy as np
+from netCDF4 import Dataset
 from permamodel.utils import model_input
 from permamodel.components import perma_base
 from permamodel import examples_directory
 from nose.tools import assert_greater_equal, assert_true, assert_equal
 
 
+def degree_days(T_cold, T_hot):
+    """
+    Degree freezing and thawing days for any number of years and sites
+
+    T_cold and T_hot (avg temps of the coldest and warmest months) may
+    be scalars or arrays of any matching shape, e.g. (n_years, n_sites).
+    The three cases of the Outcalt fit (always freezing, never freezing,
+    cosine fit) are evaluated as masks over the whole array, so no
+    Python loop over years or sites is needed.
+
+    Returns (ddf, ddt, T_average, T_amplitude) with the shape of the inputs
+    """
+    T_cold = np.asarray(T_cold)
+    T_hot = np.asarray(T_hot)
+
+    # Sums are taken in the input precision, as in the per-year code
+    T_average = np.asarray(T_hot + T_cold, dtype=np.float64) / 2.0
+    T_amplitude = np.asarray(T_hot - T_cold, dtype=np.float64) / 2.0
+
+    # Note that these conditions should cover T_hot == T_cold
+    always_freezing = (T_hot <= 0)
+    never_freezing = (T_cold > 0) & ~always_freezing
+    cosine_fit = ~(always_freezing | never_freezing)
+
+    # Beta is only meaningful where the cosine fit applies; elsewhere
+    # the amplitude may be zero, so use a harmless placeholder
+    with np.errstate(divide='ignore', invalid='ignore'):
+        safe_amplitude = np.where(cosine_fit, T_amplitude, 1.0)
+        Beta = np.arccos(np.where(cosine_fit,
+                                  -T_average / safe_amplitude, 0.0))
+        T_summer = T_average + T_amplitude * np.sin(Beta) / Beta
+        T_winter = T_average - T_amplitude * np.sin(Beta) / (np.pi - Beta)
+        L_summer = 365.0 * Beta / np.pi
+        L_winter = 365.0 - L_summer
+
+        # Negative sign because ddf is + and T_average (here) is -
+        ddf = np.where(cosine_fit, -T_winter * L_winter,
+                       np.where(always_freezing, -365.0 * T_average, 0.0))
+        ddt = np.where(cosine_fit, T_summer * L_summer,
+                       np.where(never_freezing, 365.0 * T_average, 0.0))
+
+    return (ddf, ddt, T_average, T_amplitude)
+
+
+def air_frost_number(ddf, ddt):
+    """ Reduced air frost number from degree freezing and thawing days """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(ddf) / (np.sqrt(ddf) + np.sqrt(ddt))
+
+
+frost_number_fields = ['air', 'surface', 'stefan']
+
+
+def frost_number_dtype(site_shape=()):
+    """ Record layout of one year of frost number output """
+    return np.dtype([('year', np.int32)] +
+                    [(field, np.float64, site_shape)
+                     for field in frost_number_fields])
+
+
+def format_record(record):
+    """ The original "%5.3f" text tuple for one output record """
+    values = []
+    for field in frost_number_fields:
+        if np.ndim(record[field]) == 0:
+            values.append("%5.3f" % record[field])
+        else:
+            values.append(["%5.3f" % value
+                           for value in np.ravel(record[field])])
+    return tuple(values)
+
+
+def write_text(file_name, records):
+    """ Original text format: one "Year: ... output=..." line per year """
+    with open(file_name, 'w') as f_out:
+        f_out.writelines(["Year: %d  output=%s\n" %
+                          (record['year'], format_record(record))
+                          for record in records])
+
+
+def write_npy(file_name, records):
+    """ The record array itself, in NumPy's binary format """
+    np.save(file_name, records)
+
+
+def write_csv(file_name, records):
+    """ One row per year; a column per site if there are several """
+    columns = [records['year'].reshape((len(records), 1))]
+    header = ['year']
+    for field in frost_number_fields:
+        values = records[field].reshape((len(records), -1))
+        columns.append(values)
+        if values.shape[1] == 1:
+            header.append(field)
+        else:
+            header.extend(['%s_%d' % (field, k)
+                           for k in range(values.shape[1])])
+    np.savetxt(file_name, np.hstack(columns), delimiter=',',
+               header=','.join(header), comments='',
+               fmt=['%d'] + ['%.8g'] * (len(header) - 1))
+
+
+def write_netcdf(file_name, records):
+    """ One variable per frost number along a year (and site) axis """
+    site_shape = records.dtype['air'].shape
+    ncid = Dataset(file_name, 'w', format='NETCDF4')
+    try:
+        ncid.createDimension('time', len(records))
+        dimensions = ('time',)
+        if site_shape:
+            ncid.createDimension('site', int(np.prod(site_shape)))
+            dimensions = ('time', 'site')
+        year = ncid.createVariable('year', np.dtype('int32').char,
+                                   ('time',))
+        year.units = 'Year'
+        year[:] = records['year']
+        for field in frost_number_fields:
+            data = ncid.createVariable(field, np.dtype('float64').char,
+                                       dimensions)
+            data.long_name = '%s frost number' % field
+            data[:] = records[field].reshape((len(records),) +
+                                             ((-1,) if site_shape else ()))
+    finally:
+        ncid.close()
+
+
+# Output writers, chosen by fn_out_format or by the file extension
+output_writers = {
+    'text': write_text,
+    'npy': write_npy,
+    'csv': write_csv,
+    'netcdf': write_netcdf,
+}
+output_extensions = {
+    '.npy': 'npy',
+    '.csv': 'csv',
+    '.nc': 'netcdf',
+}
+
+
+class FrostnumberOutput(object):
+    """
+    Frost numbers for every year of a run, held in a preallocated
+    record array with fields year, air, surface and stefan.  Like the
+    dictionary it replaces, it is indexed by year and only holds the
+    years that have been calculated.
+    """
+    def __init__(self, start_year, n_years, site_shape=()):
+        self.start_year = start_year
+        self.records = np.zeros(n_years, dtype=frost_number_dtype(site_shape))
+        self.records['year'] = start_year + np.arange(n_years)
+        for field in frost_number_fields:
+            self.records[field] = np.nan
+        self.calculated = np.zeros(n_years, dtype=bool)
+
+    def set_year(self, year, air, surface, stefan):
+        """ Store the frost numbers of one year """
+        index = int(year - self.start_year)
+        self.records['air'][index] = air
+        self.records['surface'][index] = surface
+        self.records['stefan'][index] = stefan
+        self.calculated[index] = True
+
+    def set_years(self, years, air, surface, stefan):
+        """ Store the frost numbers of several years in one call """
+        indices = (np.asarray(years) - self.start_year).astype(int)
+        self.records['air'][indices] = air
+        self.records['surface'][indices] = surface
+        self.records['stefan'][indices] = stefan
+        self.calculated[indices] = True
+
+    def valid_records(self):
+        """ The records of the years calculated so far """
+        return self.records[self.calculated]
+
+    def keys(self):
+        return list(self.valid_records()['year'])
+
+    def __contains__(self, year):
+        index = int(year - self.start_year)
+        return 0 <= index < len(self.records) and self.calculated[index]
+
+    def __getitem__(self, year):
+        if year not in self:
+            raise KeyError(year)
+        return self.records[int(year - self.start_year)]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.calculated))
+
+    def write(self, file_name, out_format=None):
+        """ Write all calculated years in a single call """
+        if out_format is None:
+            extension = os.path.splitext(file_name)[1].lower()
+            out_format = output_extensions.get(extension, 'text')
+        output_writers[out_format.lower()](file_name, self.valid_records())
+
+
 class FrostnumberMethod(perma_base.PermafrostComponent):
     """ Provides 1D Frostnumber component """
     def __init__(self):
@@ -47,7 +246,7 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         self.start_year = -1
         self.end_year = -1
         self.dt = 1
-        self.output = {}
+        self.output = None
         self.T_average = -99.0
         self.T_amplitude = -99.0
         self.ddt = []
@@ -60,6 +259,16 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         self.Z_tot = -99.0
         self.stefan_number = -99.0
         self.fn_out_filename = ""
+        self.fn_out_format = None
+
+        # Degree days and air frost number for every year of the run,
+        # computed in one call by compute_all_frost_numbers()
+        self.ddf_series = None
+        self.ddt_series = None
+        self.T_average_series = None
+        self.T_amplitude_series = None
+        self.air_frost_number_series = None
+        self.series_inputs = (None, None)
 
         # Not sure why these aren't set elsewhere
         self.DEBUG = True
@@ -114,6 +323,8 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         self.start_year = self._configuration['start_year']
         self.end_year = self._configuration['end_year']
         self.fn_out_filename = self._configuration['fn_out_filename']
+        # Optional: text, npy, csv or netcdf (default: by file extension)
+        self.fn_out_format = self._configuration.get('fn_out_format')
 
         # These don't need to be used after this routine
         T_air_min_type = self._configuration['T_air_min_type']
@@ -134,14 +345,12 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
             fname = os.path.join(in_dir,
                                  self._configuration['T_air_min'])
             assert_true(os.path.isfile(fname))
-            Tvalues = np.loadtxt(fname, skiprows=0, unpack=False)
-            self.T_air_min = np.array(Tvalues, dtype=np.float32)
+            self.T_air_min = model_input.load_time_series(fname)
 
             fname = os.path.join(in_dir,
                                  self._configuration['T_air_max'])
             assert_true(os.path.isfile(fname))
-            Tvalues = np.loadtxt(fname, skiprows=0, unpack=False)
-            self.T_air_max = np.array(Tvalues, dtype=np.float32)
+            self.T_air_max = model_input.load_time_series(fname)
 
     def initialize_frostnumber_component(self):
         """ Set the starting values for the frostnumber component """
@@ -156,24 +365,66 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         except AssertionError:
             self.end_year = self.start_year
 
-        # Create a dictionary to hold the output values
+        # All years are computed at once; update() then only moves
+        # through these results
+        self.compute_all_frost_numbers()
+
+        # Create a record array to hold the output values
         # (this is unique to frost_number()
-        self.output = {}
+        self.output = FrostnumberOutput(
+            self.start_year, int(self.end_year - self.start_year) + 1,
+            np.shape(self.air_frost_number_series)[1:])
 
         # Here, we should calculate the initial values of all the frost numbers
         self.calculate_frost_numbers()
 
+    def compute_all_frost_numbers(self):
+        """
+        Compute degree days and air frost number for every year of the
+        run in a single vectorized call.  T_air_min and T_air_max may
+        have one value per year, or shape (n_years, n_sites).
+        """
+        n_years = int(self.end_year - self.start_year) + 1
+        T_cold = np.asarray(self.T_air_min)[:n_years]
+        T_hot = np.asarray(self.T_air_max)[:n_years]
+        assert_true(np.all(T_hot >= T_cold))
+
+        (self.ddf_series, self.ddt_series,
+         self.T_average_series, self.T_amplitude_series) = \
+            degree_days(T_cold, T_hot)
+        self.air_frost_number_series = \
+            air_frost_number(self.ddf_series, self.ddt_series)
+
+        # Remember which inputs these results belong to
+        self.series_inputs = (self.T_air_min, self.T_air_max)
+
+    def have_frost_number_series(self, index):
+        """ True if precomputed results exist for this year's inputs """
+        return (self.air_frost_number_series is not None
+                and self.series_inputs[0] is self.T_air_min
+                and self.series_inputs[1] is self.T_air_max
+                and 0 <= index < len(self.air_frost_number_series))
+
     def calculate_frost_numbers(self):
         """ Calculate frost numbers at the current timestep """
         # Calculate all the frost numbers using the current data
-        self.calculate_air_frost_number()
+        index = int(self.year - self.start_year)
+        if self.have_frost_number_series(index):
+            self.ddf = self.ddf_series[index]
+            self.ddt = self.ddt_series[index]
+            self.T_average = self.T_average_series[index]
+            self.T_amplitude = self.T_amplitude_series[index]
+            self.air_frost_number = self.air_frost_number_series[index]
+        else:
+            # The inputs changed since they were precomputed
+            self.calculate_air_frost_number()
         self.calculate_surface_frost_number()
         self.calculate_stefan_frost_number()
 
-        # Add these frost numbers to the output dictionary
-        self.output[self.year] = ("%5.3f" % self.air_frost_number,
-                                  "%5.3f" % self.surface_frost_number,
-                                  "%5.3f" % self.stefan_frost_number)
+        # Add these frost numbers to the output records
+        self.output.set_year(self.year, self.air_frost_number,
+                             self.surface_frost_number,
+                             self.stefan_frost_number)
 
     def print_frost_numbers(self, year=-1):
         """ Print output to screen """
@@ -185,8 +436,9 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
                    self.air_frost_number, self.surface_frost_number,
                    self.stefan_frost_number))
         else:
-            for year in sorted(self.output.keys()):
-                print("Year: %d  output=%s" % (year, self.output[year]))
+            for record in self.output.valid_records():
+                print("Year: %d  output=%s" %
+                      (record['year'], format_record(record)))
 
     def calculate_air_frost_number(self):
         """ Air frost number requires degree days before calculation """
@@ -219,41 +471,13 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         T_hot = self.T_air_max[int(self.year - self.start_year)]
 
         assert_greater_equal(T_hot, T_cold)
-        T_avg = (T_hot + T_cold) / 2.0
-
-        # Note that these conditions should cover T_hot == T_cold
-        if T_hot <= 0:
-            # Always freezing
-            # Negative sign because ddf is + and T_avg (here) is -
-            ddf = -365.0 * T_avg
-            ddt = 0
-            L_winter = 365.0
-            L_summer = 0.0
-            T_average = (T_hot + T_cold) / 2.0
-            T_amplitude = (T_hot - T_cold) / 2.0
-        elif T_cold > 0:
-            # Never freezing
-            ddf = 0
-            ddt = 365.0 * T_avg
-            L_winter = 0.0
-            L_summer = 365.0
-            T_average = (T_hot + T_cold) / 2.0
-            T_amplitude = (T_hot - T_cold) / 2.0
-        else:
-            # Assume cosine fit for temp series
-            T_average = (T_hot + T_cold) / 2.0
-            T_amplitude = (T_hot - T_cold) / 2.0
-            Beta = np.arccos(-T_average / T_amplitude)
-            T_summer = T_average + T_amplitude * np.sin(Beta) / Beta
-            T_winter = T_average - T_amplitude * np.sin(Beta) / (np.pi - Beta)
-            L_summer = 365.0 * Beta / np.pi
-            L_winter = 365.0 - L_summer
-            ddt = T_summer * L_summer
-            ddf = -T_winter * L_winter
-        self.T_average = T_average
-        self.T_amplitude = T_amplitude
-        self.ddt = ddt
-        self.ddf = ddf
+        (ddf, ddt, T_average, T_amplitude) = degree_days(T_cold, T_hot)
+
+        # Scalar inputs give back numpy scalars
+        self.T_average = T_average[()]
+        self.T_amplitude = T_amplitude[()]
+        self.ddt = ddt[()]
+        self.ddf = ddf[()]
 
     def compute_air_frost_number(self):
         """
@@ -261,9 +485,7 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         The reduced frost number is close 0 for long summers
         and close to 1 for long winters.
         """
-        self.air_frost_number = \
-            np.sqrt(self.ddf) / \
-            (np.sqrt(self.ddf) + np.sqrt(self.ddt))
+        self.air_frost_number = air_frost_number(self.ddf, self.ddt)
 
     def close_input_files(self):
         """ As per topoflow, close the input files to finalize() """
@@ -278,10 +500,7 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
         # If file is written, return value is True
         # If permission is denied, return value is False
         try:
-            with open(self.fn_out_filename, 'w') as f_out:
-                for year in sorted(self.output.keys()):
-                    f_out.write("Year: %d  output=%s\n" %
-                                (year, self.output[year]))
+            self.output.write(self.fn_out_filename, self.fn_out_format)
         except IOError:
             print('WARNING: Unable to write output to {}'.format(
                 self.fn_out_filename))
@@ -357,6 +576,43 @@ class FrostnumberMethod(perma_base.PermafrostComponent):
 
         self.calculate_frost_numbers()
 
+    def update_until_year(self, stop_year):
+        """
+        Update until stop_year, as a loop of update() would.  The years
+        are taken from the precomputed series at once when these still
+        belong to the inputs; otherwise, they are calculated one by one.
+        A stop_year past end_year stops at end_year.
+        """
+        stop_year = min(stop_year, self.end_year)
+        years = []
+        year = self.year
+        while year < stop_year:
+            year = min(year + self.dt, self.end_year)
+            years.append(year)
+        if not years:
+            return
+        indices = [int(year - self.start_year) for year in years]
+        if not all(self.have_frost_number_series(index)
+                   for index in indices):
+            for _ in years:
+                self.update()
+            return
+
+        # The surface and Stefan frost numbers are still dummy values
+        self.year = years[-1]
+        self.calculate_surface_frost_number()
+        self.calculate_stefan_frost_number()
+        self.output.set_years(years, self.air_frost_number_series[indices],
+                              self.surface_frost_number,
+                              self.stefan_frost_number)
+
+        index = indices[-1]
+        self.ddf = self.ddf_series[index]
+        self.ddt = self.ddt_series[index]
+        self.T_average = self.T_average_series[index]
+        self.T_amplitude = self.T_amplitude_series[index]
+        self.air_frost_number = self.air_frost_number_series[index]
+
 if __name__ == "__main__":
     # Run the code
     fn = FrostnumberMethod()
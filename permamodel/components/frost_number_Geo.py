@@ -7,12 +7,17 @@
 from __future__ import print_function
 
 import os
+import ast
+import bisect
+import calendar
 import datetime
 import numpy as np
 from dateutil.relativedelta import relativedelta
-from netCDF4 import Dataset
+from netCDF4 import Dataset, num2date
 # import yaml  # Used if yaml-style imports are used instead of Topoflow-like
 from permamodel.components import perma_base
+from permamodel.utils import slice_cache
+from permamodel.utils import model_output
 from permamodel import examples_directory, data_directory
 from nose.tools import (assert_greater_equal, assert_less_equal,
                         assert_true,
@@ -22,6 +27,25 @@ default_frostnumberGeo_config_filename = "FrostnumberGeo_Default.cfg"
 
 class FrostnumberGeoMethod(perma_base.PermafrostComponent):
     # Note: the current version interprets timesteps in years
+
+    # The ways of computing degree days that can be selected with
+    # 'degree_days_method' in the config file.  Each one names the
+    # routine that reads its input fields and the one that turns
+    # them into ddf and ddt.
+    degree_days_methods = {
+        'MinJanMaxJul': ('get_input_vars_MinJanMaxJul',
+                         'compute_degree_days_MinJanMaxJul'),
+        'MonthlyAverages': ('get_input_vars_MonthlyAverages',
+                            'compute_degree_days_MonthlyAverages'),
+        'DailyValues': ('get_input_vars_DailyValues',
+                        'compute_degree_days_DailyValues'),
+    }
+
+    # Strided reads are slow in the netCDF library, so a strided subset
+    # is read as one contiguous block and strided in memory unless the
+    # block is more than this many times larger than the subset
+    contiguous_read_ratio = 64
+
     def __init__(self, cfgfile=None):
         """ Initial definitions and assignments """
         self._name = 'FrostNumberGeo'
@@ -53,6 +77,10 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self.day = 15
 
         self._output_fid = -1
+        self._output_complevel = 4
+        self._output_async = True
+        self._output_queue_length = 8
+        self._output_writer = None
         self._nc_time = datetime.date(1900, self.month, self.day)
 
         self._temperature_first_date = datetime.date(1900, self.month, self.day)
@@ -86,6 +114,8 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self.T_air = []
         self.T_air_min = np.zeros([1])
         self.T_air_max = np.zeros([1])
+        self.T_air_series = np.zeros([1])
+        self.T_air_series_days = np.zeros([1])
 
         self._temperature_current = np.zeros([1])
         self.Precip = np.zeros([1])
@@ -99,8 +129,6 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self.stefan_frost_number_Geo = np.zeros([1])
 
         self._nc_time = datetime.date(1900, self.month, self.day)
-        self._nc_reference_time = datetime.date(1900, self.month, self.day)
-        self._nc_last_time_index = 0
         self._nc_x = np.zeros([1])
         self._nc_y = np.zeros([1])
 
@@ -116,6 +144,18 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self._date_current = datetime.date(1900, self.month, self.day)
 
         self._temperature_dataset = np.zeros([1])
+        self._temperature_source_key = None
+        self._datacube_files = []
+
+        # To run only part of the grid, set _tile to (j0, i0, ydim, xdim)
+        # in model grid cells before initializing; _config_overrides
+        # replace values read from the config file
+        self._tile = None
+        self._datacube_window = (slice(None), slice(None))
+        self._config_overrides = {}
+
+        # Temperature slices already read, shared with other instances
+        self._slice_cache = slice_cache.shared_cache
 
         # There is a default configuration file in the examples directory
         if cfgfile is None:
@@ -131,6 +171,7 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self._configuration = \
                 self.get_config_from_oldstyle_file(self._config_filename)
                 # self.get_config_from_yaml_file(self._config_filename)
+        self._configuration.update(self._config_overrides)
         # Ensure that this config file is for this type of Method
         assert_equal(self._configuration['config_for_method'],
                      str(self.__class__).split('.')[-1])
@@ -327,19 +368,18 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
                 raise ValueError("cannot handle grid of shape %s" %
                                  str(self._grid_shape))
 
-            # Set the valid dates for which temperature is available
-            self._temperature_first_date = \
-                self.datefrom(self._configuration['temperature_grid_date_0'])
-            last_date_varname = 'temperature_grid_date_%d' % \
-                (int(self._configuration['n_temperature_grid_fields']) - 1)
-            self._temperature_last_date = \
-                eval("self.datefrom(self._configuration['%s'])" % last_date_varname)
-
             # Parse the (x, y, time) data cube from which the values
             # will be drawn at the appropriate time
             self._temperature_dates, self._temperature_datacube = \
                 self.initialize_datacube('temperature',
                                          self._configuration)
+            assert_equal(tuple(self._temperature_datacube.shape[1:]),
+                         tuple(self._grid_shape))
+
+            # Set the valid dates for which temperature is available
+            self._temperature_first_date = self._temperature_dates[0]
+            self._temperature_last_date = self._temperature_dates[-1]
+
             if self._configuration['n_precipitation_grid_fields'] > 0:
                 self._precipitation_dates, self._precipitation_datacube = \
                     self.initialize_datacube('precipitation',
@@ -349,6 +389,15 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
                     self.initialize_datacube('soilproperties',
                                              self._configuration)
 
+        # Restrict the model to a tile of the grid, if requested
+        # here or by the tile_* keys of the config file
+        if self._tile is None and 'tile_rows' in self._configuration:
+            self._tile = tuple([self._configuration[key] for key in
+                                ('tile_first_row', 'tile_first_column',
+                                 'tile_rows', 'tile_columns')])
+        if self._tile is not None:
+            self.apply_tile()
+
         # Initialize the temperature min/max arrays
         self.T_air_min = np.zeros(self._grid_shape, dtype=np.float32)
         self.T_air_min.fill(np.nan)
@@ -384,6 +433,11 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         # There are different ways of computing degree days.  Ensure that
         # the method specified has been coded
         self._dd_method = self._configuration['degree_days_method']
+        if self._dd_method not in self.degree_days_methods:
+            raise ValueError("Degree days method %s not recognized"
+                             % self._dd_method)
+        if self._using_Files and self._dd_method == 'DailyValues':
+            self.check_temperature_file_is_daily()
         self.ddf = np.zeros(self._grid_shape, dtype=np.float32)
         self.ddf.fill(np.nan)
         self.ddt = np.zeros(self._grid_shape, dtype=np.float32)
@@ -407,6 +461,14 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self.initialize_model_time()
 
         # Initialize the output filename
+        # (the compression level of the output is optional, 0 for none)
+        self._output_complevel = \
+            int(self._configuration.get('output_compression_level', 4))
+        # Output may be written by a background thread (the default)
+        self._output_async = \
+            self._configuration.get('output_async', 'True') == 'True'
+        self._output_queue_length = \
+            int(self._configuration.get('output_queue_length', 8))
         self.initialize_output(self._configuration['output_directory'],
                                self._configuration['output_filename'])
 
@@ -418,6 +480,28 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         # necessary values
         """
 
+    def apply_tile(self):
+        """ Make the model grid the tile (j0, i0, ydim, xdim) of itself """
+        (tile_j0, tile_i0, tile_ydim, tile_xdim) = self._tile
+        assert_true(0 <= tile_j0 and tile_j0 + tile_ydim <= self._grid_ydim)
+        assert_true(0 <= tile_i0 and tile_i0 + tile_xdim <= self._grid_xdim)
+        if self._using_WMT:
+            raise ValueError("Tiles cannot be used with WMT input")
+
+        if self._using_Files:
+            # Move the window into the temperature file
+            self._grid_j0 += tile_j0 * self._grid_jskip
+            self._grid_i0 += tile_i0 * self._grid_iskip
+            self._grid_j1 = self._grid_j0 + self._grid_jskip * tile_ydim
+            self._grid_i1 = self._grid_i0 + self._grid_iskip * tile_xdim
+        else:
+            # Only this part of each datacube field is read
+            self._datacube_window = (slice(tile_j0, tile_j0 + tile_ydim),
+                                     slice(tile_i0, tile_i0 + tile_xdim))
+
+        self._grid_shape = (tile_ydim, tile_xdim)
+        (self._grid_ydim, self._grid_xdim) = self._grid_shape
+
     def datefrom(self, datestring):
         if isinstance(datestring, str):
             return datetime.datetime.strptime(datestring, '%Y-%m-%d').date()
@@ -426,100 +510,58 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
 
 
     def initialize_datacube(self, gridname, config):
+        # The datacube may be in a file named by <gridname>_datacube_filename
+        # (relative to the examples directory), or else each field is
+        # given in the config file itself
+        datacube_key = '%s_datacube_filename' % gridname
+        if datacube_key in config:
+            return self.read_datacube_file(
+                os.path.join(examples_directory, config[datacube_key]),
+                gridname, config)
+
         # Determine the number of lines for this grid
-        ngridlines = 0
-        thisdate = datetime.date(1900, self.month, self.day)  # This is a dummy init value
-        exec("ngridlines = config['n_%s_grid_fields']" % gridname)
+        ngridlines = int(config['n_%s_grid_fields' % gridname])
 
         # Create the datelist for this grid
-        datelist = []
-        for n in range(ngridlines):
-            # This version converts a string to a datetime.date object
-            # exec("thisdate = datetime.datetime.strptime(
-            # config['%s_grid_date_%d' % (gridname, n)], '%Y-%m-%d').date()")
-            exec("thisdate = config['%s_grid_date_%d' % (gridname, n)]")
-            if isinstance(thisdate, str):
-                thisdate = self.datefrom(thisdate)
-            datelist.append(thisdate)
+        datelist = [self.datefrom(config['%s_grid_date_%d' % (gridname, n)])
+                    for n in range(ngridlines)]
 
         # Create the datacube for this grid
         slicelist = []
         for n in range(ngridlines):
-            config_arg = eval(config['%s_grid_data_%d' % (gridname, n)])
+            config_arg = ast.literal_eval(
+                config['%s_grid_data_%d' % (gridname, n)])
             slicelist.append(np.array(config_arg))
-        # In NumPy 1.10 later, we can use np.stack()
-        # But for v1.09 -- which pip seems to install -- we need np.dstack()
-        # datacube = np.stack(slicelist)
-        datacube = self.np_stack(slicelist)
+        datacube = np.array(slicelist)
 
         return datelist, datacube
 
-    def np_stack(self, arrays, axis=0):
-        """
-        In order to provide this function from numpy v1.10, this is copied
-        from:
-           https://github.com/numpy/numpy/blob/
-           f4cc58c80df5202a743bddd514a3485d5e4ec5a4/numpy/core/shape_base.py
-        Join a sequence of arrays along a new axis.
-        The `axis` parameter specifies the index of the new axis in the dimensions
-        of the result. For example, if ``axis=0`` it will be the first dimension
-        and if ``axis=-1`` it will be the last dimension.
-        .. versionadded:: 1.10.0
-        Parameters
-        ----------
-        arrays : sequence of array_like
-            Each array must have the same shape.
-        axis : int, optional
-            The axis in the result array along which the input arrays are stacked.
-        Returns
-        -------
-        stacked : ndarray
-            The stacked array has one more dimension than the input arrays.
-        See Also
-        --------
-        concatenate : Join a sequence of arrays along an existing axis.
-        split : Split array into a list of multiple sub-arrays of equal size.
-        Examples
-        Note: Replace '>>>' with '>>' so it doesn't doctest
-        --------
-        >> arrays = [np.random.randn(3, 4) for _ in range(10)]
-        >> np.stack(arrays, axis=0).shape
-        (10, 3, 4)
-        >> np.stack(arrays, axis=1).shape
-        (3, 10, 4)
-        >> np.stack(arrays, axis=2).shape
-        (3, 4, 10)
-        >> a = np.array([1, 2, 3])
-        >> b = np.array([2, 3, 4])
-        >> np.stack((a, b))
-        array([[1, 2, 3],
-               [2, 3, 4]])
-        >> np.stack((a, b), axis=-1)
-        array([[1, 2],
-               [2, 3],
-               [3, 4]])
-        """
-        arrays = [np.asanyarray(arr) for arr in arrays]
-        if not arrays:
-            raise ValueError('need at least one array to stack')
-
-        shapes = set(arr.shape for arr in arrays)
-        if len(shapes) != 1:
-            raise ValueError('all input arrays must have the same shape')
-
-        result_ndim = arrays[0].ndim + 1
-        if not -result_ndim <= axis < result_ndim:
-            msg = 'axis {0} out of bounds [-{1}, {1})'.format(axis, result_ndim)
-            raise IndexError(msg)
-        if axis < 0:
-            axis += result_ndim
+    def read_datacube_file(self, filename, gridname, config):
+        """ A (time, y, x) datacube from a .npy or NetCDF file
 
-        sl = (slice(None),) * axis + (np.newaxis,)
-        expanded_arrays = [arr[sl] for arr in arrays]
-
-        # Changed name from that of copied code
-        # return _nx.concatenate(expanded_arrays, axis=axis)
-        return np.concatenate(expanded_arrays, axis=axis)
+        A .npy file is memory-mapped, and its dates are the
+        <gridname>_grid_date_<n> values of the config file.  A NetCDF
+        file holds its dates in a 'time' variable (with units) and the
+        fields in its only (time, y, x) variable; fields are read from
+        it as they are needed.
+        """
+        assert_true(os.path.isfile(filename))
+        if filename.endswith('.npy'):
+            datacube = np.load(filename, mmap_mode='r')
+            datelist = [self.datefrom(config['%s_grid_date_%d' %
+                                             (gridname, n)])
+                        for n in range(len(datacube))]
+        else:
+            ncid = Dataset(filename, 'r')
+            self._datacube_files.append(ncid)
+            time = ncid.variables['time']
+            datelist = [datetime.date(d.year, d.month, d.day) for d in
+                        num2date(time[:], time.units,
+                                 getattr(time, 'calendar', 'standard'))]
+            datacube = [var for var in ncid.variables.values()
+                        if var.ndim == 3][0]
+        assert_equal(len(datelist), len(datacube))
+        return datelist, datacube
 
     def get_datacube_slice(self, thisdate, datacube, cubedates):
         # Data are invalid until the first date in the datacube
@@ -533,14 +575,18 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
                 "Date %s is after last valid date (%s) in datacube" %
                 (thisdate, cubedates[-1]))
 
-        use_this_date = 0
-        for date_okay, checkdate in enumerate(cubedates):
-            if thisdate > checkdate:
-                use_this_date = date_okay
-            else:
-                break
+        # The field valid at thisdate is the last one whose date
+        # is before it (or the first one)
+        use_this_date = max(bisect.bisect_left(cubedates, thisdate) - 1, 0)
 
-        return datacube[use_this_date, :]
+        (rows, columns) = self._datacube_window
+        if isinstance(datacube, np.ndarray):
+            return datacube[use_this_date, rows, columns]
+
+        # NetCDF variable
+        with model_output.netcdf_lock:
+            field = datacube[use_this_date, rows, columns]
+        return np.ma.filled(np.ma.asarray(field, dtype=np.float32), np.nan)
 
 
     def initialize_output(self, outdirname, outfilename):
@@ -593,19 +639,19 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
             setattr(self._output_fid, 'Permafrost Component', 'FrostnumberGeo')
 
             ### Init dimensions
-            # Time dimension
+            # Time dimension: one entry per model timestep
             tdim = 0
             self._output_fid.createDimension("time", tdim)
             self._nc_time = \
                 self._output_fid.createVariable('time', 'i', ('time',), zlib=True)
             setattr(self._nc_time, 'time_long_name', 'time')
             setattr(self._nc_time, 'time_standard_name', 'time')
-            setattr(self._nc_time, 'time_units', 'months since 1900-01-01 00:00:00')
-            self._nc_reference_time = datetime.date(1900, 1, 15)
-            setattr(self._nc_time, 'time_format', 'modified julian day (MJD)')
+            setattr(self._nc_time, 'units',
+                    'years since %s' % str(self._reference_date))
+            setattr(self._nc_time, 'time_units',
+                    'years since %s' % str(self._reference_date))
             setattr(self._nc_time, 'time_time_zone', 'UTC')
             setattr(self._nc_time, 'time__FillValue', '-9999')
-            self._nc_last_time_index = 0
 
             ### For now, the X and Y dimensions are just the indexes
             # X dimension
@@ -616,9 +662,9 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
             setattr(self._nc_x, 'x_standard_name', 'x')
             setattr(self._nc_x, 'x_units', 'meters')
             setattr(self._nc_x, 'x__FillValue', 'NaN')
-            # fill the x- values
-            for x in range(self._grid_xdim):
-                self._nc_x[x] = x
+            # fill the x- values (of the whole grid, for a tile)
+            self._nc_x[:] = np.arange(self._grid_xdim) + \
+                    (self._tile[1] if self._tile is not None else 0)
 
             # Y dimension
             self._output_fid.createDimension("y", self._grid_ydim)
@@ -629,14 +675,20 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
             setattr(self._nc_y, 'y_units', 'meters')
             setattr(self._nc_y, 'y__FillValue', 'NaN')
             # fill the y- values
-            for y in range(self._grid_ydim):
-                self._nc_y[y] = y
+            self._nc_y[:] = np.arange(self._grid_ydim) + \
+                    (self._tile[0] if self._tile is not None else 0)
+
+            # Each timestep of a grid is written as exactly one chunk
+            grid_options = {
+                'zlib': self._output_complevel > 0,
+                'complevel': max(self._output_complevel, 1),
+                'chunksizes': (1, self._grid_ydim, self._grid_xdim)}
 
             ### Init grids with sizes
             # Allocate air frost number field
             self._nc_afn = \
                 self._output_fid.createVariable(
-                    'air_fn', 'f', ('time', 'y', 'x'), zlib=True)
+                    'air_fn', 'f', ('time', 'y', 'x'), **grid_options)
             setattr(self._nc_afn, 'afn_long_name', 'Air Frost Number')
             setattr(self._nc_afn, 'afn_standard_name', 'Frostnumber_air')
             setattr(self._nc_afn, 'afn_units', 'none')
@@ -646,7 +698,7 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
             if self._calc_surface_fn:
                 self._nc_sfn = \
                     self._output_fid.createVariable(
-                        'surface_fn', 'f', ('time', 'y', 'x'), zlib=True)
+                        'surface_fn', 'f', ('time', 'y', 'x'), **grid_options)
                 setattr(self._nc_sfn, 'sfn_long_name', 'Surface Frost Number')
                 setattr(self._nc_sfn, 'sfn_standard_name', 'Frostnumber_surface')
                 setattr(self._nc_sfn, 'sfn_units', 'none')
@@ -656,19 +708,42 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
             if self._calc_stefan_fn:
                 self._nc_stfn = \
                     self._output_fid.createVariable(
-                        'stefan_fn', 'f', ('time', 'y', 'x'), zlib=True)
+                        'stefan_fn', 'f', ('time', 'y', 'x'), **grid_options)
                 setattr(self._nc_stfn, 'stfn_long_name', 'Stefan Frost Number')
                 setattr(self._nc_stfn, 'stfn_standard_name', 'Frostnumber_stefan')
                 setattr(self._nc_stfn, 'stfn_units', 'none')
                 setattr(self._nc_stfn, 'stfn__FillValue', '-99')
 
+            # Compression and writing can overlap with the model run
+            if self._output_async:
+                self._output_writer = model_output.AsyncGridWriter(
+                    self._output_fid, max_queued=self._output_queue_length)
+
     def finalize(self):
         # Define this so we don't call the permamodel base class version
         self.finalize_frostnumber_Geo()
 
     def finalize_frostnumber_Geo(self):
-        if self._output_fid != -1:
-            self._output_fid.close()
+        try:
+            # Wait for queued output, raising any error in writing it
+            if self._output_writer is not None:
+                self._output_writer.close()
+        finally:
+            self._output_writer = None
+            if self._output_fid != -1:
+                self._output_fid.close()
+                self._output_fid = -1
+            for ncid in self._datacube_files:
+                ncid.close()
+            self._datacube_files = []
+
+    def write_output(self, var_name, time_index, values):
+        """ Write values at time_index (an int or a slice) of an output
+        variable, through the background writer if there is one """
+        if self._output_writer is not None:
+            self._output_writer.write(var_name, time_index, values)
+        else:
+            self._output_fid.variables[var_name][time_index] = values
 
     def check_whether_output_timestep(self, this_timestep):
         # Only output on the 15th of each month
@@ -676,21 +751,24 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         return this_date.day == 15
 
     def add_to_output(self):
-        do_add = self.check_whether_output_timestep(self._timestep_current)
+        do_add = self.check_whether_output_timestep(self._timestep_current) \
+                and self._timestep_current >= self._timestep_first
         if do_add and self._output_fid != -1:
-            # I think this assumes that the file has the same time reference as
-            # the model run...
-            this_date = self.get_date_from_timestep(self._timestep_current)
-            years = this_date.year - self._nc_reference_time.year
-            months = this_date.month - self._nc_reference_time.month
-            time_index = 12*years + months
-            # print("Adding output at index %d for date %s" % \
-            #       (time_index, str(this_date)))
-            self._nc_afn[time_index, :] = self.air_frost_number_Geo[:]
+            time_index = \
+                int(self.get_output_time_index(self._timestep_current))
+            self.write_output('time', time_index, self._timestep_current)
+            self.write_output('air_fn', time_index, self.air_frost_number_Geo)
             if self._calc_surface_fn:
-                self._nc_sfn[time_index, :] = self.surface_frost_number_Geo[:]
+                self.write_output('surface_fn', time_index,
+                                  self.surface_frost_number_Geo)
             if self._calc_stefan_fn:
-                self._nc_stfn[time_index, :] = self.stefan_frost_number_Geo[:]
+                self.write_output('stefan_fn', time_index,
+                                  self.stefan_frost_number_Geo)
+
+    def get_output_time_index(self, this_timestep):
+        """ The output file has one time entry per model timestep """
+        return (this_timestep - self._timestep_first) // \
+                self._timestep_duration
 
     def initial_update(self):
         # Increment the model for the first time step
@@ -724,6 +802,130 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         while self._timestep_current < stop_timestep:
             self.update()
 
+    def run_until_timestep(self, stop_timestep):
+        """ Batch mode of update_until_timestep(): the timesteps after the
+        current one, up to stop_timestep, are computed at once (see
+        run_timesteps()).  With WMT, the input fields set last are used
+        for all of these timesteps, as they would be by update().
+        """
+        dates = []
+        this_date = self._date_current
+        while self.get_timestep_from_date(this_date) < stop_timestep:
+            this_date += relativedelta(years=self._timestep_duration)
+            dates.append(this_date)
+        self.run_timesteps(dates)
+
+    def run_all_timesteps(self):
+        """ Batch mode: compute the current and all remaining timesteps
+        of the run at once, instead of initial_update() followed by
+        update_until_timestep(self._timestep_last)
+        """
+        if self._using_WMT:
+            raise ValueError("The whole-run mode needs input variables \
+                              from Files or ConfigVals")
+
+        # The dates of all timesteps still to be computed
+        dates = []
+        this_date = self._date_current
+        while self.get_timestep_from_date(this_date) <= self._timestep_last:
+            dates.append(this_date)
+            this_date += relativedelta(years=self._timestep_duration)
+        self.run_timesteps(dates)
+
+    def run_timesteps(self, dates):
+        """ Compute the timesteps of dates at once
+
+        The frost numbers are computed as (years, y, x) cubes and each
+        output variable is written with one call.  Afterwards, the model
+        is at the last of the dates, as it would be after the per-step run.
+        """
+        if not dates:
+            return
+        cube_shape = (len(dates),) + tuple(self._grid_shape)
+
+        ddf = np.zeros(cube_shape, dtype=np.float32)
+        ddt = np.zeros(cube_shape, dtype=np.float32)
+        afn = np.zeros(cube_shape, dtype=np.float32)
+        if self._using_WMT:
+            # The fields set through BMI do not change between updates
+            self.get_input_vars()
+            self.compute_degree_days()
+            ddf[...] = self.ddf
+            ddt[...] = self.ddt
+        elif self._dd_method == 'MinJanMaxJul':
+            (mindates, maxdates) = \
+                zip(*[self.get_min_and_max_dates(d) for d in dates])
+            T_cold = self.get_temperature_fields(mindates)
+            T_hot = self.get_temperature_fields(maxdates)
+            self.compute_degree_days_MinJanMaxJul(T_cold, T_hot, ddf, ddt)
+            (self.T_air_min, self.T_air_max) = (T_cold[-1], T_hot[-1])
+        else:
+            # The other methods already read a whole year at a time
+            for (n, this_date) in enumerate(dates):
+                self._date_current = this_date
+                self.get_input_vars()
+                self.compute_degree_days()
+                ddf[n] = self.ddf
+                ddt[n] = self.ddt
+        self.compute_air_frost_number_Geo(ddf, ddt, afn)
+
+        # Leave the model at the last timestep
+        self._date_current = dates[-1]
+        self._timestep_current = self.get_timestep_from_date(dates[-1])
+        self.ddf[...] = ddf[-1]
+        self.ddt[...] = ddt[-1]
+        self.air_frost_number_Geo[...] = afn[-1]
+        self.calculate_surface_frost_number_Geo()
+        self.calculate_stefan_frost_number_Geo()
+
+        self.add_cube_to_output(dates, afn)
+
+    def get_temperature_fields(self, dates):
+        """ Temperature fields at all of the dates, as an array of shape
+        (n_dates, ydim, xdim), NaN where not available
+        """
+        fields = np.zeros((len(dates),) + tuple(self._grid_shape),
+                          dtype=np.float32)
+        fields.fill(np.nan)
+        for (n, t_date) in enumerate(dates):
+            if self._temperature_first_date <= t_date <= \
+               self._temperature_last_date:
+                if self._using_Files:
+                    # Single slices: the netCDF library's strided
+                    # reads along time are slower than separate reads
+                    fields[n] = self.read_temperature_slab(
+                        self.get_temperature_month_index(t_date))
+                else:
+                    fields[n] = self.get_temperature_field(t_date)
+        return fields
+
+    def add_cube_to_output(self, dates, afn):
+        """ Write the output of all these dates in one call per variable """
+        if self._output_fid == -1:
+            return
+        out_dates = [d for d in dates if
+                     self.check_whether_output_timestep(
+                         self.get_timestep_from_date(d))]
+        if len(out_dates) != len(dates):
+            afn = afn[[n for (n, d) in enumerate(dates) if d in out_dates]]
+        if not out_dates:
+            return
+
+        timesteps = [self.get_timestep_from_date(d) for d in out_dates]
+        time_indices = [self.get_output_time_index(t) for t in timesteps]
+        time_slice = slice(time_indices[0], time_indices[-1] + 1)
+        assert_equal(range(time_indices[0], time_indices[-1] + 1),
+                     time_indices)
+
+        self.write_output('time', time_slice, timesteps)
+        self.write_output('air_fn', time_slice, afn)
+        if self._calc_surface_fn:
+            self.write_output('surface_fn', time_slice, np.broadcast_to(
+                self.surface_frost_number_Geo, afn.shape))
+        if self._calc_stefan_fn:
+            self.write_output('stefan_fn', time_slice, np.broadcast_to(
+                self.stefan_frost_number_Geo, afn.shape))
+
     def initialize_model_time(self):
         # The model run duration configuration file has information
         # about the reference time, the start and end times, and
@@ -771,6 +973,39 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
                 Dataset(self._temperature_source_filename, 'r', mmap=True)
         assert_true(self._temperature_dataset is not None)
 
+        # Identifies this file (and version of it) in the slice cache
+        self._temperature_source_key = \
+                (os.path.realpath(self._temperature_source_filename),
+                 os.path.getmtime(self._temperature_source_filename))
+
+    def check_temperature_file_is_daily(self):
+        """ Raise ValueError unless the temperature file holds one field
+        per day, as DailyValues reads a year as 365 or 366 fields
+
+        The spacing of the 'time' variable is checked if the file has
+        one, else the number of fields is compared with the number of
+        days between the dataset's first and last dates.
+        """
+        n_fields = len(self._temperature_dataset.variables['temp'])
+        if 'time' in self._temperature_dataset.variables and n_fields > 1:
+            time = self._temperature_dataset.variables['time']
+            try:
+                dates = num2date(time[0:2], time.units,
+                                 getattr(time, 'calendar', 'standard'))
+                is_daily = (dates[1] - dates[0]) == datetime.timedelta(days=1)
+            except (AttributeError, ValueError):
+                # (no units, or units such as 'months since')
+                is_daily = False
+        else:
+            n_days = (self._temperature_last_date -
+                      self._temperature_first_date).days + 1
+            is_daily = n_fields == n_days
+        if not is_daily:
+            raise ValueError(
+                "Degree days method DailyValues needs daily temperature "
+                "fields, but %s is not daily" %
+                self._temperature_source_filename)
+
     def get_input_vars(self):
         if self._using_WMT:
             # With WMT, the input variables will be set externally via BMI
@@ -787,19 +1022,127 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         elif self._using_Files or self._using_ConfigVals:
             # In standalone mode, variables must be set locally
             # All frost number types need temperature data
-            if self._dd_method == 'MinJanMaxJul':
-                # For the MinJanMaxJul method, need min and max temp fields
-                (mindate, maxdate) = \
-                        self.get_min_and_max_dates(self._date_current)
-                self.T_air_min = self.get_temperature_field(mindate)
-                self.T_air_max = self.get_temperature_field(maxdate)
-            else:
-                raise ValueError("Degree days method %s not recognized"
-                                 % self._dd_method)
+            get_method = self.degree_days_methods[self._dd_method][0]
+            getattr(self, get_method)()
         else:
             raise ValueError("Frostnumber must use either Files, ConfigVals \
                               or WMT to get input variables")
 
+    def get_input_vars_MinJanMaxJul(self):
+        # For the MinJanMaxJul method, need min and max temp fields
+        (mindate, maxdate) = self.get_min_and_max_dates(self._date_current)
+        self.T_air_min = self.get_temperature_field(mindate)
+        self.T_air_max = self.get_temperature_field(maxdate)
+
+    def get_input_vars_MonthlyAverages(self):
+        # All twelve monthly mean fields of the current year, each
+        # weighted by the number of days in its month
+        year = self._date_current.year
+        self.T_air_series = self.get_temperature_series(
+            datetime.date(year, 1, 15), 12, 'month')
+        self.T_air_series_days = np.array(
+            [calendar.monthrange(year, month)[1] for month in range(1, 13)],
+            dtype=np.float64)
+
+    def get_input_vars_DailyValues(self):
+        # Every daily field of the current year
+        year = self._date_current.year
+        n_days = 366 if calendar.isleap(year) else 365
+        self.T_air_series = self.get_temperature_series(
+            datetime.date(year, 1, 1), n_days, 'day')
+        self.T_air_series_days = np.ones(n_days, dtype=np.float64)
+
+    def get_temperature_series(self, first_date, n_steps, step):
+        """ Temperature fields for n_steps months or days from first_date,
+        as an array of shape (n_steps, ydim, xdim), NaN where not available
+        """
+        series = np.zeros((n_steps,) + tuple(self._grid_shape),
+                          dtype=np.float32)
+        series.fill(np.nan)
+
+        if step == 'month':
+            dates = [first_date + relativedelta(months=n)
+                     for n in range(n_steps)]
+        else:
+            dates = [first_date + datetime.timedelta(days=n)
+                     for n in range(n_steps)]
+
+        if self._using_Files:
+            # One hyperslab read of every available step in the block
+            temperature = self._temperature_dataset.variables['temp']
+            if step == 'month':
+                t0 = self.get_temperature_month_index(first_date)
+            else:
+                t0 = (first_date - self._temperature_first_date).days
+            t_first = max(t0, 0)
+            t_last = min(t0 + n_steps, len(temperature))
+            if t_first < t_last:
+                series[t_first - t0:t_last - t0] = \
+                        self.read_temperature_slab(slice(t_first, t_last))
+        elif self._using_ConfigVals:
+            for n, t_date in enumerate(dates):
+                if self._temperature_first_date <= t_date <= \
+                   self._temperature_last_date:
+                    series[n] = self.get_datacube_slice(
+                        t_date,
+                        self._temperature_datacube,
+                        self._temperature_dates)
+
+            # Fill the field with Nan if value is 'missing value'
+            with np.errstate(invalid='ignore'):
+                series[series < -90] = np.nan
+
+        return series
+
+    def read_temperature_slab(self, t_index):
+        """ Read the model grid of the temperature file at t_index (an
+        int or a slice), with NaN wherever the file holds its fill or
+        missing value
+        """
+        temperature = self._temperature_dataset.variables['temp']
+        (j0, jskip) = (self._grid_j0, self._grid_jskip)
+        (i0, iskip) = (self._grid_i0, self._grid_iskip)
+        j_last = j0 + jskip * (self._grid_ydim - 1) + 1
+        i_last = i0 + iskip * (self._grid_xdim - 1) + 1
+
+        cache_key = None
+        if self._temperature_source_key is not None:
+            if isinstance(t_index, slice):
+                t_key = (t_index.start, t_index.stop)
+            else:
+                t_key = int(t_index)
+            cache_key = (self._temperature_source_key, 'temp', t_key,
+                         (j0, j_last, jskip, i0, i_last, iskip))
+            slab = self._slice_cache.get(cache_key)
+            if slab is not None:
+                return slab
+
+        n_subset = self._grid_ydim * self._grid_xdim
+        n_block = (j_last - j0) * (i_last - i0)
+        # (the output may be written by another thread meanwhile)
+        with model_output.netcdf_lock:
+            if n_block > self.contiguous_read_ratio * n_subset or \
+               (jskip == 1 and iskip == 1):
+                # Time index and spatial subset in a single read
+                slab = temperature[t_index, j0:j_last:jskip,
+                                   i0:i_last:iskip]
+            else:
+                slab = temperature[t_index, j0:j_last, i0:i_last]
+                slab = slab[..., ::jskip, ::iskip]
+
+        # netCDF4 masks values matching _FillValue or missing_value
+        slab = np.ma.filled(np.ma.asarray(slab, dtype=np.float32), np.nan)
+        if not set(('_FillValue', 'missing_value')) & \
+           set(temperature.ncattrs()):
+            # Without those attributes, fall back on the old
+            # 'missing value' threshold
+            with np.errstate(invalid='ignore'):
+                slab[slab < -90] = np.nan
+
+        if cache_key is not None:
+            self._slice_cache.put(cache_key, slab)
+        return slab
+
     def get_temperature_field(self, t_date=None):
         # By default, return the temperature field at the date of the current
         # timestep
@@ -812,12 +1155,8 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
             t_index = self.get_temperature_month_index(t_date)
 
             if self._using_Files:
-                # Files uses netcdf input
-                temperature_subregion = \
-                    self._temperature_dataset.variables['temp']\
-                        [t_index]\
-                        [self._grid_j0:self._grid_j1:self._grid_jskip,\
-                        self._grid_i0:self._grid_i1:self._grid_iskip]
+                # Files uses netcdf input, masked as it is read
+                temperature_subregion = self.read_temperature_slab(t_index)
             elif self._using_ConfigVals:
                 # ConfigVals is the Default, where the grids are in cfg file
                 temperature_subregion = \
@@ -839,9 +1178,10 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
 
             assert_equal(temperature_subregion.shape, self._grid_shape)
 
-            # Fill the field with Nan if value is 'missing value'
-            nan_locations = temperature_subregion < -90
-            temperature_subregion[nan_locations] = np.nan
+            if not self._using_Files:
+                # Fill the field with Nan if value is 'missing value'
+                nan_locations = temperature_subregion < -90
+                temperature_subregion[nan_locations] = np.nan
         else:
             #print("Date is outside valid date range of temperature data")
             temperature_subregion = np.zeros(self._grid_shape, dtype=np.float32)
@@ -992,10 +1332,11 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         self.stefan_frost_number = np.float32(-1.0)
 
     def compute_degree_days(self):
-        if self._dd_method == 'MinJanMaxJul':
-            self.compute_degree_days_MinJanMaxJul()
+        compute_method = self.degree_days_methods[self._dd_method][1]
+        getattr(self, compute_method)()
 
-    def compute_degree_days_MinJanMaxJul(self):
+    def compute_degree_days_MinJanMaxJul(self, T_cold=None, T_hot=None,
+                                         ddf=None, ddt=None):
 
         # Input: T_hot (avg temp of warmest month)
         #        T_cold (avg temp of coldest month)
@@ -1003,57 +1344,102 @@ class FrostnumberGeoMethod(perma_base.PermafrostComponent):
         # Output: ddf (degree freezing days)
         #         ddt (degree thawing days)
 
-        # Set to Nan where appropriate
-        for (j, i), maxvalue in np.ndenumerate(self.T_air_max):
-            minvalue = self.T_air_min[j, i]
-
-            if minvalue == np.nan or maxvalue == np.nan:
-                # Any non-numbers invalidate the dd calcs
-                self.ddf[j, i] = np.nan
-                self.ddt[j, i] = np.nan
-            elif maxvalue < minvalue:
-                # Can't have min temp > max temp!
-                self.ddf[j, i] = np.nan
-                self.ddt[j, i] = np.nan
-            elif minvalue >= 0.0:
-                # Never freezes
-                self.ddf[j, i] = 0.0
-                self.ddt[j, i] = 365.0 * (minvalue+maxvalue)/2.0
-            elif maxvalue <= 0.0:
-                # Never thaws
-                self.ddf[j, i] = -365.0 * (minvalue+maxvalue)/2.0
-                self.ddt[j, i] = 0.0
-            else:
-                # Freezes in winter, thaws in summer
-                T_average = (minvalue+maxvalue) / 2.0
-                T_amplitude = (maxvalue-minvalue) / 2.0
-                Beta = np.arccos(-T_average / T_amplitude)
-                T_summer = T_average + T_amplitude * np.sin(Beta) / Beta
-                T_winter = T_average - T_amplitude * np.sin(Beta) / (np.pi - Beta)
-                L_summer = 365.0 * Beta / np.pi
-                L_winter = 365.0 - L_summer
-                self.ddt[j, i] = T_summer * L_summer
-                self.ddf[j, i] = -T_winter * L_winter
-
-            if (self.ddt[j, i] == 0.0) and (self.ddf[j, i] == 0.0):
-                # This shouldn't happen with real values
-                self.ddf[j, i] = np.nan
-                self.ddt[j, i] = np.nan
-
-    def compute_air_frost_number_Geo(self):
+        # By default these are the model's current fields, but any
+        # arrays of matching shape, e.g. (years, y, x), may be given.
+        # All cells are done at once; each case is a boolean mask and
+        # the results are written into the existing ddf/ddt arrays
+        if T_cold is None:
+            (T_cold, T_hot) = (self.T_air_min, self.T_air_max)
+            (ddf, ddt) = (self.ddf, self.ddt)
+        T_cold = np.asarray(T_cold)
+        T_hot = np.asarray(T_hot)
+
+        # Any non-numbers invalidate the dd calcs,
+        # and we can't have min temp > max temp!
+        with np.errstate(invalid='ignore'):
+            invalid = np.isnan(T_cold) | np.isnan(T_hot) | (T_hot < T_cold)
+            never_freezes = ~invalid & (T_cold >= 0.0)
+            never_thaws = ~invalid & ~never_freezes & (T_hot <= 0.0)
+        mixed = ~(invalid | never_freezes | never_thaws)
+
+        T_average = np.asarray(T_cold + T_hot, dtype=np.float64) / 2.0
+
+        ddf.fill(np.nan)
+        ddt.fill(np.nan)
+
+        # Never freezes
+        ddf[never_freezes] = 0.0
+        ddt[never_freezes] = 365.0 * T_average[never_freezes]
+
+        # Never thaws
+        ddf[never_thaws] = -365.0 * T_average[never_thaws]
+        ddt[never_thaws] = 0.0
+
+        # Freezes in winter, thaws in summer
+        # (only these cells have T_cold < 0 < T_hot, so the
+        #  amplitude is never zero here)
+        mixed_average = T_average[mixed]
+        mixed_amplitude = np.asarray(T_hot[mixed] - T_cold[mixed],
+                                     dtype=np.float64) / 2.0
+        Beta = np.arccos(-mixed_average / mixed_amplitude)
+        sin_Beta = np.sin(Beta)
+        T_summer = mixed_average + mixed_amplitude * sin_Beta / Beta
+        T_winter = mixed_average - mixed_amplitude * sin_Beta / (np.pi - Beta)
+        L_summer = 365.0 * Beta / np.pi
+        L_winter = 365.0 - L_summer
+        ddt[mixed] = T_summer * L_summer
+        ddf[mixed] = -T_winter * L_winter
+
+        # This shouldn't happen with real values
+        no_degree_days = (ddt == 0.0) & (ddf == 0.0)
+        ddf[no_degree_days] = np.nan
+        ddt[no_degree_days] = np.nan
+
+    def compute_degree_days_MonthlyAverages(self):
+        # Input: T_air_series (the year's twelve monthly mean fields)
+        #        T_air_series_days (the number of days in each month)
+        self.compute_degree_days_from_series()
+
+    def compute_degree_days_DailyValues(self):
+        # Input: T_air_series (the year's daily mean fields)
+        self.compute_degree_days_from_series()
+
+    def compute_degree_days_from_series(self):
+        # Output: ddf (degree freezing days)
+        #         ddt (degree thawing days)
+        #
+        # The positive and negative parts of each field are weighted by
+        # the length of its step and accumulated along the time axis,
+        # for all cells at once
+        series = self.T_air_series
+        days = self.T_air_series_days.reshape((-1,) + (1,) * (series.ndim - 1))
+
+        self.ddt[...] = np.sum(np.maximum(series, 0.0) * days, axis=0)
+        self.ddf[...] = np.sum(np.maximum(-series, 0.0) * days, axis=0)
+
+        # Any missing field in the year invalidates the dd calcs,
+        # and a year with no degree days shouldn't happen with real values
+        invalid = np.any(np.isnan(series), axis=0) | \
+                  ((self.ddt == 0.0) & (self.ddf == 0.0))
+        self.ddf[invalid] = np.nan
+        self.ddt[invalid] = np.nan
+
+    def compute_air_frost_number_Geo(self, ddf=None, ddt=None, afn=None):
         # Calculating Reduced Air Frost Number (pages 280-281).
         # The reduced frost number is close 0 for long summers
         #   and close to 1 for long winters.
         #self.air_frost_number_Geo = np.sqrt(self.ddf) / \
         #    (np.sqrt(self.ddf) + np.sqrt(self.ddt))
-        where_nan = np.isnan(self.ddf + self.ddt)
-        where_notnan = np.logical_not(np.isnan(self.ddf + self.ddt))
+        if ddf is None:
+            (ddf, ddt, afn) = (self.ddf, self.ddt, self.air_frost_number_Geo)
+        where_nan = np.isnan(ddf + ddt)
+        where_notnan = np.logical_not(np.isnan(ddf + ddt))
 
-        self.air_frost_number_Geo[where_nan] = np.nan
+        afn[where_nan] = np.nan
 
-        self.air_frost_number_Geo[where_notnan] = \
-            np.sqrt(self.ddf[where_notnan]) / \
-            (np.sqrt(self.ddf[where_notnan]) + np.sqrt(self.ddt[where_notnan]))
+        afn[where_notnan] = \
+            np.sqrt(ddf[where_notnan]) / \
+            (np.sqrt(ddf[where_notnan]) + np.sqrt(ddt[where_notnan]))
 
 
 if __name__ == "__main__":
@@ -1061,7 +1447,6 @@ if __name__ == "__main__":
     # Currently, this just runs the defaults
     fn_geo = FrostnumberGeoMethod()
     fn_geo.initialize_frostnumberGeo_component()
-    fn_geo.initial_update()
-    fn_geo.update_until_timestep(fn_geo._timestep_last)
+    fn_geo.run_all_timesteps()
     fn_geo.finalize()
 
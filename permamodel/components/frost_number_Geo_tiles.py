@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""  Tiled, multi-process runs of FrostnumberGeoMethod
+
+     The frost number of each grid cell depends only on that cell, so
+     the (y, x) grid is split into tiles which are run independently,
+     each by its own FrostnumberGeoMethod.  The tiles are run by
+     domain_decomposition, in fresh Python processes rather than forked
+     ones, which would inherit this process's NetCDF state.  Every tile
+     writes its own output file; these are merged into one output file
+     for the whole grid at the end.
+
+     Usage:
+
+        run_tiled('FrostnumberGeo_Default.cfg', (100, 100),
+                  'FrostnumberGeo_output.nc', n_processes=8)
+
+*The MIT License (MIT)*
+
+Copyright (c) 2016 permamodel
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+
+import os
+import shutil
+import tempfile
+from permamodel.utils import model_output
+from permamodel.components import frost_number_Geo
+from permamodel.components import domain_decomposition
+
+
+def make_tiles(grid_shape, tile_shape):
+    """ Split a (ydim, xdim) grid into (j0, i0, ydim, xdim) tiles; the
+    tiles at the bottom and right edges may be smaller than tile_shape
+    """
+    (grid_ydim, grid_xdim) = grid_shape
+    (tile_ydim, tile_xdim) = tile_shape
+    return [(j0, i0, min(tile_ydim, grid_ydim - j0),
+             min(tile_xdim, grid_xdim - i0))
+            for j0 in range(0, grid_ydim, tile_ydim)
+            for i0 in range(0, grid_xdim, tile_xdim)]
+
+
+def read_grid_shape(cfg_file):
+    """ The (ydim, xdim) of the model grid in a FrostnumberGeo config file """
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_file)
+    return tuple(fn_geo.get_config_from_oldstyle_file(cfg_file)['grid_shape'])
+
+
+def run_tiled(cfg_file, tile_shape, output_file, n_processes=None,
+              tile_directory=None, keep_tiles=False):
+    """ Run FrostnumberGeo on tiles of its grid with a pool of processes
+    (all cores by default) and merge the tiles into output_file
+
+    The tiles (see domain_decomposition.partition()) go to
+    tile_directory (a temporary directory by default) and are removed
+    after merging unless keep_tiles is True.  Returns the list of
+    tiles, as (j0, i0, ydim, xdim).
+    """
+    grid_shape = read_grid_shape(cfg_file)
+    tiles = make_tiles(grid_shape, tile_shape)
+
+    made_directory = tile_directory is None
+    if made_directory:
+        tile_directory = tempfile.mkdtemp(
+            prefix='fn_tiles_',
+            dir=os.path.dirname(os.path.abspath(output_file)))
+
+    manifest_file = None
+    try:
+        manifest_file = domain_decomposition.partition(
+            cfg_file, len(tiles), tile_directory, tiles=tiles)
+        manifest = domain_decomposition.read_manifest(manifest_file)
+        domain_decomposition.run_tiles(manifest_file, n_processes)
+
+        tile_files = [os.path.join(domain_decomposition.tile_directory(
+                                       manifest_file, tile), output)
+                      for tile in manifest['tiles']
+                      for output in manifest['outputs']]
+        model_output.merge_grid_files(
+            tile_files, [(tile[0], tile[1]) for tile in tiles], output_file,
+            y_dim='y', x_dim='x', shape=grid_shape)
+    finally:
+        if not keep_tiles and made_directory:
+            shutil.rmtree(tile_directory, ignore_errors=True)
+        elif not keep_tiles and manifest_file is not None:
+            for tile in domain_decomposition.read_manifest(
+                    manifest_file)['tiles']:
+                shutil.rmtree(domain_decomposition.tile_directory(
+                    manifest_file, tile), ignore_errors=True)
+            os.remove(manifest_file)
+
+    return tiles
@@ -541,6 +541,49 @@ class PermafrostComponent( BMI_base.BMI_component ):
 
     #   close_input_files()
     #-------------------------------------------------------------------
+    def get_value_ptr(self, var_name):
+
+        #----------------------------------------------------------
+        # Notes: BMI 2.0 reference to the array of a variable.
+        #        It is the array the model itself uses, so it
+        #        stays valid (and current) from one update to
+        #        the next, and a coupler can read it without
+        #        making a copy.
+        #----------------------------------------------------------
+        return self.get_value_ref(var_name)
+
+    #   get_value_ptr()
+    #-------------------------------------------------------------------
+    def get_value(self, var_name, dest=None):
+
+        #----------------------------------------------------------
+        # Notes: Copy of the values of a variable.  If dest is
+        #        given, the values are copied into it (it may be
+        #        flat, as in BMI 2.0) and dest is returned, so
+        #        repeated calls allocate no new arrays.
+        #----------------------------------------------------------
+        values = np.asarray(self.get_value_ptr(var_name))
+        if (dest is None):
+            return values.copy()
+        if (dest.shape == values.shape):
+            dest[...] = values
+        else:
+            dest[...] = values.reshape(dest.shape)
+        return dest
+
+    #   get_value()
+    #-------------------------------------------------------------------
+    def set_value(self, var_name, new_var_values):
+
+        #----------------------------------------------------------
+        # Notes: The values are copied into the model's array,
+        #        so references from get_value_ptr() stay valid.
+        #----------------------------------------------------------
+        values = self.get_value_ptr(var_name)
+        values[...] = np.reshape(new_var_values, values.shape)
+
+    #   set_value()
+    #-------------------------------------------------------------------
 
     # ----------------------------------------
     # CRU geotiff file interpretation routines
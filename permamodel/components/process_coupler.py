@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""  Multi-process coupling of BMI components through shared memory
+
+     Each component runs in its own Python process (a ComponentProcess),
+     so components which spend their time in pure-Python loops do not
+     compete for one interpreter lock.  The component class is used
+     unchanged: the process imports it, initializes it from its cfg
+     file, and then runs the commands it receives from the coupler.
+
+     Every exchanged variable (and every variable written to the output
+     file) has two shared-memory blocks, memory-mapped files under
+     /dev/shm named after the variable, which both the producing and
+     consuming processes map.  Only short commands (pickled tuples)
+     go through the pipes to the processes; the grids are copied by
+     the components themselves, with get_value(name, dest=block) and
+     set_value(name, block).
+
+     The ProcessCoupler drives the processes as a pipeline: step t
+     uses the blocks of slot t % 2, so a component can compute step
+     t + 1 while those after it still compute step t.  Steps are
+     handed over in order, giving the results of a Coupler.
+
+     Usage:
+
+        fng = ComponentProcess(BmiFrostnumberGeoMethod, 'FNGeo.cfg')
+        cru = ComponentProcess(BmiCruAKtempMethod, 'cruAKtemp.cfg')
+        coupler = ProcessCoupler([cru, fng], {...},
+                                 output_file='fn_air.nc',
+                                 output_vars=['frostnumber__air'],
+                                 update_at_start=[fng])
+        coupler.run()
+        for component in (cru, fng):
+            component.finalize()
+            component.close()
+
+*The MIT License (MIT)*
+
+Copyright (c) 2016 permamodel
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import importlib
+import traceback
+import subprocess
+import cPickle as pickle
+
+import numpy as np
+from permamodel import permamodel_directory
+from permamodel.components import coupler
+
+shared_memory_directory = '/dev/shm'
+
+
+class ComponentWorker(object):
+    """ Runs the commands for one component, in its own process """
+
+    def __init__(self):
+        self.component = None
+        self.blocks = {}
+
+    def initialize(self, module_name, class_name, cfg_file):
+        module = importlib.import_module(module_name)
+        self.component = getattr(module, class_name)()
+        self.component.initialize(cfg_file)
+        return {'input_var_names': list(self.component.get_input_var_names()),
+                'output_var_names':
+                    list(self.component.get_output_var_names()),
+                'time_step': float(self.component.get_time_step()),
+                'end_time': float(self.component.get_end_time()),
+                'current_time': float(self.component.get_current_time())}
+
+    def describe(self, var_names):
+        """ The shape and dtype of each variable """
+        values = [np.asarray(self.component.get_value_ptr(var_name))
+                  for var_name in var_names]
+        return dict([(var_name, (value.shape, value.dtype.str))
+                     for (var_name, value) in zip(var_names, values)])
+
+    def get_value(self, var_name):
+        return self.component.get_value(var_name)
+
+    def attach(self, path, shape, dtype):
+        """ Map a shared block, created by the coupler """
+        self.blocks[path] = np.memmap(path, dtype=dtype, mode='r+',
+                                      shape=shape)
+
+    def set_inputs(self, inputs):
+        """ inputs are (block path, input name) """
+        for (path, input_name) in inputs:
+            self.component.set_value(input_name, self.blocks[path])
+
+    def put_outputs(self, outputs):
+        """ outputs are (output name, block path) """
+        for (output_name, path) in outputs:
+            self.component.get_value(output_name, dest=self.blocks[path])
+
+    def advance(self, time, inputs, outputs):
+        """ Update until time, if behind it, and put the outputs (also
+        when not updated, as they are held until the next update) """
+        if self.component.get_current_time() < time - coupler.time_tolerance:
+            self.set_inputs(inputs)
+            while self.component.get_current_time() < \
+                  time - coupler.time_tolerance:
+                self.component.update()
+        self.put_outputs(outputs)
+        return float(self.component.get_current_time())
+
+    def update_frac(self, time_fraction):
+        self.component.update_frac(time_fraction)
+        return float(self.component.get_current_time())
+
+    def finalize(self):
+        self.component.finalize()
+
+    def serve(self, commands, replies):
+        """ Run commands, (name, args) tuples, until 'exit'; each gets the
+        reply ('ok', result) or ('error', traceback) """
+        while True:
+            try:
+                (command, args) = pickle.load(commands)
+            except EOFError:
+                return
+            if command == 'exit':
+                return
+            try:
+                reply = ('ok', getattr(self, command)(*args))
+            except Exception:
+                reply = ('error', traceback.format_exc())
+            pickle.dump(reply, replies, pickle.HIGHEST_PROTOCOL)
+            replies.flush()
+
+
+class ComponentProcess(object):
+    """ A BMI component running in its own Python process """
+
+    def __init__(self, component_class, cfg_file, name=None):
+        """ Start the process and initialize a component_class from
+        cfg_file in it """
+        #----------------------------------------------------------
+        # Notes: The process is a new interpreter rather than a
+        #        fork, which would inherit the HDF5 state and open
+        #        NetCDF files of this one (see domain_decomposition).
+        #----------------------------------------------------------
+        self.name = name or component_class.__name__
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(permamodel_directory)] +
+            [path for path in [env.get('PYTHONPATH')] if path])
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'permamodel.components.process_coupler'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.pending = False
+
+        try:
+            info = self.request('initialize', component_class.__module__,
+                                component_class.__name__,
+                                os.path.abspath(cfg_file))
+        except Exception:
+            self.close()
+            raise
+        self.input_var_names = tuple(info['input_var_names'])
+        self.output_var_names = tuple(info['output_var_names'])
+        self.time_step = info['time_step']
+        self.end_time = info['end_time']
+        self.current_time = info['current_time']
+
+    def send(self, command, *args):
+        """ Send a command without waiting for its reply """
+        assert not self.pending
+        pickle.dump((command, args), self.process.stdin,
+                    pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.flush()
+        self.pending = (command != 'exit')
+
+    def wait(self):
+        """ The result of the command sent last, if not yet received """
+        if not self.pending:
+            return None
+        self.pending = False
+        try:
+            (status, result) = pickle.load(self.process.stdout)
+        except EOFError:
+            raise RuntimeError("The process of %s has ended" % self.name)
+        if status == 'error':
+            raise RuntimeError("Error in %s:\n%s" % (self.name, result))
+        return result
+
+    def request(self, command, *args):
+        """ Send a command and wait for its result """
+        self.wait()
+        self.send(command, *args)
+        return self.wait()
+
+    def get_input_var_names(self):
+        return self.input_var_names
+
+    def get_output_var_names(self):
+        return self.output_var_names
+
+    def get_time_step(self):
+        return self.time_step
+
+    def get_end_time(self):
+        return self.end_time
+
+    def get_current_time(self):
+        return self.current_time
+
+    def get_value(self, var_name):
+        """ A copy of the values, through the pipe (for inspection, not
+        for exchanges) """
+        return self.request('get_value', var_name)
+
+    def update_frac(self, time_fraction):
+        self.current_time = self.request('update_frac', time_fraction)
+
+    def advance(self, time, inputs, outputs):
+        """ Start an update until time (see ComponentWorker.advance());
+        finish_advance() waits for it """
+        self.wait()
+        self.send('advance', time, inputs, outputs)
+
+    def finish_advance(self):
+        if self.pending:
+            self.current_time = self.wait()
+
+    def finalize(self):
+        self.request('finalize')
+
+    def close(self):
+        """ End the process """
+        if self.process is None:
+            return
+        try:
+            self.pending = False
+            self.send('exit')
+            self.process.stdin.close()
+        except (IOError, OSError):
+            pass
+        self.process.wait()
+        self.process = None
+
+
+class ProcessCoupler(coupler.Coupler):
+    """ Couples ComponentProcesses through shared-memory blocks, as a
+    pipeline of the processes """
+
+    def __init__(self, components, exchanges, **kwargs):
+        """ components are ComponentProcesses, in an order in which each
+        comes after those it takes inputs from; the other arguments are
+        those of Coupler """
+        directory = shared_memory_directory \
+            if os.path.isdir(shared_memory_directory) else None
+        self.block_directory = tempfile.mkdtemp(prefix='coupler_',
+                                                dir=directory)
+        self.blocks = {}
+        try:
+            coupler.Coupler.__init__(self, components, exchanges, **kwargs)
+            for (output_name, producer, consumers) in self.exchanges:
+                for (consumer, _) in consumers:
+                    if self.components.index(consumer) <= \
+                       self.components.index(producer):
+                        raise ValueError(
+                            "%s takes %s from a component after it"
+                            % (consumer.name, output_name))
+            for (var_name, component) in self.output_components.items():
+                if var_name not in self.blocks:
+                    self.make_buffer(var_name, component)
+        except Exception:
+            self.remove_blocks()
+            raise
+
+    def make_buffer(self, var_name, producer):
+        """ The two shared blocks (one per slot) of a variable, mapped by
+        its producer and consumers """
+        ((shape, dtype),) = producer.request('describe', [var_name]).values()
+        users = [producer] + \
+            [consumer for (output_name, _, consumers) in self.exchanges
+             if output_name == var_name for (consumer, _) in consumers]
+        self.blocks[var_name] = []
+        for slot in (0, 1):
+            path = os.path.join(self.block_directory,
+                                '%s.%d' % (var_name, slot))
+            self.blocks[var_name].append(
+                np.memmap(path, dtype=dtype, mode='w+', shape=shape))
+            for user in users:
+                user.request('attach', path, shape, dtype)
+        return self.blocks[var_name]
+
+    def block_path(self, var_name, slot):
+        return self.blocks[var_name][slot].filename
+
+    def inputs(self, component, slot):
+        return [(self.block_path(output_name, slot), input_name)
+                for (output_name, _, consumers) in self.exchanges
+                for (consumer, input_name) in consumers
+                if consumer is component]
+
+    def outputs(self, component, slot):
+        var_names = [output_name for (output_name, producer, _)
+                     in self.exchanges if producer is component]
+        var_names += [var_name for (var_name, owner)
+                      in self.output_components.items()
+                      if (owner is component) and (var_name not in var_names)]
+        return [(var_name, self.block_path(var_name, slot))
+                for var_name in var_names]
+
+    def slot_values(self, slot):
+        return dict([(var_name, self.blocks[var_name][slot])
+                     for var_name in self.output_components])
+
+    def start(self):
+        """ Exchange the initial values (in slot 1, as for step -1) and
+        write them """
+        for component in self.components:
+            component.request('put_outputs', self.outputs(component, 1))
+        for component in self.components:
+            component.request('set_inputs', self.inputs(component, 1))
+            if component in self.update_at_start:
+                component.update_frac(0)
+                component.request('put_outputs', self.outputs(component, 1))
+
+        self.open_output(dict(
+            [(var_name, self.blocks[var_name][0].shape)
+             for var_name in self.output_components]))
+        self.write_outputs(self.slot_values(1))
+
+    def run(self):
+        """ Run the coupled components from the start to the end time;
+        the components are neither finalized nor closed """
+        try:
+            self.start()
+            times = self.step_times()
+            written = 0
+            for (step, time) in enumerate(times):
+                #------------------------------------------------------
+                # Every component has finished step - 2 (it was only
+                # sent step - 1 after that), so its slot can be
+                # written, and then reused for this step
+                #------------------------------------------------------
+                if step >= 2:
+                    self.write_step(times, written)
+                    written += 1
+                for component in self.components:
+                    for producer in self.producers(component):
+                        producer.finish_advance()
+                    component.advance(time, self.inputs(component, step % 2),
+                                      self.outputs(component, step % 2))
+            for component in self.components:
+                component.finish_advance()
+            while written < len(times):
+                self.write_step(times, written)
+                written += 1
+        finally:
+            # (replies still expected after an error are read and dropped)
+            for component in self.components:
+                try:
+                    component.finish_advance()
+                except RuntimeError:
+                    pass
+            try:
+                self.finish()
+            finally:
+                self.remove_blocks()
+
+    def producers(self, component):
+        return [producer for (_, producer, consumers) in self.exchanges
+                if any([consumer is component for (consumer, _) in consumers])]
+
+    def write_step(self, times, step):
+        self.time = times[step]
+        self.write_outputs(self.slot_values(step % 2))
+
+    def remove_blocks(self):
+        self.blocks = {}
+        shutil.rmtree(self.block_directory, ignore_errors=True)
+
+
+def main():
+    """ The process of a ComponentProcess: commands come on stdin and
+    replies go on stdout, so the component's own printing goes to
+    stderr """
+    commands = os.fdopen(os.dup(0), 'rb')
+    replies = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    ComponentWorker().serve(commands, replies)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+test_Ku_calibration.py
+  tests of the population-based calibration of the Ku component
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from permamodel.components import bmi_Ku_component
+from permamodel.components import Ku_calibration
+from permamodel import examples_directory
+from nose.tools import (assert_true, assert_equal, assert_raises)
+
+
+# The time series example does not save output grids
+ts_cfg_filename = os.path.join(examples_directory, 'Ku_method_TS.cfg')
+grid_cfg_filename = os.path.join(examples_directory, 'Ku_method_2D.cfg')
+
+def test_population_of_one_matches_bmi_run():
+    """ Test that the vectorized evaluation reproduces a BMI run """
+    ku = bmi_Ku_component.BmiKuMethod()
+    ku.initialize(ts_cfg_filename)
+    n_years = int(ku._model.end_year - ku._model.start_year + 1)
+    bmi_ALT = []
+    for year in range(n_years):
+        ku.update()
+        bmi_ALT.append(float(ku.get_value('soil__active_layer_thickness')))
+    ku.finalize()
+
+    site = Ku_calibration.read_site_inputs(ts_cfg_filename)
+    (ALT, TPS) = Ku_calibration.evaluate_population(site, [], np.zeros((1, 0)))
+    assert_equal(ALT.shape, (1, n_years))
+    assert_true(np.allclose(ALT[0], np.array(bmi_ALT, dtype=float),
+                            equal_nan=True))
+
+def test_population_of_one_matches_bmi_run_on_grid():
+    """ Test that a gridded site, with inputs of one value per year,
+    is evaluated as in a BMI run """
+    run_directory = tempfile.mkdtemp()
+    try:
+        # (the 2D example saves its grids to the run directory)
+        cfg_filename = os.path.join(run_directory, 'Ku_method_2D.cfg')
+        replacements = {'in_directory': examples_directory,
+                        'out_directory': run_directory + os.sep}
+        with open(grid_cfg_filename, 'r') as in_cfg:
+            lines = in_cfg.readlines()
+        with open(cfg_filename, 'w') as out_cfg:
+            for line in lines:
+                words = line.split('|')
+                if len(words) == 4 and words[0].strip() in replacements:
+                    words[1] = ' %s ' % replacements[words[0].strip()]
+                    line = '|'.join(words)
+                out_cfg.write(line)
+
+        ku = bmi_Ku_component.BmiKuMethod()
+        ku.initialize(cfg_filename)
+        n_years = int(ku._model.end_year - ku._model.start_year + 1)
+        bmi_ALT = []
+        for year in range(n_years):
+            ku.update()
+            # (get_value() drops the mask of the cells without soil)
+            bmi_ALT.append(np.ma.filled(np.ma.asarray(
+                ku.get_value_ptr('soil__active_layer_thickness'),
+                dtype=float), np.nan))
+        ku.finalize()
+
+        site = Ku_calibration.read_site_inputs(cfg_filename)
+        assert_equal(site['inputs']['Hvgf'].shape, (n_years,))
+        (ALT, TPS) = Ku_calibration.evaluate_population(site, [],
+                                                        np.zeros((1, 0)))
+        assert_equal(ALT.shape, (1, n_years) + bmi_ALT[0].shape)
+        assert_true(np.allclose(ALT[0], np.array(bmi_ALT), equal_nan=True))
+    finally:
+        shutil.rmtree(run_directory, ignore_errors=True)
+
+def test_population_is_evaluated_in_one_call():
+    """ Test that each candidate gets its own parameter values """
+    site = Ku_calibration.read_site_inputs(ts_cfg_filename)
+    population = np.array([[0.2], [0.3], [0.4]])
+    (ALT, TPS) = Ku_calibration.evaluate_population(site, ['vwc_H2O'],
+                                                    population)
+    assert_equal(ALT.shape, (3, site['n_years']))
+    for k in range(3):
+        (one_ALT, one_TPS) = Ku_calibration.evaluate_population(
+            site, ['vwc_H2O'], population[k:k+1])
+        assert_true(np.allclose(ALT[k], one_ALT[0], equal_nan=True))
+
+def test_calibration_recovers_known_parameters():
+    """ Test calibration against ALT made with known parameter values """
+    site = Ku_calibration.read_site_inputs(ts_cfg_filename)
+    (observed_ALT, observed_TPS) = Ku_calibration.evaluate_population(
+        site, ['vwc_H2O', 'rho_snow'], np.array([[0.35, 250.0]]))
+
+    calibration = Ku_calibration.KuCalibration(
+        ts_cfg_filename, observed_ALT=observed_ALT[0],
+        parameters=['vwc_H2O', 'rho_snow'])
+    result = calibration.run(population_size=20, n_generations=60, seed=1)
+
+    assert_true(result['cost'] < 0.005)
+    assert_true(abs(result['parameters']['vwc_H2O'] - 0.35) < 0.02)
+    # The best cost never gets worse
+    assert_true(np.all(np.diff(result['history']) <= 0.0))
+
+def test_calibration_uses_several_processes():
+    """ Test that a population split over processes gives the same costs """
+    site_ALT = Ku_calibration.evaluate_population(
+        Ku_calibration.read_site_inputs(ts_cfg_filename), [],
+        np.zeros((1, 0)))[0][0]
+    serial = Ku_calibration.KuCalibration(ts_cfg_filename,
+                                          observed_ALT=site_ALT)
+    parallel = Ku_calibration.KuCalibration(ts_cfg_filename,
+                                            observed_ALT=site_ALT,
+                                            n_processes=2)
+    population = serial.to_parameters(
+        np.random.RandomState(0).uniform(size=(7, len(serial.parameters))))
+    pool = Ku_calibration.multiprocessing.Pool(2)
+    try:
+        parallel_cost = parallel.cost(population, pool)
+    finally:
+        pool.close()
+        pool.join()
+    assert_true(np.allclose(serial.cost(population), parallel_cost))
+
+def test_calibration_needs_observations():
+    """ Test that a calibration without observations is refused """
+    assert_raises(ValueError, Ku_calibration.KuCalibration, ts_cfg_filename)
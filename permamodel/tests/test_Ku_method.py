@@ -0,0 +1,383 @@
+"""
+test_Ku_method.py
+  tests of the Ku component of permamodel using the bmi API
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from netCDF4 import Dataset
+from permamodel.components import bmi_Ku_component
+from permamodel.components import Ku_method
+from permamodel.utils import model_input
+from permamodel import examples_directory
+from nose.tools import (assert_true, assert_equal)
+
+
+# The 2D example uses a relative input directory, so a copy of it
+# with absolute input and output directories is written for testing
+example_2D_filename = os.path.join(examples_directory, 'Ku_method_2D.cfg')
+example_scalar_filename = os.path.join(examples_directory, 'Ku_method.cfg')
+example_TS_filename = os.path.join(examples_directory, 'Ku_method_TS.cfg')
+
+# List of files to be removed after testing is complete
+# use files_to_remove.append(<filename>) to add to it
+files_to_remove = []
+output_directory = None
+
+def make_ku_cfg(cfg_filename, replacements,
+                example_filename=example_2D_filename):
+    """ Copy an example cfg, replacing the values of the given keys """
+    with open(example_filename, 'r') as in_cfg:
+        lines = in_cfg.readlines()
+    with open(cfg_filename, 'w') as out_cfg:
+        for line in lines:
+            words = line.split('|')
+            key = words[0].strip()
+            if len(words) == 4 and key in replacements:
+                words[1] = ' %s ' % replacements[key]
+                line = '|'.join(words)
+            out_cfg.write(line)
+    files_to_remove.append(cfg_filename)
+    return cfg_filename
+
+def setup_module():
+    """ Standard fixture called before any tests in this file are performed """
+    global output_directory
+    output_directory = tempfile.mkdtemp()
+
+def teardown_module():
+    """ Standard fixture called after all tests in this file are performed """
+    for f in files_to_remove:
+        if os.path.exists(f):
+            os.remove(f)
+    if output_directory is not None:
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+def test_Ku_2D_output_grows_each_update():
+    """ Test that ALT and TPS grids are appended to file every update """
+    cfg_filename = make_ku_cfg(
+        os.path.join(output_directory, 'Ku_2D_stream.cfg'),
+        {'in_directory': examples_directory,
+         'out_directory': output_directory + os.sep})
+
+    ku = bmi_Ku_component.BmiKuMethod()
+    ku.initialize(cfg_filename)
+    alt_filename = os.path.join(output_directory, 'NA_ALT.nc')
+    tps_filename = os.path.join(output_directory, 'NA_TPS.nc')
+
+    n_steps = int(ku._model.end_year - ku._model.start_year + 1)
+    for step in range(n_steps):
+        ku.update()
+        # Written grids are visible before the run is finished
+        with Dataset(alt_filename, 'r') as ncid:
+            assert_equal(len(ncid.dimensions['time']), step + 1)
+    ku.finalize()
+
+    for filename, value in ((alt_filename, 'soil__active_layer_thickness'),
+                            (tps_filename, 'soil__temperature')):
+        with Dataset(filename, 'r') as ncid:
+            assert_equal(len(ncid.dimensions['time']), n_steps)
+            last_grid = np.ma.filled(ncid.variables['data'][-1, :, :],
+                                     np.nan)
+        last_value = np.reshape(ku.get_value(value), last_grid.shape)
+        assert_true(np.allclose(last_grid, last_value, equal_nan=True))
+
+def test_Ku_2D_prefetch_gives_same_results():
+    """ Test that prefetched input slices match those read on demand """
+    results = {}
+    for prefetch in ('Yes', 'No'):
+        cfg_filename = make_ku_cfg(
+            os.path.join(output_directory, 'Ku_2D_%s.cfg' % prefetch),
+            {'in_directory': examples_directory,
+             'out_directory': output_directory + os.sep,
+             'prefetch_inputs': prefetch,
+             'SAVE_ALT_GRIDS': 'No',
+             'SAVE_TPS_GRIDS': 'No'})
+        ku = bmi_Ku_component.BmiKuMethod()
+        ku.initialize(cfg_filename)
+        ku.update()
+        ku.update()
+        if prefetch == 'Yes':
+            # The slice for the next update is being read
+            assert_equal(ku._model.prefetched['index'], ku._model.cont + 1)
+        results[prefetch] = (ku.get_value('soil__active_layer_thickness'),
+                             ku.get_value('atmosphere_bottom_air__temperature'))
+        ku.finalize()
+
+    for with_prefetch, without_prefetch in zip(results['Yes'], results['No']):
+        assert_true(np.allclose(with_prefetch, without_prefetch,
+                                equal_nan=True))
+
+def make_forcing_file(forcing_filename, chunk_years=2):
+    """ Combine the 2D example inputs into one chunked forcing file """
+    input_dir = os.path.join(examples_directory, 'Ku_2D_Input')
+    names = {'ta.nc': 'tas', 'aa.nc': 'tas_amplitude', 'snd.nc': 'snd',
+             'rsn.nc': 'rho_snow', 'vwc.nc': 'vwc_H2O'}
+    with Dataset(forcing_filename, 'w', format='NETCDF4') as out_nc:
+        for input_name, var_name in sorted(names.items()):
+            with Dataset(os.path.join(input_dir, input_name), 'r') as in_nc:
+                if 'time' not in out_nc.dimensions:
+                    for dim in ('time', 'lat', 'lon'):
+                        out_nc.createDimension(dim, len(in_nc.dimensions[dim]))
+                        out_nc.createVariable(dim, 'f4', (dim,))
+                        out_nc.variables[dim][:] = in_nc.variables[dim][:]
+                data = in_nc.variables['data'][:]
+                var = out_nc.createVariable(
+                    var_name, 'f4', ('time', 'lat', 'lon'), zlib=True,
+                    chunksizes=(chunk_years,) + data.shape[1:])
+                var[:] = data
+    files_to_remove.append(forcing_filename)
+    return forcing_filename
+
+def test_Ku_2D_forcing_file_matches_separate_files():
+    """ Test that reading all inputs from one forcing file gives the same
+        results as reading them from one file per variable """
+    forcing_filename = make_forcing_file(
+        os.path.join(output_directory, 'Ku_2D_forcing.nc'))
+    common = {'in_directory': examples_directory,
+              'out_directory': output_directory + os.sep,
+              'SAVE_ALT_GRIDS': 'No',
+              'SAVE_TPS_GRIDS': 'No'}
+    separate_cfg = make_ku_cfg(
+        os.path.join(output_directory, 'Ku_2D_separate.cfg'), common)
+
+    # Replace the <var>_type/<var>_file pairs of the gridded inputs
+    forcing_cfg = os.path.join(output_directory, 'Ku_2D_forcing.cfg')
+    forcing_lines = [
+        'forcing_file | %s | string | all forcing\n' %
+        os.path.relpath(forcing_filename, examples_directory),
+        'T_air_type | Forcing | string | x\n',
+        'T_air_forcing_var | tas | string | x\n',
+        'A_air_type | Forcing | string | x\n',
+        'A_air_forcing_var | tas_amplitude | string | x\n',
+        'h_snow_type | Forcing | string | x\n',
+        'h_snow_forcing_var | snd | string | x\n',
+        'rho_snow_type | Forcing | string | x\n',
+        'vwc_H2O_type | Forcing | string | x\n']
+    with open(separate_cfg, 'r') as in_cfg:
+        lines = [line for line in in_cfg.readlines()
+                 if line.split('|')[0].strip() not in
+                 ('T_air_type', 'T_air_file', 'A_air_type', 'A_air_file',
+                  'h_snow_type', 'h_snow_file', 'rho_snow_type',
+                  'rho_snow_file', 'vwc_H2O_type', 'vwc_H2O_file')]
+    with open(forcing_cfg, 'w') as out_cfg:
+        for line in lines:
+            out_cfg.write(line)
+            if line.startswith('dt '):
+                out_cfg.writelines(forcing_lines)
+    files_to_remove.append(forcing_cfg)
+
+    results = []
+    for cfg_filename in (separate_cfg, forcing_cfg):
+        ku = bmi_Ku_component.BmiKuMethod()
+        ku.initialize(cfg_filename)
+        values = []
+        for _ in range(3):
+            ku.update()
+            values.append(np.copy(ku.get_value('soil__active_layer_thickness')))
+        results.append(values)
+        ku.finalize()
+
+    for separate, forcing in zip(*results):
+        assert_true(np.allclose(separate, forcing, equal_nan=True))
+
+def test_Ku_recomputes_only_what_changed():
+    """ Test that intermediates are cached until one of their inputs changes """
+    cfg_filename = make_ku_cfg(
+        os.path.join(output_directory, 'Ku_scalar.cfg'),
+        {'in_directory': examples_directory,
+         'out_directory': output_directory + os.sep,
+         'SAVE_ALT_GRIDS': 'No',
+         'SAVE_TPS_GRIDS': 'No'},
+        example_filename=example_scalar_filename)
+    ku = Ku_method.Ku_method()
+    ku.initialize(cfg_file=cfg_filename, SILENT=True)
+    ku.update_ground_temperatures()
+    ku.update_ALT()
+    Kt, snow_damping, tao1 = ku.Kt, ku.snow_damping, ku.tao1
+    first_alt = np.copy(ku.Zal)
+
+    # Nothing changed: cached values are reused, results are the same
+    ku.update_ground_temperatures()
+    ku.update_ALT()
+    assert_true(ku.Kt is Kt)
+    assert_true(ku.snow_damping is snow_damping)
+    assert_equal(ku.Zal, first_alt)
+
+    # New soil moisture: soil properties are recomputed, snow is not
+    ku.vwc_H2O = np.float64(0.3)
+    ku.update_ground_temperatures()
+    ku.update_ALT()
+    assert_true(ku.Kt is not Kt)
+    assert_true(ku.snow_damping is snow_damping)
+    assert_true(ku.tao1 is tao1)
+    assert_true(ku.Zal != first_alt)
+
+    # In-place changes must be reported with mark_input_changed()
+    ku.h_snow = np.array(ku.h_snow)
+    ku.update_ground_temperatures()
+    snow_damping = ku.snow_damping
+    ku.h_snow[...] = 2.0 * ku.h_snow
+    ku.mark_input_changed('h_snow')
+    ku.update_ground_temperatures()
+    assert_true(ku.snow_damping < snow_damping)
+
+def test_Ku_time_series_inputs_are_loaded_once():
+    """ Test that Time_Series inputs are served from memory, in order """
+    ku = Ku_method.Ku_method()
+    ku.initialize(cfg_file=example_TS_filename, SILENT=True)
+    assert_true(isinstance(ku.T_air_unit, model_input.TimeSeries))
+
+    T_air_file = os.path.join(examples_directory, 'Ku_TS_Input', 'T_air.txt')
+    T_air_values = np.loadtxt(T_air_file, dtype=np.float32)
+    assert_equal(len(ku.T_air_unit), len(T_air_values))
+    assert_equal(ku.T_air, T_air_values[0])
+    ku.read_input_files()
+    assert_equal(ku.T_air, T_air_values[1])
+    assert_equal(ku.T_air_unit.read_at(-1), T_air_values[-1])
+    ku.close_input_files()
+
+def test_time_series_npy_cache():
+    """ Test that a saved .npy copy of a time series is used """
+    ts_filename = os.path.join(output_directory, 'values.txt')
+    with open(ts_filename, 'w') as ts_file:
+        ts_file.write('1.5\n-2\n3e-1\n')
+    files_to_remove.append(ts_filename)
+    files_to_remove.append(ts_filename + '.npy')
+
+    values = model_input.load_time_series(ts_filename, save_npy=True)
+    assert_true(np.allclose(values, [1.5, -2.0, 0.3]))
+    assert_true(os.path.isfile(ts_filename + '.npy'))
+
+    # The cached copy is now read instead of the text
+    np.save(ts_filename + '.npy', np.array([4.0, 5.0], dtype=np.float32))
+    time_series = model_input.TimeSeries(ts_filename)
+    assert_equal(time_series.read_next(), 4.0)
+    assert_equal(time_series.read_next(), 5.0)
+    assert_true(time_series.read_next() is None)
+
+def test_Ku_2D_ALT_lookup_is_close_to_analytic():
+    """ Test that the approximate ALT lookup table is close to the equations """
+    results = {}
+    for ALT_method in ('Analytic', 'Lookup'):
+        cfg_filename = make_ku_cfg(
+            os.path.join(output_directory, 'Ku_2D_%s.cfg' % ALT_method),
+            {'in_directory': examples_directory,
+             'out_directory': output_directory + os.sep,
+             'ALT_method': ALT_method,
+             'SAVE_ALT_GRIDS': 'No',
+             'SAVE_TPS_GRIDS': 'No'})
+        ku = Ku_method.Ku_method()
+        ku.initialize(cfg_file=cfg_filename, SILENT=True)
+        ku.update_ground_temperatures()
+        ku.update_ALT()
+        results[ALT_method] = np.ma.filled(ku.Zal, np.nan)
+        if ALT_method == 'Lookup':
+            lookup_error = ku.get_ALT_lookup_error()
+        ku.close_input_files()
+        ku.close_output_files()
+
+    alt_error = np.abs(results['Lookup'] - results['Analytic'])
+    assert_true(np.nanmax(alt_error) < 0.01)
+    assert_true(np.allclose(np.nanmax(alt_error), lookup_error))
+    assert_true(np.array_equal(np.isnan(results['Lookup']),
+                               np.isnan(results['Analytic'])))
+
+def test_Ku_get_value_into_dest_and_set_value_in_place():
+    """ Test the BMI 2.0 style access to Ku's variables """
+    cfg_filename = make_ku_cfg(
+        os.path.join(output_directory, 'Ku_2D_value_ptr.cfg'),
+        {'in_directory': examples_directory,
+         'out_directory': output_directory + os.sep,
+         'SAVE_ALT_GRIDS': 'No',
+         'SAVE_TPS_GRIDS': 'No'})
+    ku = bmi_Ku_component.BmiKuMethod()
+    ku.initialize(cfg_filename)
+    ku.update()
+
+    alt = ku.get_value_ptr('soil__active_layer_thickness')
+    assert_true(alt is ku._model.Zal)
+    dest = np.empty(alt.size)
+    assert_true(ku.get_value('soil__active_layer_thickness', dest) is dest)
+    assert_true(np.allclose(dest, alt.flatten(), equal_nan=True))
+
+    # Setting an input changes the model's array, and what depends on it
+    T_air = ku.get_value_ptr('atmosphere_bottom_air__temperature')
+    version = ku._model.get_input_versions('T_air')
+    ku.set_value('atmosphere_bottom_air__temperature',
+                 np.full(T_air.size, -5.0))
+    assert_true(ku._model.T_air is T_air)
+    assert_true(np.all(T_air == -5.0))
+    assert_true(ku._model.get_input_versions('T_air') != version)
+
+    # A scalar input becomes an array the model uses
+    ku.set_value('vegetation__Hvgf', 0.5)
+    assert_equal(float(ku.get_value('vegetation__Hvgf')), 0.5)
+    ku.finalize()
+
+def test_Ku_references_stay_valid_across_updates():
+    """ Test that Ku updates its input and output arrays in place """
+    cfg_filename = make_ku_cfg(
+        os.path.join(output_directory, 'Ku_2D_stable_refs.cfg'),
+        {'in_directory': examples_directory,
+         'out_directory': output_directory + os.sep,
+         'SAVE_ALT_GRIDS': 'No',
+         'SAVE_TPS_GRIDS': 'No'})
+    ku = bmi_Ku_component.BmiKuMethod()
+    ku.initialize(cfg_filename)
+    names = ('soil__active_layer_thickness', 'soil__temperature',
+             'atmosphere_bottom_air__temperature', 'latitude', 'longitude')
+    refs = [ku.get_value_ptr(name) for name in names]
+    for _ in range(3):
+        ku.update()
+        for (name, ref) in zip(names, refs):
+            assert_true(ku.get_value_ptr(name) is ref)
+    assert_true(np.allclose(refs[0], ku._model.Zal, equal_nan=True))
+    ku.finalize()
+
+def test_Ku_2D_update_until_matches_updates():
+    """ Test that update_until() reads, computes and saves its years at
+    once, with the values and output grids of a loop of update() """
+    results = []
+    for run in ('per_step', 'at_once'):
+        run_directory = os.path.join(output_directory, run)
+        os.mkdir(run_directory)
+        cfg_filename = make_ku_cfg(
+            os.path.join(output_directory, 'Ku_2D_%s.cfg' % run),
+            {'in_directory': examples_directory,
+             'out_directory': run_directory + os.sep})
+        ku = bmi_Ku_component.BmiKuMethod()
+        ku.initialize(cfg_filename)
+        refs = [ku.get_value_ptr(name) for name in ku.get_output_var_names()]
+        stop_time = ku.get_end_time() - 1
+        if run == 'per_step':
+            for _ in range(int(stop_time)):
+                ku.update()
+            ku.update_frac(0)
+        else:
+            ku.update_until(stop_time)
+        assert_equal(ku.get_current_time(), stop_time)
+        values = [np.copy(ref) for ref in refs]
+        ku.finalize()
+
+        grids = []
+        for filename in ('NA_ALT.nc', 'NA_TPS.nc'):
+            with Dataset(os.path.join(run_directory, filename), 'r') as ncid:
+                grids.append((ncid.variables['time'][:],
+                              ncid.variables['data'][:]))
+        results.append((values, grids))
+
+    ((values, grids), (bulk_values, bulk_grids)) = results
+    for (bulk_value, value) in zip(bulk_values, values):
+        assert_true(np.array_equal(np.isnan(bulk_value), np.isnan(value)))
+        assert_true(np.array_equal(bulk_value[~np.isnan(value)],
+                                   value[~np.isnan(value)]))
+    for ((bulk_time, bulk_data), (time, data)) in zip(bulk_grids, grids):
+        assert_true(np.array_equal(bulk_time, time))
+        assert_equal(bulk_data.shape, (int(stop_time) + 1,) + data.shape[1:])
+        assert_true(np.array_equal(np.ma.getmaskarray(bulk_data),
+                                   np.ma.getmaskarray(data)))
+        assert_true(np.array_equal(np.ma.filled(bulk_data, 0.0),
+                                   np.ma.filled(data, 0.0)))
@@ -0,0 +1,294 @@
+"""
+test_coupler.py
+  tests of the in-process coupling of BMI components
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from netCDF4 import Dataset
+from permamodel.components import perma_base
+from permamodel.components import bmi_frost_number_Geo
+from permamodel.components import bmi_Ku_component
+from permamodel.components import coupler
+from permamodel.components import process_coupler
+from permamodel.components import domain_decomposition
+from permamodel import examples_directory
+from nose.tools import (assert_true, assert_equal, assert_raises)
+
+
+wmt_cfg_filename = os.path.join(examples_directory, 'FNGeo_WMT_testing.cfg')
+jan_name = 'atmosphere_bottom_air__temperature_mean_jan'
+jul_name = 'atmosphere_bottom_air__temperature_mean_jul'
+output_directory = None
+
+def setup_module():
+    """ Standard fixture called before any tests in this file are performed """
+    global output_directory
+    output_directory = tempfile.mkdtemp()
+
+def teardown_module():
+    """ Standard fixture called after all tests in this file are performed """
+    if output_directory is not None:
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+
+class MonthlyTemperatures(perma_base.PermafrostComponent):
+    """ Stands in for cruAKtemp: January and July temperature fields
+    which warm by a degree every time step """
+
+    def __init__(self, shape=(20, 40), time_step=1.0, end_time=10.0):
+        self.time = 0.0
+        self.time_step = time_step
+        self.end_time = end_time
+        self.n_updates = 0
+        self._values = {
+            jan_name: np.linspace(-30.0, -10.0, np.prod(shape)).reshape(shape),
+            jul_name: np.linspace(5.0, 15.0, np.prod(shape)).reshape(shape)}
+
+    def initialize(self, cfg_file=None):
+        pass
+
+    def get_input_var_names(self):
+        return ()
+
+    def get_output_var_names(self):
+        return (jan_name, jul_name)
+
+    def get_value_ref(self, var_name):
+        return self._values[var_name]
+
+    def update(self):
+        self.time += self.time_step
+        self.n_updates += 1
+        for values in self._values.values():
+            values += self.time_step
+
+    def get_current_time(self):
+        return self.time
+
+    def get_time_step(self):
+        return self.time_step
+
+    def get_end_time(self):
+        return self.end_time
+
+
+def make_frostnumber_geo(name):
+    """ A BmiFrostnumberGeoMethod with WMT inputs, writing its output
+    in the test directory """
+    cfg_filename = os.path.join(output_directory, name + '.cfg')
+    domain_decomposition.write_tile_cfg(
+        wmt_cfg_filename, cfg_filename,
+        {'output_directory': output_directory,
+         'output_filename': name + '.nc'}, [])
+    fng = bmi_frost_number_Geo.BmiFrostnumberGeoMethod()
+    fng.initialize(cfg_filename)
+    return fng
+
+def test_coupler_matches_hand_coded_loop():
+    """ Test that the coupler gives the frost numbers of the loop of
+    coupling/couple_cru_FNGeo.py """
+    fng = make_frostnumber_geo('FNGeo_by_hand')
+    temperatures = MonthlyTemperatures(fng._model._grid_shape)
+    fng.set_value(jan_name, temperatures.get_value(jan_name))
+    fng.set_value(jul_name, temperatures.get_value(jul_name))
+    fng.update_frac(0)
+    expected = [fng.get_value('frostnumber__air')]
+    while fng.get_current_time() < fng.get_end_time():
+        temperatures.update()
+        fng.set_value(jan_name, temperatures.get_value(jan_name))
+        fng.set_value(jul_name, temperatures.get_value(jul_name))
+        fng.update()
+        expected.append(fng.get_value('frostnumber__air'))
+    fng.finalize()
+
+    fng = make_frostnumber_geo('FNGeo_coupled')
+    temperatures = MonthlyTemperatures(fng._model._grid_shape)
+    output_file = os.path.join(output_directory, 'coupled.nc')
+    coupled = coupler.Coupler(
+        [temperatures, fng], {jan_name: jan_name, jul_name: jul_name},
+        output_file=output_file, output_vars=['frostnumber__air'],
+        update_at_start=[fng])
+    # The buffers are allocated before the run and kept
+    buffers = dict(coupled.buffers)
+    coupled.run()
+    fng.finalize()
+    for (name, buffer) in buffers.items():
+        assert_true(coupled.buffers[name] is buffer)
+    assert_true(np.all(buffers[jan_name] == temperatures._values[jan_name]))
+
+    with Dataset(output_file, 'r') as ncid:
+        assert_equal(list(ncid.variables['time'][:]),
+                     range(len(expected)))
+        air_fn = ncid.variables['frostnumber__air'][:]
+    assert_equal(air_fn.shape, (len(expected),) + fng._model._grid_shape)
+    assert_true(np.allclose(air_fn, expected))
+
+def test_coupler_holds_values_of_longer_time_steps():
+    """ Test that a component with a longer time step is updated only
+    when the clock reaches its time """
+    fng = make_frostnumber_geo('FNGeo_aligned')
+    temperatures = MonthlyTemperatures(fng._model._grid_shape,
+                                       time_step=2.0)
+    coupled = coupler.Coupler(
+        [temperatures, fng], {jan_name: jan_name, jul_name: jul_name},
+        update_at_start=[fng])
+    assert_equal(coupled.time_step, 1.0)
+    assert_equal(coupled.end_time, fng.get_end_time())
+    coupled.run()
+    fng.finalize()
+    assert_equal(fng.get_current_time(), fng.get_end_time())
+    assert_equal(temperatures.n_updates, (int(fng.get_end_time()) + 1) // 2)
+
+def test_coupler_checks_exchanges():
+    """ Test that each exchanged variable needs a producer and consumer """
+    temperatures = MonthlyTemperatures((2, 3))
+    assert_raises(ValueError, coupler.Coupler, [temperatures],
+                  {jan_name: jan_name})
+    assert_raises(ValueError, coupler.Coupler, [temperatures],
+                  {'frostnumber__air': jan_name})
+
+def read_coupled_output(output_file):
+    with Dataset(output_file, 'r') as ncid:
+        return (ncid.variables['time'][:],
+                ncid.variables['frostnumber__air'][:],
+                ncid.variables[jan_name][:])
+
+def test_pipelined_coupler_matches_coupler():
+    """ Test that running the upstream component a step ahead gives the
+    results of the sequential coupler """
+    outputs = []
+    for (name, coupler_class) in (('sequential', coupler.Coupler),
+                                  ('pipelined', coupler.PipelinedCoupler)):
+        fng = make_frostnumber_geo('FNGeo_' + name)
+        temperatures = MonthlyTemperatures(fng._model._grid_shape,
+                                           time_step=2.0)
+        output_file = os.path.join(output_directory, name + '.nc')
+        coupled = coupler_class(
+            [temperatures, fng], {jan_name: jan_name, jul_name: jul_name},
+            output_file=output_file,
+            output_vars=['frostnumber__air', jan_name],
+            update_at_start=[fng])
+        coupled.run()
+        fng.finalize()
+        outputs.append(read_coupled_output(output_file))
+
+    assert_equal(len(outputs[0][0]), int(fng.get_end_time()) + 1)
+    for (sequential, pipelined) in zip(*outputs):
+        assert_true(np.array_equal(sequential, pipelined))
+
+class FailingTemperatures(MonthlyTemperatures):
+    """ MonthlyTemperatures which fail at their third update """
+
+    def update(self):
+        if self.n_updates == 2:
+            raise RuntimeError("No temperatures for this year")
+        MonthlyTemperatures.update(self)
+
+def test_pipelined_coupler_raises_upstream_errors():
+    """ Test that an error of the worker is raised by run() """
+    fng = make_frostnumber_geo('FNGeo_failing')
+    temperatures = FailingTemperatures(fng._model._grid_shape)
+    coupled = coupler.PipelinedCoupler(
+        [temperatures, fng], {jan_name: jan_name, jul_name: jul_name},
+        update_at_start=[fng])
+    assert_equal(coupled.upstream, [temperatures])
+    assert_raises(RuntimeError, coupled.run)
+    # The downstream component got the two steps before the error
+    assert_equal(fng.get_current_time(), 2)
+    fng.finalize()
+
+    assert_raises(ValueError, coupler.PipelinedCoupler, [temperatures],
+                  {}, upstream=[temperatures])
+
+def test_process_coupler_matches_coupler():
+    """ Test that components in their own processes, exchanging values
+    through shared memory, give the results of the in-process coupler """
+    fng = make_frostnumber_geo('FNGeo_in_process')
+    temperatures = MonthlyTemperatures(fng._model._grid_shape)
+    output_file = os.path.join(output_directory, 'in_process.nc')
+    coupler.Coupler(
+        [temperatures, fng], {jan_name: jan_name, jul_name: jul_name},
+        output_file=output_file, output_vars=['frostnumber__air', jan_name],
+        update_at_start=[fng]).run()
+    fng.finalize()
+    expected = read_coupled_output(output_file)
+
+    cfg_filename = os.path.join(output_directory, 'FNGeo_in_process.cfg')
+    components = [
+        process_coupler.ComponentProcess(MonthlyTemperatures, cfg_filename),
+        process_coupler.ComponentProcess(
+            bmi_frost_number_Geo.BmiFrostnumberGeoMethod, cfg_filename)]
+    try:
+        output_file = os.path.join(output_directory, 'processes.nc')
+        coupled = process_coupler.ProcessCoupler(
+            components, {jan_name: jan_name, jul_name: jul_name},
+            output_file=output_file,
+            output_vars=['frostnumber__air', jan_name],
+            update_at_start=[components[1]])
+        coupled.run()
+        assert_true(not os.path.exists(coupled.block_directory))
+        assert_equal(components[1].get_current_time(),
+                     components[1].get_end_time())
+        components[1].finalize()
+    finally:
+        for component in components:
+            component.close()
+    for (in_process, processes) in zip(expected,
+                                       read_coupled_output(output_file)):
+        assert_true(np.array_equal(in_process, processes))
+
+def test_process_coupler_runs_Ku_unchanged():
+    """ Test that BmiKuMethod runs unchanged in its own process """
+    cfg_filename = os.path.join(output_directory, 'Ku_2D_processes.cfg')
+    domain_decomposition.write_tile_cfg(
+        os.path.join(examples_directory, 'Ku_method_2D.cfg'), cfg_filename,
+        {'in_directory': examples_directory,
+         'out_directory': output_directory + os.sep,
+         'SAVE_ALT_GRIDS': 'No', 'SAVE_TPS_GRIDS': 'No'}, [])
+    ku = bmi_Ku_component.BmiKuMethod()
+    ku.initialize(cfg_filename)
+    expected = []
+    for _ in range(int(ku.get_end_time())):
+        ku.update()
+        expected.append(ku.get_value('soil__active_layer_thickness'))
+    ku.finalize()
+
+    ku = process_coupler.ComponentProcess(bmi_Ku_component.BmiKuMethod,
+                                          cfg_filename)
+    try:
+        output_file = os.path.join(output_directory, 'Ku_processes.nc')
+        process_coupler.ProcessCoupler(
+            [ku], {}, output_file=output_file,
+            output_vars=['soil__active_layer_thickness']).run()
+        ku.finalize()
+    finally:
+        ku.close()
+    with Dataset(output_file, 'r') as ncid:
+        alt = ncid.variables['soil__active_layer_thickness'][1:]
+    assert_true(np.allclose(np.ma.filled(alt, np.nan),
+                            np.array(expected, dtype=np.float32),
+                            equal_nan=True))
+
+def test_process_coupler_raises_component_errors():
+    """ Test that an error in a component's process is raised by run() """
+    cfg_filename = os.path.join(output_directory, 'FNGeo_in_process.cfg')
+    components = [
+        process_coupler.ComponentProcess(FailingTemperatures, cfg_filename),
+        process_coupler.ComponentProcess(
+            bmi_frost_number_Geo.BmiFrostnumberGeoMethod, cfg_filename)]
+    try:
+        coupled = process_coupler.ProcessCoupler(
+            components, {jan_name: jan_name, jul_name: jul_name},
+            update_at_start=[components[1]])
+        assert_raises(RuntimeError, coupled.run)
+        # The processes still run the commands they are sent
+        components[1].finalize()
+    finally:
+        for component in components:
+            component.close()
+    assert_raises(RuntimeError, process_coupler.ComponentProcess,
+                  bmi_frost_number_Geo.BmiFrostnumberGeoMethod,
+                  os.path.join(output_directory, 'missing.cfg'))
@@ -0,0 +1,131 @@
+"""
+test_domain_decomposition.py
+  tests of the tiled runs of Ku and FrostnumberGeo
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from netCDF4 import Dataset
+from permamodel.components import bmi_Ku_component
+from permamodel.components import frost_number_Geo
+from permamodel.components import domain_decomposition
+from permamodel import examples_directory
+from nose.tools import (assert_true, assert_equal, assert_raises)
+
+
+example_2D_filename = os.path.join(examples_directory, 'Ku_method_2D.cfg')
+example_fngeo_filename = os.path.join(examples_directory,
+                                      'FrostnumberGeo_Default.cfg')
+output_directory = None
+
+def setup_module():
+    """ Standard fixture called before any tests in this file are performed """
+    global output_directory
+    output_directory = tempfile.mkdtemp()
+
+def teardown_module():
+    """ Standard fixture called after all tests in this file are performed """
+    if output_directory is not None:
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+def make_cfg(cfg_filename, example_filename, replacements):
+    """ Copy an example cfg, replacing the values of the given keys """
+    domain_decomposition.write_tile_cfg(example_filename, cfg_filename,
+                                        replacements, [])
+    return cfg_filename
+
+def read_grids(filename, var_names):
+    with Dataset(filename, 'r') as ncid:
+        return [np.ma.filled(ncid.variables[var][:], np.nan)
+                for var in var_names]
+
+def test_split_grid_covers_grid():
+    """ Test that the tiles cover the grid once, in the squarest layout """
+    tiles = domain_decomposition.split_grid((81, 281), 4)
+    assert_equal(len(tiles), 4)
+    # 81 rows and 281 columns are best split in columns only
+    assert_true(all([tile[0] == 0 and tile[2] == 81 for tile in tiles]))
+    coverage = np.zeros((81, 281), dtype=int)
+    for (j0, i0, ny, nx) in tiles:
+        coverage[j0:j0 + ny, i0:i0 + nx] += 1
+    assert_true(np.all(coverage == 1))
+    assert_raises(ValueError, domain_decomposition.split_grid, (3, 2), 7)
+
+def test_Ku_tiles_match_whole_grid():
+    """ Test that merged tile outputs equal those of one run of the grid """
+    whole_directory = os.path.join(output_directory, 'Ku_whole')
+    os.makedirs(whole_directory)
+    cfg_filename = make_cfg(
+        os.path.join(output_directory, 'Ku_2D_tiled.cfg'), example_2D_filename,
+        {'in_directory': examples_directory,
+         'out_directory': whole_directory + os.sep})
+
+    ku = bmi_Ku_component.BmiKuMethod()
+    ku.initialize(cfg_filename)
+    for _ in range(int(ku.get_end_time())):
+        ku.update()
+    ku.finalize()
+
+    job_directory = os.path.join(output_directory, 'Ku_job')
+    manifest_file = domain_decomposition.partition(cfg_filename, 4,
+                                                   job_directory)
+    manifest = domain_decomposition.read_manifest(manifest_file)
+    assert_equal(manifest['grid_shape'], [81, 281])
+    assert_equal(manifest['outputs'], ['NA_ALT.nc', 'NA_TPS.nc'])
+    assert_equal(len(manifest['tiles']), 4)
+
+    domain_decomposition.run_tiles(manifest_file, n_processes=2)
+    assert_equal(domain_decomposition.missing_tiles(manifest_file), [])
+    merged_files = domain_decomposition.merge(manifest_file)
+
+    for merged_file in merged_files:
+        whole_file = os.path.join(whole_directory,
+                                  os.path.basename(merged_file))
+        merged = read_grids(merged_file, ('lat', 'lon', 'time', 'data'))
+        whole = read_grids(whole_file, ('lat', 'lon', 'time', 'data'))
+        for (merged_values, whole_values) in zip(merged, whole):
+            assert_equal(merged_values.shape, whole_values.shape)
+            assert_true(np.allclose(merged_values, whole_values,
+                                    equal_nan=True))
+
+    # A tile which did not finish is reported, and can be run again
+    os.remove(os.path.join(job_directory, 'tile_002',
+                           domain_decomposition.complete_filename))
+    assert_equal(domain_decomposition.missing_tiles(manifest_file),
+                 ['tile_002'])
+    assert_raises(ValueError, domain_decomposition.merge, manifest_file)
+    assert_equal(domain_decomposition.run_tiles(manifest_file, n_processes=1),
+                 ['tile_002'])
+    domain_decomposition.merge(manifest_file)
+
+def test_FrostnumberGeo_tiles_match_whole_grid():
+    """ Test the command line tool on the default FrostnumberGeo config """
+    whole_directory = os.path.join(output_directory, 'FNGeo_whole')
+    os.makedirs(whole_directory)
+    cfg_filename = make_cfg(
+        os.path.join(output_directory, 'FNGeo_tiled.cfg'),
+        example_fngeo_filename, {'output_directory': whole_directory})
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_filename)
+    fn_geo.initialize_frostnumberGeo_component()
+    fn_geo.run_all_timesteps()
+    fn_geo.finalize()
+
+    job_directory = os.path.join(output_directory, 'FNGeo_job')
+    domain_decomposition.main(['partition', cfg_filename, '3', job_directory])
+    manifest_file = os.path.join(job_directory,
+                                 domain_decomposition.manifest_filename)
+    assert_equal([tile['shape'] for tile in
+                  domain_decomposition.read_manifest(manifest_file)['tiles']],
+                 [[1, 2], [1, 2], [1, 2]])
+    domain_decomposition.main(['run', manifest_file, '--processes', '1'])
+    domain_decomposition.main(['merge', manifest_file])
+
+    output_filename = 'FrostnumberGeo_output.nc'
+    merged = read_grids(os.path.join(job_directory, output_filename),
+                        ('y', 'x', 'air_fn'))
+    whole = read_grids(os.path.join(whole_directory, output_filename),
+                       ('y', 'x', 'air_fn'))
+    for (merged_values, whole_values) in zip(merged, whole):
+        assert_true(np.allclose(merged_values, whole_values, equal_nan=True))
@@ -5,6 +5,7 @@ test_frost_number.py
 from __future__ import print_function
 
 import os
+import numpy as np
 from permamodel.components import frost_number
 from .. import examples_directory
 from nose.tools import (assert_equal, assert_greater_equal,
@@ -109,3 +110,96 @@ def test_frostnumber_generates_output():
         files_to_remove.append(fn.fn_out_filename)
     else:
         print('Unable to test output to: {}'.format(fn.fn_out_filename))
+
+def test_frostnumber_precomputes_every_year():
+    """ Test that the vectorized years match the per-year calculation """
+    fn = frost_number.FrostnumberMethod()
+    cfg_file = os.path.join(examples_directory,
+                            'Frostnumber_example_timeseries.cfg')
+    fn.initialize(cfg_file=cfg_file)
+    n_years = fn.end_year - fn.start_year + 1
+    assert_equal(len(fn.air_frost_number_series), n_years)
+    for year in range(fn.start_year, fn.end_year + 1):
+        fn.year = year
+        fn.calculate_air_frost_number()
+        assert_almost_equal(
+            fn.air_frost_number_series[year - fn.start_year],
+            fn.air_frost_number, places=6)
+
+def test_frostnumber_update_until_year_stops_at_end_year():
+    """ Test that updating past the last year stops at end_year """
+    fn = frost_number.FrostnumberMethod()
+    cfg_file = os.path.join(examples_directory,
+                            'Frostnumber_example_timeseries.cfg')
+    fn.initialize(cfg_file=cfg_file)
+    fn.update_until_year(fn.end_year + 1)
+    assert_equal(fn.year, fn.end_year)
+    assert_equal(len(fn.output), fn.end_year - fn.start_year + 1)
+    assert_almost_equal(
+        fn.air_frost_number,
+        fn.air_frost_number_series[fn.end_year - fn.start_year], places=6)
+
+def test_degree_days_for_many_sites():
+    """ Test degree days computed for several years and sites at once """
+    T_cold = np.array([[-20.0, 5.0, -25.0], [0.0, -10.0, -2.0]])
+    T_hot = np.array([[10.0, 15.0, -5.0], [0.0, 10.0, -2.0]])
+    (ddf, ddt, T_average, T_amplitude) = \
+        frost_number.degree_days(T_cold, T_hot)
+    assert_equal(ddf.shape, (2, 3))
+    fn = frost_number.air_frost_number(ddf, ddt)
+    assert_almost_equal(fn[0, 0], 0.63267, places=3)
+    assert_almost_equal(fn[0, 1], 0.0, places=3)
+    assert_almost_equal(fn[0, 2], 1.0, places=3)
+    # Equal temperatures in a cosine-fit year give a symmetric result
+    assert_almost_equal(fn[1, 1], 0.5, places=3)
+    assert_almost_equal(ddf[1, 2], 365.0 * 2.0)
+
+def test_frostnumber_output_is_numeric():
+    """ Test that output records hold numbers indexed by year """
+    fn = frost_number.FrostnumberMethod()
+    cfg_file = os.path.join(examples_directory,
+                            'Frostnumber_example_timeseries.cfg')
+    fn.initialize(cfg_file=cfg_file)
+    fn.update()
+    assert_equal(sorted(fn.output.keys()), [2000, 2001])
+    assert_true(2002 not in fn.output)
+    assert_almost_equal(fn.output[2001]['air'], fn.air_frost_number)
+    assert_raises(KeyError, fn.output.__getitem__, 2002)
+
+def test_frostnumber_output_writers():
+    """ Test that each writer stores the calculated years """
+    fn = frost_number.FrostnumberMethod()
+    cfg_file = os.path.join(examples_directory,
+                            'Frostnumber_example_timeseries.cfg')
+    fn.initialize(cfg_file=cfg_file)
+    fn.update()
+    fn.update()
+    air = fn.output.valid_records()['air']
+
+    npy_filename = 'fn_test_output.npy'
+    files_to_remove.append(npy_filename)
+    fn.output.write(npy_filename)
+    records = np.load(npy_filename)
+    assert_true(np.array_equal(records['year'], [2000, 2001, 2002]))
+    assert_true(np.array_equal(records['air'], air))
+
+    csv_filename = 'fn_test_output.csv'
+    files_to_remove.append(csv_filename)
+    fn.output.write(csv_filename)
+    table = np.genfromtxt(csv_filename, delimiter=',', names=True)
+    assert_true(np.allclose(table['air'], air))
+
+    nc_filename = 'fn_test_output.nc'
+    files_to_remove.append(nc_filename)
+    fn.output.write(nc_filename)
+    ncid = frost_number.Dataset(nc_filename)
+    assert_true(np.array_equal(ncid.variables['air'][:], air))
+    ncid.close()
+
+    txt_filename = 'fn_test_output.txt'
+    files_to_remove.append(txt_filename)
+    fn.output.write(txt_filename)
+    with open(txt_filename) as f_in:
+        lines = f_in.readlines()
+    assert_equal(lines[0],
+                 "Year: 2000  output=('0.633', '-1.000', '-1.000')\n")
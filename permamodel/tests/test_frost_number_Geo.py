@@ -251,3 +251,364 @@ def test_Geo_frostnumber_update_until_timestep():
     fn_geo.update_until_timestep(fn_geo._timestep_last)
     fn_geo.finalize()
 
+
+def test_Geo_frostnumber_degree_day_cases():
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod()
+    fn_geo.initialize_frostnumberGeo_component()
+    fn_geo.T_air_min = np.array([[5.0, -25.0], [-20.0, np.nan],
+                                 [10.0, 0.0]], dtype=np.float32)
+    fn_geo.T_air_max = np.array([[15.0, -5.0], [10.0, 10.0],
+                                 [5.0, 0.0]], dtype=np.float32)
+    ddf = fn_geo.ddf
+    fn_geo.compute_degree_days()
+    # The results are written into the existing arrays
+    assert_true(fn_geo.ddf is ddf)
+    # Never freezes, never thaws
+    assert_equal((fn_geo.ddf[0, 0], fn_geo.ddt[0, 0]), (0.0, 365.0 * 10.0))
+    assert_equal((fn_geo.ddf[0, 1], fn_geo.ddt[0, 1]), (365.0 * 15.0, 0.0))
+    # Freezes and thaws
+    assert_greater(fn_geo.ddf[1, 0], 0.0)
+    assert_greater(fn_geo.ddt[1, 0], 0.0)
+    # Missing, reversed and all-zero temperatures are invalid
+    assert_true(np.isnan(fn_geo.ddf[1, 1]) and np.isnan(fn_geo.ddt[1, 1]))
+    assert_true(np.isnan(fn_geo.ddf[2, 0]) and np.isnan(fn_geo.ddt[2, 0]))
+    assert_true(np.isnan(fn_geo.ddf[2, 1]) and np.isnan(fn_geo.ddt[2, 1]))
+    fn_geo.finalize()
+
+def make_fngeo_cfg(cfg_filename, dd_method):
+    """ Copy the default config, selecting another degree days method """
+    default_cfg = os.path.join(examples_directory,
+                               frost_number_Geo.\
+                               default_frostnumberGeo_config_filename)
+    with open(default_cfg) as f_in:
+        lines = f_in.readlines()
+    with open(cfg_filename, 'w') as f_out:
+        for line in lines:
+            if line.startswith('degree_days_method'):
+                line = 'degree_days_method | %s | string | dd method\n' % \
+                    dd_method
+            f_out.write(line)
+    files_to_remove.append(cfg_filename)
+
+def test_Geo_frostnumber_monthly_and_daily_degree_days():
+    for dd_method in ('MonthlyAverages', 'DailyValues'):
+        cfg_filename = 'FrostnumberGeo_%s.cfg' % dd_method
+        make_fngeo_cfg(cfg_filename, dd_method)
+        fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_filename)
+        fn_geo.initialize_frostnumberGeo_component()
+        fn_geo.initial_update()
+
+        # Sum the year's fields one at a time
+        year = fn_geo._date_current.year
+        ddt = np.zeros(fn_geo._grid_shape)
+        ddf = np.zeros(fn_geo._grid_shape)
+        t_date = datetime.date(year, 1, 1)
+        while t_date.year == year:
+            field = fn_geo.get_datacube_slice(
+                t_date, fn_geo._temperature_datacube,
+                fn_geo._temperature_dates)
+            ddt += np.maximum(field, 0)
+            ddf += np.maximum(-field, 0)
+            t_date += datetime.timedelta(days=1)
+
+        if dd_method == 'DailyValues':
+            assert_true(np.allclose(fn_geo.ddt, ddt))
+            assert_true(np.allclose(fn_geo.ddf, ddf))
+        else:
+            # Monthly means are close to the daily sums
+            assert_true(np.allclose(fn_geo.ddt, ddt, atol=2.0 * 31))
+            assert_true(np.allclose(fn_geo.ddf, ddf, atol=2.0 * 31))
+        assert_false(np.any(np.isnan(fn_geo.air_frost_number_Geo)))
+        fn_geo.finalize()
+
+def test_Geo_frostnumber_rejects_unknown_degree_days_method():
+    cfg_filename = 'FrostnumberGeo_unknown_dd.cfg'
+    make_fngeo_cfg(cfg_filename, 'ObservedMinMax')
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_filename)
+    assert_raises(ValueError, fn_geo.initialize_frostnumberGeo_component)
+
+def test_Geo_frostnumber_refuses_daily_values_from_monthly_file():
+    # Monthly fields, like the CRU temperature files, and daily ones
+    for (nc_filename, units, is_daily) in (
+            ('FrostnumberGeo_test_monthly.nc', 'months since 1901-01-01',
+             False),
+            ('FrostnumberGeo_test_monthly_days.nc', 'days since 1901-01-01',
+             False),
+            ('FrostnumberGeo_test_daily.nc', 'days since 1901-01-01', True)):
+        files_to_remove.append(nc_filename)
+        ncid = frost_number_Geo.Dataset(nc_filename, 'w')
+        ncid.createDimension('time', None)
+        ncid.createDimension('y', 4)
+        ncid.createDimension('x', 3)
+        time = ncid.createVariable('time', 'f8', ('time',))
+        time.units = units
+        if is_daily or units.startswith('months'):
+            time[:] = np.arange(24)
+        else:
+            time[:] = np.arange(24) * 30.4375
+        temp = ncid.createVariable('temp', 'f4', ('time', 'y', 'x'))
+        temp[:] = np.zeros((24, 4, 3), dtype=np.float32)
+        ncid.close()
+
+        fn_geo = frost_number_Geo.FrostnumberGeoMethod()
+        fn_geo._temperature_source_filename = nc_filename
+        fn_geo.initialize_input_vars_from_files()
+        if is_daily:
+            fn_geo.check_temperature_file_is_daily()
+        else:
+            assert_raises(ValueError, fn_geo.check_temperature_file_is_daily)
+        fn_geo._temperature_dataset.close()
+
+def test_Geo_frostnumber_reads_temperature_subset():
+    # A small temperature file with some fill values
+    nc_filename = 'FrostnumberGeo_test_temperature.nc'
+    files_to_remove.append(nc_filename)
+    temperature = np.arange(3 * 20 * 16, dtype=np.float32).reshape(
+        (3, 20, 16)) % 50 - 25
+    temperature[1, 5, 4] = -9999.0
+    ncid = frost_number_Geo.Dataset(nc_filename, 'w')
+    ncid.createDimension('time', None)
+    ncid.createDimension('y', 20)
+    ncid.createDimension('x', 16)
+    temp = ncid.createVariable('temp', 'f4', ('time', 'y', 'x'),
+                               fill_value=-9999.0)
+    temp[:] = temperature
+    ncid.close()
+
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod()
+    fn_geo._temperature_dataset = frost_number_Geo.Dataset(nc_filename)
+    (fn_geo._grid_ydim, fn_geo._grid_xdim) = (4, 3)
+    (fn_geo._grid_j0, fn_geo._grid_jskip) = (1, 2)
+    (fn_geo._grid_i0, fn_geo._grid_iskip) = (1, 3)
+    expected = temperature[:, 1:9:2, 1:10:3]
+    expected[expected == -9999.0] = np.nan
+
+    # Both the strided read and the contiguous-block read
+    for ratio in (0, 64):
+        fn_geo.contiguous_read_ratio = ratio
+        slab = fn_geo.read_temperature_slab(1)
+        assert_equal(slab.shape, (4, 3))
+        assert_true(np.isnan(slab[2, 1]))
+        assert_true(np.allclose(slab, expected[1], equal_nan=True))
+        block = fn_geo.read_temperature_slab(slice(0, 3))
+        assert_true(np.allclose(block, expected, equal_nan=True))
+    fn_geo._temperature_dataset.close()
+
+def test_Geo_frostnumber_caches_temperature_slices():
+    nc_filename = 'FrostnumberGeo_test_cache.nc'
+    files_to_remove.append(nc_filename)
+    ncid = frost_number_Geo.Dataset(nc_filename, 'w')
+    ncid.createDimension('time', None)
+    ncid.createDimension('y', 4)
+    ncid.createDimension('x', 3)
+    temp = ncid.createVariable('temp', 'f4', ('time', 'y', 'x'))
+    temp[:] = np.arange(24 * 12, dtype=np.float32).reshape((24, 4, 3))
+    ncid.close()
+
+    cache = frost_number_Geo.slice_cache.SliceCache(
+        max_bytes=2 * 4 * 3 * 4)
+    fn_geos = []
+    for n in range(2):
+        fn_geo = frost_number_Geo.FrostnumberGeoMethod()
+        fn_geo._slice_cache = cache
+        fn_geo._temperature_source_filename = nc_filename
+        fn_geo.initialize_input_vars_from_files()
+        (fn_geo._grid_ydim, fn_geo._grid_xdim) = (4, 3)
+        (fn_geo._grid_j0, fn_geo._grid_jskip) = (0, 1)
+        (fn_geo._grid_i0, fn_geo._grid_iskip) = (0, 1)
+        fn_geos.append(fn_geo)
+
+    first = fn_geos[0].read_temperature_slab(5)
+    first[:] = -1.0
+    # A second instance gets the cached slice, unchanged by the first
+    second = fn_geos[1].read_temperature_slab(5)
+    assert_equal((cache.hits, cache.misses), (1, 1))
+    assert_equal(second[0, 0], 5 * 12)
+
+    # Room for two slices: the least recently used one is dropped
+    fn_geos[0].read_temperature_slab(6)
+    fn_geos[0].read_temperature_slab(7)
+    assert_equal(len(cache), 2)
+    assert_equal(cache.nbytes, 2 * 4 * 3 * 4)
+    fn_geos[0].read_temperature_slab(5)
+    assert_equal((cache.hits, cache.misses), (1, 4))
+    for fn_geo in fn_geos:
+        fn_geo._temperature_dataset.close()
+
+def run_fngeo_and_read_output(cfg_filename=None, batch=False):
+    """ Run FrostnumberGeo one step at a time or in batch mode """
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_filename)
+    fn_geo.initialize_frostnumberGeo_component()
+    if batch:
+        fn_geo.run_all_timesteps()
+    else:
+        fn_geo.initial_update()
+        fn_geo.update_until_timestep(fn_geo._timestep_last)
+    fn_geo.finalize()
+    ncid = frost_number_Geo.Dataset(fn_geo.output_filename)
+    air_fn = ncid.variables['air_fn'][:]
+    ncid.close()
+    return (fn_geo, air_fn)
+
+def test_Geo_frostnumber_whole_run_matches_timesteps():
+    (stepped, stepped_fn) = run_fngeo_and_read_output()
+    (batch, batch_fn) = run_fngeo_and_read_output(batch=True)
+    assert_equal(batch._timestep_current, stepped._timestep_current)
+    assert_true(np.allclose(batch.air_frost_number_Geo,
+                            stepped.air_frost_number_Geo, equal_nan=True))
+    assert_equal(batch_fn.shape, stepped_fn.shape)
+    assert_true(np.allclose(np.ma.filled(batch_fn, np.nan),
+                            np.ma.filled(stepped_fn, np.nan), equal_nan=True))
+
+    # Methods reading whole years are run year by year
+    cfg_filename = 'FrostnumberGeo_batch_MonthlyAverages.cfg'
+    make_fngeo_cfg(cfg_filename, 'MonthlyAverages')
+    (stepped, stepped_fn) = run_fngeo_and_read_output(cfg_filename)
+    (batch, batch_fn) = run_fngeo_and_read_output(cfg_filename, batch=True)
+    assert_true(np.allclose(np.ma.filled(batch_fn, np.nan),
+                            np.ma.filled(stepped_fn, np.nan), equal_nan=True))
+
+def test_Geo_frostnumber_output_has_one_entry_per_year():
+    (fn_geo, air_fn) = run_fngeo_and_read_output()
+    n_years = fn_geo._timestep_last - fn_geo._timestep_first + 1
+    assert_equal(air_fn.shape, (n_years,) + tuple(fn_geo._grid_shape))
+    ncid = frost_number_Geo.Dataset(fn_geo.output_filename)
+    assert_equal(list(ncid.variables['time'][:]),
+                 range(fn_geo._timestep_first, fn_geo._timestep_last + 1))
+    assert_equal(ncid.variables['air_fn'].chunking(),
+                 [1] + list(fn_geo._grid_shape))
+    assert_equal(list(ncid.variables['x'][:]), range(fn_geo._grid_xdim))
+    ncid.close()
+
+def test_Geo_frostnumber_writes_output_in_background():
+    cfg_filename = 'FrostnumberGeo_sync_output.cfg'
+    make_fngeo_cfg(cfg_filename, 'MinJanMaxJul')
+    with open(cfg_filename, 'a') as f_out:
+        f_out.write('output_async | False | string | write in the model\n')
+    (sync_run, sync_fn) = run_fngeo_and_read_output(cfg_filename)
+    assert_true(sync_run._output_writer is None)
+    (async_run, async_fn) = run_fngeo_and_read_output()
+    assert_true(np.allclose(np.ma.filled(async_fn, np.nan),
+                            np.ma.filled(sync_fn, np.nan), equal_nan=True))
+
+    # Errors in the writer thread are raised by finalize()
+    fn_geo = frost_number_Geo.FrostnumberGeoMethod()
+    fn_geo.initialize_frostnumberGeo_component()
+    fn_geo.initial_update()
+    fn_geo.write_output('no_such_variable', 0, fn_geo.air_frost_number_Geo)
+    assert_raises(KeyError, fn_geo.finalize)
+    assert_equal(fn_geo._output_fid, -1)
+
+def make_datacube_cfg(cfg_filename, datacube_filename, dates, grid_shape):
+    """ Default config reading its temperature datacube from a file """
+    default_cfg = os.path.join(examples_directory,
+                               frost_number_Geo.\
+                               default_frostnumberGeo_config_filename)
+    with open(default_cfg) as f_in:
+        lines = [line for line in f_in.readlines()
+                 if not line.startswith('temperature_grid_')]
+    with open(cfg_filename, 'w') as f_out:
+        for line in lines:
+            if line.startswith('grid_rows'):
+                line = 'grid_rows | %d | int | rows\n' % grid_shape[0]
+            elif line.startswith('grid_columns'):
+                line = 'grid_columns | %d | int | columns\n' % grid_shape[1]
+            elif line.startswith('n_temperature_grid_fields'):
+                line = 'n_temperature_grid_fields | %d | int | fields\n' % \
+                    len(dates)
+            f_out.write(line)
+        f_out.write('temperature_datacube_filename | %s | string | cube\n'
+                    % os.path.abspath(datacube_filename))
+        for (n, date) in enumerate(dates):
+            f_out.write('temperature_grid_date_%d | %s | string | date\n' %
+                        (n, date))
+    files_to_remove.append(cfg_filename)
+
+def test_Geo_frostnumber_reads_datacube_files():
+    grid_shape = (40, 30)
+    dates = [datetime.date(1901 + m // 12, m % 12 + 1, 1)
+             for m in range(12 * 6)]
+    rs = np.random.RandomState(0)
+    datacube = rs.uniform(-30, 25, (len(dates),) + grid_shape).astype(
+        np.float32)
+
+    npy_filename = 'FrostnumberGeo_test_datacube.npy'
+    files_to_remove.append(npy_filename)
+    np.save(npy_filename, datacube)
+
+    nc_filename = 'FrostnumberGeo_test_datacube.nc'
+    files_to_remove.append(nc_filename)
+    ncid = frost_number_Geo.Dataset(nc_filename, 'w')
+    ncid.createDimension('time', len(dates))
+    ncid.createDimension('y', grid_shape[0])
+    ncid.createDimension('x', grid_shape[1])
+    time = ncid.createVariable('time', 'f8', ('time',))
+    time.units = 'days since 1900-01-01'
+    time[:] = [(d - datetime.date(1900, 1, 1)).days for d in dates]
+    ncid.createVariable('temp', 'f4', ('time', 'y', 'x'))[:] = datacube
+    ncid.close()
+
+    results = []
+    for datacube_filename in (npy_filename, nc_filename):
+        cfg_filename = datacube_filename + '.cfg'
+        make_datacube_cfg(cfg_filename, datacube_filename, dates, grid_shape)
+        fn_geo = frost_number_Geo.FrostnumberGeoMethod(cfgfile=cfg_filename)
+        fn_geo.initialize_frostnumberGeo_component()
+        assert_equal(fn_geo._temperature_dates, dates)
+        test_date = datetime.date(1903, 3, 10)
+        assert_true(np.array_equal(
+            fn_geo.get_temperature_field(test_date), datacube[26]))
+        fn_geo.initial_update()
+        results.append(fn_geo.air_frost_number_Geo.copy())
+        fn_geo.finalize()
+    assert_true(np.allclose(results[0], results[1], equal_nan=True))
+
+def test_Geo_frostnumber_tiled_run_matches_whole_grid():
+    from permamodel.components import frost_number_Geo_tiles
+    grid_shape = (40, 30)
+    dates = [datetime.date(1901 + m // 12, m % 12 + 1, 1)
+             for m in range(12 * 6)]
+    datacube = np.random.RandomState(1).uniform(
+        -30, 25, (len(dates),) + grid_shape).astype(np.float32)
+    npy_filename = 'FrostnumberGeo_tiles_datacube.npy'
+    files_to_remove.append(npy_filename)
+    np.save(npy_filename, datacube)
+
+    # The tile processes read NetCDF inputs as well
+    nc_filename = 'FrostnumberGeo_tiles_datacube.nc'
+    files_to_remove.append(nc_filename)
+    ncid = frost_number_Geo.Dataset(nc_filename, 'w')
+    ncid.createDimension('time', len(dates))
+    ncid.createDimension('y', grid_shape[0])
+    ncid.createDimension('x', grid_shape[1])
+    time = ncid.createVariable('time', 'f8', ('time',))
+    time.units = 'days since 1900-01-01'
+    time[:] = [(d - datetime.date(1900, 1, 1)).days for d in dates]
+    ncid.createVariable('temp', 'f4', ('time', 'y', 'x'))[:] = datacube
+    ncid.close()
+
+    # Tiles at the edges are smaller than the others
+    tiles = frost_number_Geo_tiles.make_tiles(grid_shape, (16, 12))
+    assert_equal(len(tiles), 9)
+    assert_equal(tiles[-1], (32, 24, 8, 6))
+
+    for datacube_filename in (npy_filename, nc_filename):
+        cfg_filename = 'FrostnumberGeo_tiles_%s.cfg' % \
+            os.path.splitext(datacube_filename)[1][1:]
+        make_datacube_cfg(cfg_filename, datacube_filename, dates, grid_shape)
+        merged_filename = 'FrostnumberGeo_tiles_merged.nc'
+        files_to_remove.append(merged_filename)
+        frost_number_Geo_tiles.run_tiled(cfg_filename, (16, 12),
+                                         merged_filename, n_processes=2)
+        (whole, whole_fn) = run_fngeo_and_read_output(cfg_filename,
+                                                      batch=True)
+
+        ncid = frost_number_Geo.Dataset(merged_filename)
+        merged_fn = ncid.variables['air_fn'][:]
+        assert_true(np.array_equal(ncid.variables['x'][:], np.arange(30)))
+        assert_true(np.array_equal(ncid.variables['y'][:], np.arange(40)))
+        ncid.close()
+        assert_equal(merged_fn.shape, whole_fn.shape)
+        assert_true(np.allclose(np.ma.filled(merged_fn, np.nan),
+                                np.ma.filled(whole_fn, np.nan),
+                                equal_nan=True))
@@ -289,3 +289,69 @@ def test_FNGeo_simulate_WMT_run():
     assert_array_equal(0.5 * airtemps_of_one, airfn_values)
 
     fng.finalize()  # Must have this or get IOError later
+
+def test_FNGeo_value_ptr_and_get_value_into_dest():
+    """ Test that BMI arrays are the model's and are not reallocated """
+    fng = bmi_frost_number_Geo.BmiFrostnumberGeoMethod()
+    fng.initialize()
+
+    air_fn = fng.get_value_ptr('frostnumber__air')
+    assert_true(air_fn is fng._model.air_frost_number_Geo)
+    address = air_fn.__array_interface__['data'][0]
+    dest = np.empty(air_fn.size, dtype=air_fn.dtype)
+    for _ in range(3):
+        fng.update()
+        assert_true(fng.get_value_ptr('frostnumber__air') is air_fn)
+        assert_equal(air_fn.__array_interface__['data'][0], address)
+        # A flat dest is filled in place
+        assert_true(fng.get_value('frostnumber__air', dest) is dest)
+        assert_array_equal(dest, air_fn.flatten())
+
+    # set_value copies into the model's array
+    jan = fng.get_value_ptr('atmosphere_bottom_air__temperature_mean_jan')
+    fng.set_value('atmosphere_bottom_air__temperature_mean_jan',
+                  np.arange(jan.size))
+    assert_true(fng._model._temperature_jan is jan)
+    assert_array_equal(jan, np.arange(jan.size).reshape(jan.shape))
+
+    fng.finalize()  # Must have this or get IOError later
+
+def run_fngeo_until(stop_time, per_step, cfg_file=None, temperatures=None):
+    """ Run BmiFrostnumberGeoMethod to stop_time and read its output """
+    fng = bmi_frost_number_Geo.BmiFrostnumberGeoMethod()
+    fng.initialize(cfg_file)
+    if temperatures is not None:
+        grid_shape = fng._model._grid_shape
+        fng.set_value('atmosphere_bottom_air__temperature_mean_jan',
+                      np.full(grid_shape, temperatures[0]))
+        fng.set_value('atmosphere_bottom_air__temperature_mean_jul',
+                      np.full(grid_shape, temperatures[1]))
+    fng.update_frac(0)
+    if per_step:
+        while fng.get_current_time() < stop_time:
+            fng.update()
+    else:
+        fng.update_until(stop_time)
+    air_fn = np.array(fng.get_value('frostnumber__air'))
+    current_time = fng.get_current_time()
+    fng.finalize()
+    ncid = frost_number_Geo.Dataset(fng._model.output_filename)
+    output = ncid.variables['air_fn'][:]
+    ncid.close()
+    return (current_time, air_fn, output)
+
+def test_FNGeo_update_until_matches_updates():
+    """ Test that update_until() computes its years at once with the
+    results of a loop of update() """
+    wmt_cfg_file = os.path.join(examples_directory, "FNGeo_WMT_testing.cfg")
+    for (cfg_file, temperatures) in ((None, None),
+                                     (wmt_cfg_file, (-12.0, 8.0))):
+        stop_time = 3.0
+        per_step = run_fngeo_until(stop_time, True, cfg_file, temperatures)
+        at_once = run_fngeo_until(stop_time, False, cfg_file, temperatures)
+        assert_equal(at_once[0], stop_time)
+        assert_equal(per_step[0], at_once[0])
+        assert_array_equal(per_step[1], at_once[1])
+        assert_equal(per_step[2].shape, at_once[2].shape)
+        assert_array_equal(np.ma.filled(per_step[2], np.nan),
+                           np.ma.filled(at_once[2], np.nan))
@@ -4,6 +4,7 @@ test_frost_number_bmi.py
 """
 
 import os
+import numpy as np
 from permamodel.components import bmi_frost_number
 from permamodel import examples_directory
 from nose.tools import (assert_is_instance, assert_raises,
@@ -172,3 +173,50 @@ def test_bmi_fn_get_var_units():
     assert_in('deg',
               fn.get_var_units('atmosphere_bottom_air__temperature'))
 
+
+def test_bmi_fn_value_ptr_is_updated_in_place():
+    """ Test that the frost number array is kept, and refilled each year """
+    fn = bmi_frost_number.BmiFrostnumberMethod()
+    fn.initialize(cfg_file=onesite_multiyear_filename)
+    air_fn = fn.get_value_ptr('frostnumber__air')
+    dest = np.empty(1, dtype=air_fn.dtype)
+    for _ in range(3):
+        fn.update()
+        assert_true(fn.get_value_ptr('frostnumber__air') is air_fn)
+        assert_equal(float(air_fn), float(fn.model.air_frost_number))
+        # get_value() fills the caller's array instead of making one
+        assert_true(fn.get_value('frostnumber__air', dest) is dest)
+        assert_equal(dest[0], air_fn)
+
+    temperature = fn.get_value_ptr('atmosphere_bottom_air__temperature')
+    fn.set_value('atmosphere_bottom_air__temperature', 5.0)
+    assert_true(fn.get_value_ptr('atmosphere_bottom_air__temperature')
+                is temperature)
+    assert_equal(float(temperature), 5.0)
+
+def test_frost_number_update_until_matches_updates():
+    """ Test that update_until() takes its years from the precomputed
+    series at once, and loops over update() when the inputs changed """
+    for change_inputs in (False, True):
+        runs = []
+        for per_step in (True, False):
+            fn = bmi_frost_number.BmiFrostnumberMethod()
+            fn.initialize(cfg_file=onesite_multiyear_filename)
+            if change_inputs:
+                fn.model.T_air_min = np.asarray(fn.model.T_air_min) - 5.0
+            if per_step:
+                while fn.model.year < fn.model.end_year:
+                    fn.update()
+            else:
+                fn.update_until(fn.get_end_time())
+            runs.append((fn.model.year, fn.model.output.valid_records(),
+                         [fn.get_value(var_name) for var_name
+                          in fn.get_output_var_names()]))
+        ((year, records, values), (bulk_year, bulk_records, bulk_values)) = \
+            runs
+        assert_equal(bulk_year, year)
+        assert_equal(len(bulk_records), len(records))
+        for field in records.dtype.names:
+            assert_true(np.array_equal(bulk_records[field], records[field]))
+        for (bulk_value, value) in zip(bulk_values, values):
+            assert_true(np.array_equal(bulk_value, value))
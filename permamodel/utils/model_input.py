@@ -11,6 +11,8 @@
 #  read_scalar()
 #  read_grid()
 #  close_file()
+#  load_time_series()
+#  TimeSeries  (class)
 """
 *The MIT License (MIT)*
 Copyright (c) 2016 permamodel
@@ -74,7 +76,7 @@ def open_file(var_type, input_file):
         # Input file contains a time series and
         # is ASCII text with one value per line.
         #-----------------------------------------
-        file_unit = open(input_file, 'r')
+        file_unit = TimeSeries(input_file)
     else:
         #--------------------------------------------
         # Input file contains a grid or grid stack
@@ -300,6 +302,13 @@ def read_scalar(file_unit, dtype='Float32'):
     # scalar = fromfile(file_unit, count=1, dtype=dtype, sep=" ")
     # scalar = loadtxt(file_unit, dtype=dtype)
 
+    #----------------------------------------------------
+    # A TimeSeries was loaded whole by open_file(), so no
+    # reading or parsing is needed here
+    #----------------------------------------------------
+    if isinstance(file_unit, TimeSeries):
+        return file_unit.read_next()
+
     line = file_unit.readline()
     line = line.strip()
 ##    print 'line =', line
@@ -355,6 +364,88 @@ def close_file(file_unit):
 
 #   close_file()
 #-------------------------------------------------------------------
+def load_time_series(input_file, dtype='float32', save_npy=False):
+
+    #--------------------------------------------------------
+    # Notes:  An ASCII time series has one value per line
+    #         (only the first column is used).  The whole
+    #         file is loaded at once with numpy.loadtxt().
+    #
+    #         A ".npy" file is loaded directly.  Otherwise,
+    #         if "<input_file>.npy" exists and is not older
+    #         than input_file, it is loaded instead of parsing
+    #         the text again.  With save_npy=True, the parsed
+    #         values are saved there for the next run.
+    #--------------------------------------------------------
+    if input_file.endswith('.npy'):
+        return numpy.asarray(numpy.load(input_file), dtype=dtype).ravel()
+
+    npy_file = input_file + '.npy'
+    if os.path.exists(npy_file) and \
+       (os.path.getmtime(npy_file) >= os.path.getmtime(input_file)):
+        return numpy.asarray(numpy.load(npy_file), dtype=dtype).ravel()
+
+    values = numpy.loadtxt(input_file, dtype=dtype, usecols=(0,), ndmin=1)
+
+    if (save_npy):
+        try:
+            numpy.save(npy_file, values)
+        except IOError:
+            # (e.g. a read-only input directory)
+            pass
+
+    return values
+
+#   load_time_series()
+#-------------------------------------------------------------------
+class TimeSeries(object):
+
+    #--------------------------------------------------------
+    # Notes:  A time series input held in memory, used as
+    #         the "file_unit" of Time_Series inputs.  Values
+    #         are served in order by read_next(), like lines
+    #         read from the file, or by index with read_at()
+    #         for random access.  read_next() returns None
+    #         after the last value, as read_scalar() does at
+    #         the end of a file.
+    #--------------------------------------------------------
+    def __init__(self, input_file, dtype='float32', save_npy=False):
+
+        self.name   = input_file
+        self.values = load_time_series(input_file, dtype=dtype,
+                                       save_npy=save_npy)
+        self.index  = 0
+
+    def __len__(self):
+
+        return len(self.values)
+
+    def read_next(self):
+
+        if (self.index >= len(self.values)):
+            return None
+        value = self.values[self.index]
+        self.index += 1
+        return value
+
+    def read_at(self, index):
+
+        return self.values[index]
+
+    def seek(self, index):
+
+        #------------------------------------------
+        # The next call to read_next() will return
+        # the value with this (0-based) index
+        #------------------------------------------
+        self.index = index
+
+    def close(self):
+
+        self.values = None
+
+#   TimeSeries
+#-------------------------------------------------------------------
 
 
 
@@ -0,0 +1,363 @@
+#-------------------------------------------------------------------
+#  Grid stack output in NetCDF format
+#
+#  Output grids are appended one timestep at a time along an
+#  unlimited time dimension, so a model never needs to hold
+#  its whole run in memory and a crash only loses the current
+#  timestep.
+#-------------------------------------------------------------------
+#
+#  open_new_gs_file()
+#  add_grid()
+#  add_grids()
+#  close_gs_file()
+#  AsyncGridWriter  (class)
+#  merge_grid_files()
+#
+"""
+*The MIT License (MIT)*
+Copyright (c) 2016 permamodel
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+#-------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+from netCDF4 import Dataset
+
+#-------------------------------------------------------------------
+#  The NetCDF library is not thread-safe, so threads that read or
+#  write NetCDF files in this process share this lock.
+#-------------------------------------------------------------------
+netcdf_lock = threading.RLock()
+
+#-------------------------------------------------------------------
+def open_new_gs_file(file_name, var_name, lat, lon,
+                     long_name='', units_name='', time_units='Year',
+                     fill_value=-999.99, complevel=4):
+
+    #----------------------------------------------------------
+    # Notes: The time dimension is unlimited and the data
+    #        variable is chunked as (1, n_lat, n_lon), so that
+    #        each call to add_grid() writes exactly one chunk.
+    #        NaNs are stored as fill_value, which is recorded
+    #        as the "missing_value" attribute.
+    #----------------------------------------------------------
+    n_lat = np.size(lat)
+    n_lon = np.size(lon)
+
+    ncid = Dataset(file_name, 'w', format='NETCDF4')
+
+    # ==== Latitude ====
+    ncid.createDimension('lat', n_lat)
+    lats = ncid.createVariable('lat', np.dtype('float32').char, ('lat',))
+    lats.units = 'degrees_north'
+    lats.standard_name = 'latitude'
+    lats.long_name = 'latitude'
+    lats.axis = 'Y'
+    lats[:] = lat
+
+    # ==== Longitude ====
+    ncid.createDimension('lon', n_lon)
+    lons = ncid.createVariable('lon', np.dtype('float32').char, ('lon',))
+    lons.units = 'degrees_east'
+    lons.standard_name = 'longitude'
+    lons.long_name = 'longitude'
+    lons.axis = 'X'
+    lons[:] = lon
+
+    # ==== Time (unlimited) ====
+    ncid.createDimension('time', None)
+    time = ncid.createVariable('time', np.dtype('float32').char, ('time',))
+    time.units = time_units
+    time.axis = 'Z'
+
+    # ==== Data ====
+    data = ncid.createVariable(var_name, np.dtype('float32').char,
+                               ('time', 'lat', 'lon'),
+                               zlib=(complevel > 0),
+                               complevel=max(complevel, 1),
+                               chunksizes=(1, n_lat, n_lon))
+    data.units = units_name
+    data.missing_value = np.float32(fill_value)
+    data.long_name = long_name
+
+    return ncid
+
+#   open_new_gs_file()
+#-------------------------------------------------------------------
+def add_grid(ncid, grid, var_name, time_value):
+
+    #--------------------------------------------------
+    # Append one (n_lat, n_lon) grid at the end of the
+    # time axis.  Only this grid is copied to replace
+    # NaNs with the missing value.
+    #--------------------------------------------------
+    data = ncid.variables[var_name]
+    time = ncid.variables['time']
+    n_lat = len(ncid.dimensions['lat'])
+    n_lon = len(ncid.dimensions['lon'])
+
+    grid = np.reshape(np.asarray(grid, dtype='float32'), (n_lat, n_lon))
+    grid = np.where(np.isnan(grid), np.float32(data.missing_value), grid)
+
+    time_index = len(time)
+    time[time_index] = time_value
+    data[time_index, :, :] = grid
+
+    #------------------------------------------
+    # Flush so that a crash later in the run
+    # does not lose the timesteps written here
+    #------------------------------------------
+    ncid.sync()
+
+#   add_grid()
+#-------------------------------------------------------------------
+def add_grids(ncid, grids, var_name, time_values):
+
+    #--------------------------------------------------
+    # Append (n_time, n_lat, n_lon) grids, one for
+    # each of time_values, with a single write and
+    # a single sync (see add_grid())
+    #--------------------------------------------------
+    data = ncid.variables[var_name]
+    time = ncid.variables['time']
+    n_lat = len(ncid.dimensions['lat'])
+    n_lon = len(ncid.dimensions['lon'])
+    n_time = len(time_values)
+
+    grids = np.reshape(np.asarray(grids, dtype='float32'),
+                       (n_time, n_lat, n_lon))
+    grids = np.where(np.isnan(grids), np.float32(data.missing_value), grids)
+
+    time_index = len(time)
+    time[time_index:time_index + n_time] = time_values
+    data[time_index:time_index + n_time, :, :] = grids
+    ncid.sync()
+
+#   add_grids()
+#-------------------------------------------------------------------
+def close_gs_file(ncid):
+
+    if (ncid is not None):
+        ncid.close()
+
+#   close_gs_file()
+#-------------------------------------------------------------------
+class AsyncGridWriter(object):
+
+    #--------------------------------------------------------
+    # Notes:  Writes slices of the variables of an open
+    #         NetCDF file on a background thread, so that
+    #         compression and I/O overlap with the model.
+    #
+    #         write() copies the values into a bounded queue
+    #         (it blocks while the queue is full).  The thread
+    #         takes whatever is queued, up to batch_size
+    #         items, and writes consecutive time indices of a
+    #         variable with a single call.  An error in the
+    #         thread is raised by the next write() or by
+    #         close(), which also waits for the queue to be
+    #         written.  The file itself is not closed.
+    #--------------------------------------------------------
+    def __init__(self, ncid, max_queued=8, batch_size=16):
+
+        self.ncid       = ncid
+        self.batch_size = batch_size
+        self.queue      = queue.Queue(maxsize=max_queued)
+        self.error      = None
+        self.thread     = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, var_name, index, values):
+
+        #-------------------------------------------------
+        # index is a time index (int) or a slice of them
+        #-------------------------------------------------
+        self.check_error()
+        self.queue.put((var_name, index, np.array(values)))
+
+    def close(self):
+
+        if (self.thread is not None):
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.check_error()
+
+    def check_error(self):
+
+        if (self.error is not None):
+            error = self.error
+            self.error = None
+            raise error
+
+    def run(self):
+
+        finished = False
+        while not finished:
+            items = [self.queue.get()]
+            while (items[-1] is not None) and \
+                  (len(items) < self.batch_size):
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if (items[-1] is None):
+                finished = True
+                items.pop()
+
+            #-------------------------------------------
+            # After an error, the rest is not written
+            # but the queue is still drained
+            #-------------------------------------------
+            if (self.error is None) and items:
+                try:
+                    self.write_batch(items)
+                except Exception as error:
+                    self.error = error
+
+    def write_batch(self, items):
+
+        #-----------------------------------------------
+        # Group by variable, keeping the order of each
+        # variable's writes, and join runs of
+        # consecutive time indices into one write
+        #-----------------------------------------------
+        by_variable = OrderedDict()
+        for (var_name, index, values) in items:
+            runs = by_variable.setdefault(var_name, [])
+            if runs and isinstance(index, int) and \
+               isinstance(runs[-1][0], int) and \
+               (index == runs[-1][0] + len(runs[-1][1])):
+                runs[-1][1].append(values)
+            elif isinstance(index, int):
+                runs.append((index, [values]))
+            else:
+                runs.append((index, values))
+
+        with netcdf_lock:
+            for (var_name, runs) in by_variable.items():
+                var = self.ncid.variables[var_name]
+                for (index, values) in runs:
+                    if isinstance(index, int):
+                        var[index:index + len(values)] = np.array(values)
+                    else:
+                        var[index] = values
+
+#   AsyncGridWriter
+#-------------------------------------------------------------------
+def merge_grid_files(tile_files, offsets, output_file,
+                     y_dim='lat', x_dim='lon', shape=None):
+
+    #--------------------------------------------------------
+    # Notes:  Reassembles the output files of tiles of a grid
+    #         into one file.  offsets holds the (j0, i0) of
+    #         each tile in the whole grid and shape its size
+    #         (by default, just large enough for the tiles).
+    #
+    #         Variables with y_dim or x_dim (including 1-D
+    #         coordinates) are placed at each tile's offset;
+    #         other variables and the attributes are copied
+    #         from the first tile.  Every cell of the grid
+    #         must come from exactly one tile.
+    #--------------------------------------------------------
+    tiles = [Dataset(tile_file, 'r') for tile_file in tile_files]
+    try:
+        tile_shapes = [(len(tile.dimensions[y_dim]),
+                        len(tile.dimensions[x_dim])) for tile in tiles]
+        if (shape is None):
+            shape = (max([j0 + ny for ((j0, i0), (ny, nx))
+                          in zip(offsets, tile_shapes)]),
+                     max([i0 + nx for ((j0, i0), (ny, nx))
+                          in zip(offsets, tile_shapes)]))
+
+        coverage = np.zeros(shape, dtype='int32')
+        for ((j0, i0), (ny, nx)) in zip(offsets, tile_shapes):
+            coverage[j0:j0 + ny, i0:i0 + nx] += 1
+        if not np.all(coverage == 1):
+            raise ValueError('Tiles of %s do not cover the %s grid once'
+                             % (output_file, str(shape)))
+
+        first = tiles[0]
+        ncid = Dataset(output_file, 'w', format='NETCDF4')
+        try:
+            ncid.setncatts(dict([(name, first.getncattr(name))
+                                 for name in first.ncattrs()]))
+            for (name, dim) in first.dimensions.items():
+                if (name == y_dim):
+                    ncid.createDimension(name, shape[0])
+                elif (name == x_dim):
+                    ncid.createDimension(name, shape[1])
+                elif dim.isunlimited():
+                    ncid.createDimension(name, None)
+                else:
+                    ncid.createDimension(name, len(dim))
+
+            gridded = []
+            for (name, var) in first.variables.items():
+                filters = var.filters() or {}
+                sizes = dict([(y_dim, shape[0]), (x_dim, shape[1])])
+                chunking = var.chunking()
+                if isinstance(chunking, list):
+                    chunking = [sizes.get(dim, size) for (dim, size)
+                                in zip(var.dimensions, chunking)]
+                else:
+                    chunking = None
+                attributes = dict([(attr, var.getncattr(attr))
+                                   for attr in var.ncattrs()])
+                fill_value = attributes.pop('_FillValue', None)
+                out = ncid.createVariable(
+                    name, var.dtype, var.dimensions,
+                    zlib=filters.get('zlib', False),
+                    complevel=filters.get('complevel', 4) or 4,
+                    chunksizes=chunking, fill_value=fill_value)
+                out.setncatts(attributes)
+                if (y_dim in var.dimensions) or (x_dim in var.dimensions):
+                    gridded.append(name)
+                else:
+                    out[:] = var[:]
+
+            for (tile, (j0, i0), (ny, nx)) in \
+                    zip(tiles, offsets, tile_shapes):
+                for name in gridded:
+                    var = tile.variables[name]
+                    index = []
+                    for (dim, size) in zip(var.dimensions, var.shape):
+                        if (dim == y_dim):
+                            index.append(slice(j0, j0 + ny))
+                        elif (dim == x_dim):
+                            index.append(slice(i0, i0 + nx))
+                        else:
+                            index.append(slice(0, size))
+                    ncid.variables[name][tuple(index)] = var[:]
+        finally:
+            ncid.close()
+    finally:
+        for tile in tiles:
+            tile.close()
+
+#   merge_grid_files()
+#-------------------------------------------------------------------
@@ -0,0 +1,113 @@
+#-------------------------------------------------------------------
+#  Least-recently-used cache of grid slices read from files
+#
+#  Components that read the same time slices of a large input file
+#  more than once (overlapping runs, replays, several instances in
+#  one process) can keep them here instead of reading them again.
+#  The cache is bounded by the total size of the arrays it holds.
+#-------------------------------------------------------------------
+#
+#  SliceCache  (class)
+#  shared_cache
+#
+"""
+*The MIT License (MIT)*
+Copyright (c) 2016 permamodel
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+*
+"""
+#-------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+#-------------------------------------------------------------------
+class SliceCache(object):
+
+    #--------------------------------------------------------
+    # Notes:  Keys are any hashable description of a slice,
+    #         e.g. (file, variable, t_index, window).  The
+    #         arrays are stored read-only and get() returns a
+    #         copy, so callers may modify what they receive.
+    #         When the total size would exceed max_bytes, the
+    #         least recently used slices are evicted.  An
+    #         array larger than max_bytes is never stored.
+    #--------------------------------------------------------
+    def __init__(self, max_bytes=256 * 2**20):
+
+        self.max_bytes = max_bytes
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.slices    = OrderedDict()
+        self.lock      = threading.Lock()
+
+    def __len__(self):
+
+        return len(self.slices)
+
+    def __contains__(self, key):
+
+        return key in self.slices
+
+    def get(self, key):
+
+        #--------------------------------------------
+        # Return a copy of the cached slice, or None
+        #--------------------------------------------
+        with self.lock:
+            array = self.slices.pop(key, None)
+            if (array is None):
+                self.misses += 1
+                return None
+            self.slices[key] = array   # (now the most recent)
+            self.hits += 1
+        return array.copy()
+
+    def put(self, key, array):
+
+        array = np.array(array)   # (a private copy)
+        array.flags.writeable = False
+        if (array.nbytes > self.max_bytes):
+            return
+
+        with self.lock:
+            old = self.slices.pop(key, None)
+            if (old is not None):
+                self.nbytes -= old.nbytes
+            while self.slices and \
+                  (self.nbytes + array.nbytes > self.max_bytes):
+                (_, evicted) = self.slices.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+            self.slices[key] = array
+            self.nbytes += array.nbytes
+
+    def clear(self):
+
+        with self.lock:
+            self.slices.clear()
+            self.nbytes = 0
+            self.hits   = 0
+            self.misses = 0
+
+#   SliceCache
+#-------------------------------------------------------------------
+#  One cache shared by all components in this process
+#-------------------------------------------------------------------
+shared_cache = SliceCache()
+